@@ -6,6 +6,7 @@ load_dotenv()
 # LLM config
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_MODEL = "gemini-2.5-flash"
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")  # gemini | stub (LLM giả lập cho benchmark offline)
 # GEMINI_EMBEDDING_MODEL = "gemini-embedding-001"
 
 # Vector DB config (Qdrant)
@@ -14,6 +15,25 @@ QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 QDRANT_COLLECTION_NAME = os.getenv("QDRANT_COLLECTION_NAME")
 QDRANT_VECTOR_SIZE = int(os.getenv("QDRANT_VECTOR_SIZE", 768))  # embedding size
 QDRANT_BATCH_SIZE = int(os.getenv("QDRANT_BATCH_SIZE", 64))  # Batch size for ingestion
+QDRANT_COPY_BATCH_SIZE = int(os.getenv("QDRANT_COPY_BATCH_SIZE", 1000))  # Số point mỗi lần scroll/upsert khi fork session
+HNSW_M = int(os.getenv("HNSW_M", 16))  # Số cạnh mỗi node trong đồ thị HNSW khi tạo collection
+HNSW_EF_CONSTRUCT = int(os.getenv("HNSW_EF_CONSTRUCT", 100))  # Độ rộng tìm kiếm khi build HNSW
+
+# Embedding config
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "bkai-foundation-models/vietnamese-bi-encoder")
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "huggingface")  # huggingface | onnx | stub | remote
+EMBEDDING_MAX_LENGTH = int(os.getenv("EMBEDDING_MAX_LENGTH", 256))  # Số token tối đa mỗi text khi embed
+EMBEDDING_MICRO_BATCHING = os.getenv("EMBEDDING_MICRO_BATCHING", "true").lower() == "true"  # Gom embed_query đồng thời thành 1 batch
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", 3))  # Thời gian chờ gom thêm query sau query đầu tiên
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", 32))  # Số query tối đa mỗi batch
+EMBEDDING_SOCKET_PATH = os.getenv("EMBEDDING_SOCKET_PATH", "/tmp/rag_embedding.sock")  # Unix socket của embedding sidecar (EMBEDDING_PROVIDER=remote)
+EMBEDDING_CONNECT_TIMEOUT = float(os.getenv("EMBEDDING_CONNECT_TIMEOUT", 60))  # Thời gian chờ sidecar sẵn sàng (giây)
+
+# ONNX embedding config (EMBEDDING_PROVIDER=onnx)
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "models/vietnamese-bi-encoder-onnx")  # Thư mục chứa model đã export
+ONNX_QUANTIZE = os.getenv("ONNX_QUANTIZE", "true").lower() == "true"  # Dùng bản int8 dynamic quantization
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", 0))  # Số thread mỗi phép tính (0: onnxruntime tự chọn)
+ONNX_BATCH_SIZE = int(os.getenv("ONNX_BATCH_SIZE", 32))  # Batch size khi embed nhiều text
 
 # Redis config
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
@@ -22,14 +42,97 @@ REDIS_DB = int(os.getenv("REDIS_DB", 0))
 # Chunking config
 CHUNK_SIZE = 1024
 
+# Upload config
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))  # Số byte đọc/ghi mỗi lần khi stream file upload
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR") or None  # Thư mục temp file upload (mặc định: temp của hệ thống)
+MAX_UPLOAD_FILE_MB = float(os.getenv("MAX_UPLOAD_FILE_MB", 50))  # Dung lượng tối đa mỗi file
+MAX_SESSION_UPLOAD_MB = float(os.getenv("MAX_SESSION_UPLOAD_MB", 200))  # Tổng dung lượng tài liệu tối đa mỗi session
+
 # Chat summary config
 SUMMARY_EVERY_N = int(os.getenv("SUMMARY_EVERY_N", 10))  # Số lượt chat để tự động summarize
 
 # Session config (đơn giản, không cần auth)
 SESSION_EXPIRE_HOURS = int(os.getenv("SESSION_EXPIRE_HOURS", 24))
 
+# History/response config
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 50))  # Số lượt chat mặc định mỗi trang /history
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", 200))  # Giới hạn `limit` của /history
+GZIP_MIN_SIZE = int(os.getenv("GZIP_MIN_SIZE", 1024))  # Nén gzip response lớn hơn N byte (0: tắt)
+
 # Vector search config
 TOP_K = int(os.getenv("TOP_K", 3))  # Số lượng chunk trả về khi truy vấn
 SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", 10)) # số lượng vector để search đồng thời
+SEARCH_HNSW_EF = int(os.getenv("SEARCH_HNSW_EF", 0))  # ef cố định khi search (0: để policy adaptive/Qdrant quyết định)
+SEARCH_ADAPTIVE_EF = os.getenv("SEARCH_ADAPTIVE_EF", "true").lower() == "true"  # Chọn ef theo kích thước collection và latency target
+SEARCH_EXACT_THRESHOLD = int(os.getenv("SEARCH_EXACT_THRESHOLD", 1000))  # Collection <= N points thì search exact (brute-force)
+if SEARCH_EXACT_THRESHOLD < 1:
+    raise ValueError(f"SEARCH_EXACT_THRESHOLD phải >= 1 (hiện tại: {SEARCH_EXACT_THRESHOLD})")
+SEARCH_LATENCY_TARGET_MS = float(os.getenv("SEARCH_LATENCY_TARGET_MS", 50))  # Latency mục tiêu cho 1 lần search
+SEARCH_EF_MIN = int(os.getenv("SEARCH_EF_MIN", 16))
+SEARCH_EF_MAX = int(os.getenv("SEARCH_EF_MAX", 512))
+SEARCH_SCORE_THRESHOLD = float(os.getenv("SEARCH_SCORE_THRESHOLD")) if os.getenv("SEARCH_SCORE_THRESHOLD") else None  # Bỏ kết quả có cosine thấp hơn ngưỡng
+MMR_ENABLED = os.getenv("MMR_ENABLED", "false").lower() == "true"  # Chọn TOP_K chunk đa dạng (MMR) thay vì top-k theo score
+MMR_FETCH_K = int(os.getenv("MMR_FETCH_K", 20))  # Số candidate lấy từ Qdrant (kèm vector) để chọn MMR
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", 0.5))  # 1: chỉ xét relevance, 0: chỉ xét đa dạng
+LOCAL_INDEX_ENABLED = os.getenv("LOCAL_INDEX_ENABLED", "true").lower() == "true"  # Search collection nhỏ bằng NumPy trong process
+LOCAL_INDEX_MAX_POINTS = int(os.getenv("LOCAL_INDEX_MAX_POINTS", 5000))  # Collection lớn hơn thì search trên Qdrant
+LOCAL_INDEX_MAX_MB = float(os.getenv("LOCAL_INDEX_MAX_MB", 256))  # Tổng RAM cho local index mỗi worker (LRU)
+PARENT_CHILD_INDEXING = os.getenv("PARENT_CHILD_INDEXING", "false").lower() == "true"  # Embed child chunk nhỏ, đưa parent passage vào prompt
+CHILD_CHUNK_SIZE = int(os.getenv("CHILD_CHUNK_SIZE", 300))  # Số ký tự mỗi child chunk
+CHILD_CHUNK_OVERLAP = int(os.getenv("CHILD_CHUNK_OVERLAP", 50))  # Số ký tự chồng lấn giữa các child chunk
+TEXT_COMPRESSION = os.getenv("TEXT_COMPRESSION", "none")  # Codec mặc định cho text payload của collection mới: none | zstd
+TEXT_COMPRESSION_LEVEL = int(os.getenv("TEXT_COMPRESSION_LEVEL", 9))  # Mức nén zstd
+TEXT_DICT_SIZE = int(os.getenv("TEXT_DICT_SIZE", 16384))  # Kích thước (byte) dictionary zstd train từ chunk của collection
+TEXT_DICT_MIN_SAMPLES = int(os.getenv("TEXT_DICT_MIN_SAMPLES", 32))  # Ít chunk hơn thì nén không dùng dictionary
+
+REWRITE_HISTORY_M = int(os.getenv("REWRITE_HISTORY_M", 3))  # Số lịch sử dùng để rewrite query
+
+# LLM scheduler config (giới hạn tính theo từng worker: chia tổng quota cho số worker)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))  # Số lời gọi LLM chạy đồng thời tối đa
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", 250000))  # Quota tokens/phút (0: không giới hạn)
+LLM_MAX_QUEUE_SECONDS = float(os.getenv("LLM_MAX_QUEUE_SECONDS", 10))  # Chờ slot quá lâu thì trả 503
+LLM_MAX_QUEUE_DEPTH = int(os.getenv("LLM_MAX_QUEUE_DEPTH", 200))  # Hàng đợi đầy thì trả 503 ngay
+LLM_MAX_QUEUED_PER_SESSION = int(os.getenv("LLM_MAX_QUEUED_PER_SESSION", 20))  # Một session chờ quá nhiều thì trả 429
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", 256))  # Token output ước lượng để trừ quota
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", 30))  # Deadline mỗi lời gọi LLM (tính từ lúc được cấp slot)
+LLM_HEDGING = os.getenv("LLM_HEDGING", "true").lower() == "true"  # Gửi lời gọi dự phòng khi lời gọi chính chậm bất thường
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 95))  # Chậm hơn percentile này của latency gần đây thì hedge
+LLM_HEDGE_MAX_RATE = float(os.getenv("LLM_HEDGE_MAX_RATE", 0.1))  # Số hedge tối đa trên mỗi lời gọi (chặn chi phí)
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))  # Số mẫu latency tối thiểu trước khi bật hedge
+LLM_HEDGE_MIN_DELAY_MS = float(os.getenv("LLM_HEDGE_MIN_DELAY_MS", 200))  # Không hedge sớm hơn mức này
+REQUEST_COALESCING = os.getenv("REQUEST_COALESCING", "true").lower() == "true"  # Gộp các lời gọi LLM/embed_query giống hệt đang chạy đồng thời
+
+# Context assembly config
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 2048))  # Số token tối đa cho phần tài liệu tham khảo trong prompt
+DEDUP_SIMILARITY_THRESHOLD = float(os.getenv("DEDUP_SIMILARITY_THRESHOLD", 0.8))  # Ngưỡng overlap để coi 2 chunk là trùng
+DEDUP_SHINGLE_SIZE = int(os.getenv("DEDUP_SHINGLE_SIZE", 3))  # Số từ mỗi shingle khi so sánh chunk
+
+# Query rewrite gating/cache config
+REWRITE_GATE_ENABLED = os.getenv("REWRITE_GATE_ENABLED", "true").lower() == "true"  # Bỏ qua rewrite với câu hỏi tự đủ nghĩa
+REWRITE_GATE_MIN_WORDS = int(os.getenv("REWRITE_GATE_MIN_WORDS", 3))  # Số từ nội dung tối thiểu để coi câu hỏi là tự đủ nghĩa
+REWRITE_GATE_OVERLAP_THRESHOLD = float(os.getenv("REWRITE_GATE_OVERLAP_THRESHOLD", 0.5))  # Tỉ lệ từ trùng với câu hỏi trước để vẫn rewrite
+REWRITE_CACHE_TTL = int(os.getenv("REWRITE_CACHE_TTL", 24 * 3600))  # Thời gian giữ cache rewrite (giây)
+
+# Answer/retrieval cache config (key gắn với version tập tài liệu của session, 0: tắt cache)
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", 24 * 3600))  # Thời gian giữ câu trả lời cho cùng prompt (giây)
+RETRIEVAL_CACHE_TTL = int(os.getenv("RETRIEVAL_CACHE_TTL", 3600))  # Thời gian giữ kết quả retrieval cho cùng câu hỏi (giây)
+
+# Speculative retrieval config
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "false").lower() == "true"  # Retrieval câu hỏi gốc song song với rewrite
+SPECULATION_SIMILARITY_THRESHOLD = float(os.getenv("SPECULATION_SIMILARITY_THRESHOLD", 0.92))  # Cosine tối thiểu để dùng lại kết quả speculative
+
+# Debug/profiling config
+DEBUG_PROFILING_ENABLED = os.getenv("DEBUG_PROFILING_ENABLED", "false").lower() == "true"  # Cho phép `X-Debug: profile` chạy cProfile
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/rag_profiles")  # Nơi lưu file .prof của các request được profile
+PROFILE_MAX_FILES = max(int(os.getenv("PROFILE_MAX_FILES", 50)), 1)  # Số file .prof giữ lại, file cũ nhất bị xóa
+
+# Stub LLM/embedding config (chỉ dùng khi LLM_PROVIDER/EMBEDDING_PROVIDER=stub)
+STUB_LLM_LATENCY_MS = float(os.getenv("STUB_LLM_LATENCY_MS", 800))  # Latency cơ bản mỗi lần gọi
+STUB_LLM_JITTER = float(os.getenv("STUB_LLM_JITTER", 0.3))  # Sigma của hệ số lognormal nhân vào latency
+STUB_LLM_TOKENS_PER_SECOND = float(os.getenv("STUB_LLM_TOKENS_PER_SECOND", 200))  # Tốc độ sinh token giả lập
+STUB_LLM_OUTPUT_TOKENS = int(os.getenv("STUB_LLM_OUTPUT_TOKENS", 60))  # Số token output giả lập
+STUB_EMBEDDING_LATENCY_MS = float(os.getenv("STUB_EMBEDDING_LATENCY_MS", 0))  # Latency giả lập mỗi text được embed
 
-REWRITE_HISTORY_M = int(os.getenv("REWRITE_HISTORY_M", 3))  # Số lịch sử dùng để rewrite query
\ No newline at end of file
+# Startup config
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"  # Khởi tạo model + embedding giả ngay khi worker start
+WARMUP_RETRY_SECONDS = max(float(os.getenv("WARMUP_RETRY_SECONDS", 5)), 1)  # Thời gian chờ trước khi thử warmup lại (nhân đôi mỗi lần lỗi)
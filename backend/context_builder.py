@@ -0,0 +1,124 @@
+import hashlib
+import re
+from .config import CONTEXT_TOKEN_BUDGET, DEDUP_SIMILARITY_THRESHOLD, DEDUP_SHINGLE_SIZE
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_PUNCT_RE = re.compile(r"[^\w\s]", re.UNICODE)
+
+# Hệ số token/từ ước lượng cho tiếng Việt (mỗi âm tiết ~1.3 token với tokenizer của Gemini)
+TOKENS_PER_WORD = 1.3
+
+
+def estimate_tokens(text):
+    """Ước lượng nhanh số token của text (không gọi tokenizer/API)"""
+    if not text:
+        return 0
+    n_words = len(_WORD_RE.findall(text))
+    n_punct = len(_PUNCT_RE.findall(text))
+    # Chuỗi dài không có khoảng trắng (URL, công thức...) thì fallback ~4 ký tự/token
+    return max(int(n_words * TOKENS_PER_WORD) + n_punct, len(text) // 4)
+
+
+def _normalize(text):
+    return " ".join(_WORD_RE.findall(text.lower()))
+
+
+def _shingles(words, size=DEDUP_SHINGLE_SIZE):
+    if len(words) <= size:
+        return {tuple(words)}
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def deduplicate_chunks(docs, threshold=DEDUP_SIMILARITY_THRESHOLD):
+    """Loại bỏ chunk trùng lặp hoặc gần trùng (overlap) dựa trên word shingles.
+
+    Giữ nguyên thứ tự relevance của retriever: chunk đứng trước được ưu tiên giữ lại.
+    Một chunk bị loại nếu trùng hoàn toàn, hoặc phần lớn shingles của nó đã nằm
+    trong một chunk đã giữ (containment >= threshold).
+    """
+    kept = []
+    kept_shingles = []
+    seen_hashes = set()
+    for doc in docs:
+        normalized = _normalize(doc.page_content)
+        if not normalized:
+            continue
+        digest = hashlib.md5(normalized.encode()).hexdigest()
+        if digest in seen_hashes:
+            continue
+        shingles = _shingles(normalized.split())
+        is_duplicate = False
+        for other in kept_shingles:
+            overlap = len(shingles & other)
+            # containment theo chunk nhỏ hơn để bắt được chunk bị bao trong chunk khác
+            if overlap / min(len(shingles), len(other)) >= threshold:
+                is_duplicate = True
+                break
+        if is_duplicate:
+            continue
+        seen_hashes.add(digest)
+        kept.append(doc)
+        kept_shingles.append(shingles)
+    return kept
+
+
+def _truncate_to_budget(text, budget):
+    """Prefix dài nhất của text có estimate_tokens <= budget, cắt ở ranh giới từ nếu được.
+
+    estimate_tokens không giảm khi prefix dài thêm nên tìm nhị phân theo số ký tự.
+    """
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    cut = text[:low]
+    if low < len(text) and not text[low].isspace() and len(cut.split()) > 1:
+        cut = cut.rsplit(None, 1)[0]
+    return cut.strip()
+
+
+def _document_position(item):
+    rank, doc = item
+    metadata = doc.metadata or {}
+    page = metadata.get("page", 0)
+    return (str(metadata.get("source", "")), page if isinstance(page, int) else 0, rank)
+
+
+def assemble_context(docs, budget=CONTEXT_TOKEN_BUDGET):
+    """Dedup, đóng gói chunk vào token budget và ghép thành context cho prompt.
+
+    Chunk được chọn tham lam theo thứ tự relevance; sau đó sắp xếp lại theo vị trí
+    trong tài liệu (source, page) để LLM đọc liền mạch.
+    Trả về (context, selected_docs, context_tokens); selected_docs là Document mới,
+    không sửa Document của caller (có thể đang được cache dùng chung).
+    """
+    from langchain.docstore.document import Document
+
+    unique_docs = deduplicate_chunks(docs)
+    selected = []
+    used_tokens = 0
+    for rank, doc in enumerate(unique_docs):
+        text = doc.page_content.strip()
+        tokens = estimate_tokens(text)
+        remaining = budget - used_tokens
+        if tokens > remaining:
+            if selected:
+                # Bỏ qua chunk quá lớn, thử chunk tiếp theo có thể vừa budget
+                continue
+            # Chunk tốt nhất lớn hơn cả budget: cắt bớt thay vì trả về context rỗng
+            text = _truncate_to_budget(text, remaining)
+            tokens = estimate_tokens(text)
+        if tokens <= 0:
+            continue
+        selected.append((rank, Document(page_content=text, metadata=doc.metadata)))
+        used_tokens += tokens
+        if used_tokens >= budget:
+            break
+
+    selected.sort(key=_document_position)
+    selected_docs = [doc for _, doc in selected]
+    context = "\n\n".join(doc.page_content for doc in selected_docs)
+    return context, selected_docs, used_tokens
@@ -1,8 +1,9 @@
 import redis
+import base64
 import json
 import uuid
 from datetime import datetime
-from .config import REDIS_URL, REDIS_DB, SESSION_EXPIRE_HOURS
+from .config import REDIS_URL, REDIS_DB, SESSION_EXPIRE_HOURS, REWRITE_CACHE_TTL, ANSWER_CACHE_TTL, RETRIEVAL_CACHE_TTL
 
 # Redis client
 redis_client = redis.from_url(REDIS_URL, db=REDIS_DB, decode_responses=True)
@@ -49,24 +50,138 @@ def get_chat_history(session_id, limit=30):
             chats.append(chat_data)
     return chats
 
-def get_cache(prompt_hash):
+# Mọi cache theo session đều gắn "scope" = "{session_id}:{docset_version}".
+# Version tăng mỗi khi session thêm/xóa tài liệu nên cache cũ không bao giờ được đọc lại (tự hết hạn theo TTL).
+# Key cache của mỗi scope được ghi thêm vào set `cache_keys:{scope}` để xóa theo scope mà không cần SCAN keyspace.
+CACHE_INDEX_TTL = max(ANSWER_CACHE_TTL, RETRIEVAL_CACHE_TTL, REWRITE_CACHE_TTL, 1)
+
+def _set_scoped_cache(scope, key, ttl, value):
+    pipe = redis_client.pipeline()
+    pipe.setex(key, ttl, value)
+    pipe.sadd(f"cache_keys:{scope}", key)
+    pipe.expire(f"cache_keys:{scope}", CACHE_INDEX_TTL)
+    pipe.execute()
+
+def get_docset_version(session_id):
+    """Version của tập tài liệu trong session (0 nếu chưa upload gì)"""
+    return redis_client.get(f"session:{session_id}:docset_version") or "0"
+
+def get_cache_scope(session_id):
+    return f"{session_id}:{get_docset_version(session_id)}"
+
+def bump_docset_version(session_id):
+    """Tăng version sau mỗi lần upload/xóa tài liệu và dọn cache của version cũ.
+
+    Chỉ xóa các key đã ghi trong set của scope cũ (không SCAN). Blocking nên từ code async phải gọi qua
+    asyncio.to_thread.
+    """
+    version = redis_client.incr(f"session:{session_id}:docset_version")
+    delete_cache_for_session(session_id, version - 1)
+    return version
+
+def get_cache(scope, prompt_hash):
     """Lấy cache từ Redis"""
-    cache_data = redis_client.get(f"cache:{prompt_hash}")
+    cache_data = redis_client.get(f"cache:{scope}:{prompt_hash}")
     if cache_data:
         return json.loads(cache_data)
     return None
 
-def set_cache(prompt_hash, prompt, context, response):
-    """Lưu cache vào Redis (expire sau 24h)"""
+def set_cache(scope, prompt_hash, prompt, context, response):
+    """Lưu cache vào Redis (expire sau ANSWER_CACHE_TTL)"""
     cache_data = {
         "prompt": prompt,
         "context": context,
         "response": response,
         "created_at": datetime.now().isoformat()
     }
-    redis_client.setex(f"cache:{prompt_hash}", 24*3600, json.dumps(cache_data))
+    _set_scoped_cache(scope, f"cache:{scope}:{prompt_hash}", ANSWER_CACHE_TTL, json.dumps(cache_data))
     return cache_data
 
+def get_retrieval_cache(scope, key):
+    """Lấy danh sách chunk đã retrieve ([{page_content, metadata}]) từ cache"""
+    cache_data = redis_client.get(f"retrieval_cache:{scope}:{key}")
+    if cache_data:
+        return json.loads(cache_data)
+    return None
+
+def set_retrieval_cache(scope, key, docs):
+    _set_scoped_cache(scope, f"retrieval_cache:{scope}:{key}", RETRIEVAL_CACHE_TTL, json.dumps(docs, ensure_ascii=False))
+
+def get_rewrite_cache(scope, key):
+    """Lấy câu hỏi đã rewrite từ cache"""
+    return redis_client.get(f"rewrite_cache:{scope}:{key}")
+
+def set_rewrite_cache(scope, key, rewritten):
+    """Lưu câu hỏi đã rewrite vào cache"""
+    _set_scoped_cache(scope, f"rewrite_cache:{scope}:{key}", REWRITE_CACHE_TTL, rewritten)
+
+def get_document_locations(content_hash):
+    """Các bản đã ingest của một tài liệu (theo hash nội dung), dạng [(collection, document_id)]"""
+    members = redis_client.smembers(f"document_fingerprint:{content_hash}")
+    return [tuple(member.split("|", 1)) for member in members]
+
+def add_document_location(content_hash, collection_name, document_id, pipe=None):
+    """Ghi nhận tài liệu đã có vector trong collection để các lần upload sau dùng lại"""
+    (pipe or redis_client).sadd(f"document_fingerprint:{content_hash}", f"{collection_name}|{document_id}")
+
+def remove_document_location(content_hash, collection_name, document_id):
+    redis_client.srem(f"document_fingerprint:{content_hash}", f"{collection_name}|{document_id}")
+
+# Parent passage (parent-child indexing): một hash mỗi tài liệu trong collection, field = parent_id
+def set_parents(collection_name, document_id, parents):
+    """Lưu parent passage của một tài liệu: {parent_id: {"text" (hoặc "text_zstd"/"text_dict"): ..., "metadata": ...}}"""
+    if parents:
+        redis_client.hset(f"parents:{collection_name}:{document_id}", mapping={
+            parent_id: json.dumps(parent, ensure_ascii=False) for parent_id, parent in parents.items()
+        })
+
+def get_parents(collection_name, keys):
+    """Lấy parent theo [(document_id, parent_id)] trong một round trip, trả về {(document_id, parent_id): parent}"""
+    by_document = {}
+    for document_id, parent_id in keys:
+        by_document.setdefault(document_id, []).append(parent_id)
+    pipe = redis_client.pipeline(transaction=False)
+    for document_id, parent_ids in by_document.items():
+        pipe.hmget(f"parents:{collection_name}:{document_id}", parent_ids)
+    parents = {}
+    for (document_id, parent_ids), values in zip(by_document.items(), pipe.execute()):
+        for parent_id, value in zip(parent_ids, values):
+            if value:
+                parents[(document_id, parent_id)] = json.loads(value)
+    return parents
+
+def copy_parents(source_collection, source_document_id, target_collection, target_document_id):
+    """Copy parent passage khi copy vector của tài liệu (dedup/fork), copy phía server Redis"""
+    redis_client.copy(f"parents:{source_collection}:{source_document_id}",
+                      f"parents:{target_collection}:{target_document_id}", replace=True)
+
+def delete_parents(collection_name, document_id):
+    redis_client.delete(f"parents:{collection_name}:{document_id}")
+
+# Nén text payload theo collection: {"codec": "none"|"zstd", "dict_id": ...}
+def get_collection_codec(collection_name):
+    return redis_client.hgetall(f"collection:{collection_name}:text_codec")
+
+def set_collection_codec(collection_name, codec, dict_id=None):
+    """Chọn codec (chỉ lần đầu, không ghi đè) và gắn dictionary cho collection"""
+    key = f"collection:{collection_name}:text_codec"
+    redis_client.hsetnx(key, "codec", codec)
+    if dict_id:
+        redis_client.hset(key, "dict_id", dict_id)
+
+def copy_collection_codec(source_collection, target_collection, pipe=None):
+    settings = get_collection_codec(source_collection)
+    if settings:
+        (pipe or redis_client).hset(f"collection:{target_collection}:text_codec", mapping=settings)
+
+def save_dictionary(dict_id, data):
+    """Dictionary zstd theo dict_id (hash nội dung), dùng chung cho mọi collection có point nén bằng nó"""
+    redis_client.set(f"zstd_dict:{dict_id}", base64.b64encode(data).decode("ascii"))
+
+def load_dictionary(dict_id):
+    data = redis_client.get(f"zstd_dict:{dict_id}")
+    return base64.b64decode(data) if data else None
+
 def save_evaluation(chat_id, score, comment=""):
     """Lưu đánh giá vào Redis"""
     eval_id = str(uuid.uuid4())
@@ -100,14 +215,27 @@ def get_eval_stats():
     return {"num_eval": valid_evals, "avg_score": avg_score}
 
 def delete_chat_history(session_id):
-    key = f"chat:{session_id}:history"
-    if redis_client.exists(key):
-        redis_client.delete(key)
+    """Xóa list history và tăng epoch để các cursor phân trang đã trả về trở nên stale"""
+    pipe = redis_client.pipeline()
+    pipe.delete(f"chat:{session_id}:history")
+    pipe.incr(f"chat:{session_id}:history_epoch")
+    pipe.expire(f"chat:{session_id}:history_epoch", 3600 * 24 * 7)
+    pipe.execute()
 
-def delete_cache_for_session(session_id):
-    # Xóa cache theo session (nếu cache key có lưu session_id)
-    # Nếu cache key không lưu session_id, có thể bỏ qua hoặc implement thêm nếu cần
-    pass
+def delete_cache_for_session(session_id, version=None):
+    """Xóa cache answer/retrieval/rewrite của session (mặc định mọi version) theo set key của từng scope"""
+    if version is None:
+        versions = range(int(get_docset_version(session_id)) + 1)
+    else:
+        versions = [version]
+    deleted = 0
+    for v in versions:
+        index = f"cache_keys:{session_id}:{v}"
+        keys = list(redis_client.smembers(index))
+        for i in range(0, len(keys), 500):
+            deleted += redis_client.delete(*keys[i:i + 500])
+        redis_client.delete(index)
+    return deleted
 
 def delete_summary_for_session(session_id):
     key = f"summary:{session_id}"
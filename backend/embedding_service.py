@@ -0,0 +1,231 @@
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+from .config import (
+    EMBEDDING_PROVIDER, EMBEDDING_BATCH_WINDOW_MS, EMBEDDING_MAX_BATCH, EMBEDDING_SOCKET_PATH, EMBEDDING_CONNECT_TIMEOUT
+)
+from .metrics import EMBEDDING_BATCH_SIZE
+from .singleflight import SingleFlight
+
+
+class CoalescingEmbeddings:
+    """`embed_query` cùng text đang chạy đồng thời thì dùng chung một lần embed"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._flights = SingleFlight("embed_query")
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def embed_query(self, text):
+        return self._flights.do(text, self.backend.embed_query, text)
+
+    def embed_documents(self, texts):
+        return self.backend.embed_documents(texts)
+
+
+class BatchingEmbeddings:
+    """Gom các lời gọi `embed_query` đồng thời thành một forward pass batch.
+
+    Mỗi caller đưa text vào hàng đợi kèm một Future rồi chờ kết quả. Một worker thread lấy
+    request đầu tiên, gom thêm trong tối đa `window_ms` hoặc tới `max_batch` text, gọi
+    `embed_documents` một lần và trả từng vector về đúng Future của caller.
+    `embed_documents` (ingestion, chunking) đi thẳng xuống backend vì đã là batch.
+    """
+
+    def __init__(self, backend, window_ms=EMBEDDING_BATCH_WINDOW_MS, max_batch=EMBEDDING_MAX_BATCH):
+        self.backend = backend
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # Các thuộc tính khác (model_name, client...) lấy từ backend gốc
+        return getattr(self.backend, name)
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._worker_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._embed_batch(batch)
+            except Exception as e:
+                # Worker chết thì mọi embed_query sau đó treo: chỉ log và tiếp tục vòng lặp
+                print(f"[ERROR] Embedding batcher: {e}")
+
+    def _embed_batch(self, batch):
+        """Embed một batch; mọi Future của batch đều được resolve (vector hoặc exception)"""
+        EMBEDDING_BATCH_SIZE.observe(len(batch))
+        try:
+            vectors = list(self.backend.embed_documents([text for text, _ in batch]))
+            if len(vectors) != len(batch):
+                raise RuntimeError(f"Embedding backend trả về {len(vectors)} vector cho {len(batch)} text")
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def embed_query(self, text):
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+    def embed_documents(self, texts):
+        return self.backend.embed_documents(texts)
+
+
+# ---- Embedding sidecar: một process giữ weights, các uvicorn worker gọi qua Unix socket ----
+# Message: 4 byte độ dài (big-endian) + payload.
+# Request payload: JSON {"texts": [...]}.
+# Response payload: b"\x00" + (n, dim) uint32 + n*dim float32, hoặc b"\x01" + thông báo lỗi utf-8.
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Embedding socket closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+def _send_message(sock, payload):
+    sock.sendall(struct.pack("!I", len(payload)) + payload)
+
+def _recv_message(sock):
+    (size,) = struct.unpack("!I", _recv_exact(sock, 4))
+    return _recv_exact(sock, size)
+
+
+class RemoteEmbeddings:
+    """Client của embedding sidecar (EMBEDDING_PROVIDER=remote), mỗi thread giữ một kết nối riêng"""
+
+    def __init__(self, socket_path=EMBEDDING_SOCKET_PATH, connect_timeout=EMBEDDING_CONNECT_TIMEOUT):
+        self.socket_path = socket_path
+        self.connect_timeout = connect_timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.socket_path)
+                return sock
+            except OSError:
+                sock.close()
+                # Sidecar có thể đang load model khi worker khởi động -> chờ thêm
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.2)
+
+    def _request(self, texts):
+        payload = json.dumps({"texts": texts}, ensure_ascii=False).encode("utf-8")
+        for attempt in range(2):
+            sock = getattr(self._local, "sock", None)
+            if sock is None:
+                sock = self._local.sock = self._connect()
+            try:
+                _send_message(sock, payload)
+                response = _recv_message(sock)
+                break
+            except (ConnectionError, OSError):
+                # Kết nối cũ bị đóng (sidecar restart) -> mở lại một lần
+                sock.close()
+                self._local.sock = None
+                if attempt:
+                    raise
+        if response[:1] != b"\x00":
+            raise RuntimeError(f"Embedding sidecar error: {response[1:].decode('utf-8')}")
+        n, dim = struct.unpack("!II", response[1:9])
+        return np.frombuffer(response, dtype=np.float32, offset=9).reshape(n, dim).tolist()
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        return self._request(list(texts))
+
+    def embed_query(self, text):
+        return self._request([text])[0]
+
+
+class _EmbeddingRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        embedder = self.server.embedder
+        while True:
+            try:
+                request = json.loads(_recv_message(self.request))
+            except ConnectionError:
+                return
+            try:
+                texts = request["texts"]
+                # Query lẻ đi qua BatchingEmbeddings để gom batch giữa các worker
+                vectors = [embedder.embed_query(texts[0])] if len(texts) == 1 else embedder.embed_documents(texts)
+                array = np.asarray(vectors, dtype=np.float32)
+                response = b"\x00" + struct.pack("!II", *array.shape) + array.tobytes()
+            except Exception as e:
+                response = b"\x01" + str(e).encode("utf-8")
+            _send_message(self.request, response)
+
+
+def serve_embeddings(socket_path=EMBEDDING_SOCKET_PATH, provider=None):
+    """Load model một lần và phục vụ embedding qua Unix socket cho mọi worker trên node"""
+    from .rag_pipeline import _create_embedding_backend
+
+    if (provider or EMBEDDING_PROVIDER) == "remote":
+        raise ValueError("Sidecar cần một backend embedding thật (huggingface | onnx | stub)")
+    start = time.perf_counter()
+    embedder = BatchingEmbeddings(_create_embedding_backend(provider or EMBEDDING_PROVIDER))
+    embedder.embed_query("khởi động mô hình")
+    print(f"[EMBEDDING] Model loaded in {time.perf_counter() - start:.2f}s")
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socketserver.ThreadingUnixStreamServer(socket_path, _EmbeddingRequestHandler)
+    server.daemon_threads = True
+    server.embedder = embedder
+    print(f"[EMBEDDING] Serving on {socket_path} (pid={os.getpid()})")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Embedding sidecar dùng chung cho các uvicorn worker")
+    parser.add_argument("--socket", default=EMBEDDING_SOCKET_PATH)
+    parser.add_argument("--provider", default=None, help="huggingface | onnx | stub (mặc định: EMBEDDING_PROVIDER)")
+    args = parser.parse_args()
+    serve_embeddings(args.socket, args.provider)
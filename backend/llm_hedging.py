@@ -0,0 +1,146 @@
+"""Gọi LLM có deadline và hedging để cắt đuôi latency.
+
+Nếu lời gọi chính chưa xong sau percentile latency gần đây (LLM_HEDGE_PERCENTILE) thì gửi thêm một
+lời gọi giống hệt và lấy kết quả nào về trước. Số hedge bị giới hạn bởi budget (LLM_HEDGE_MAX_RATE
+hedge trên mỗi lời gọi chính) và chỉ hedge khi scheduler còn slot trống, để hedging không tự gây quá tải.
+Lời gọi thua vẫn chạy nốt trong thread nền (không hủy được request HTTP đang chờ) và trả slot khi xong.
+"""
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from .config import (
+    LLM_MAX_CONCURRENCY, LLM_TIMEOUT_SECONDS, LLM_HEDGING, LLM_HEDGE_PERCENTILE, LLM_HEDGE_MAX_RATE,
+    LLM_HEDGE_MIN_SAMPLES, LLM_HEDGE_MIN_DELAY_MS
+)
+from .metrics import LLM_UPSTREAM_CALLS, LLM_UPSTREAM_LATENCY, LLM_HEDGES, LLM_TIMEOUTS
+
+
+class LLMTimeout(Exception):
+    pass
+
+
+class LatencyTracker:
+    """Cửa sổ trượt latency gần nhất của một loại lời gọi"""
+
+    def __init__(self, window=500):
+        self.samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, q, min_samples=LLM_HEDGE_MIN_SAMPLES):
+        with self._lock:
+            if len(self.samples) < min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+class HedgeBudget:
+    """Mỗi lời gọi chính nạp `rate` token, mỗi hedge tốn 1 token -> tỉ lệ hedge dài hạn <= rate"""
+
+    def __init__(self, rate=LLM_HEDGE_MAX_RATE, burst=5.0):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = 0.0
+        self._lock = threading.Lock()
+
+    def on_call(self):
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + self.rate)
+
+    def try_spend(self):
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def refund(self):
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+
+class HedgedInvoker:
+    def __init__(self, scheduler, timeout=LLM_TIMEOUT_SECONDS, hedging=LLM_HEDGING,
+                 percentile=LLM_HEDGE_PERCENTILE, max_rate=LLM_HEDGE_MAX_RATE,
+                 min_delay_ms=LLM_HEDGE_MIN_DELAY_MS, max_workers=None):
+        self.scheduler = scheduler
+        self.timeout = timeout
+        self.hedging = hedging
+        self.percentile = percentile
+        self.min_delay = min_delay_ms / 1000
+        self.budget = HedgeBudget(max_rate)
+        self.trackers = {}
+        self._trackers_lock = threading.Lock()
+        # Mỗi attempt giữ một slot của scheduler nên số thread bận không vượt quá max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or LLM_MAX_CONCURRENCY * 2,
+                                            thread_name_prefix="llm")
+
+    def tracker(self, purpose):
+        with self._trackers_lock:
+            return self.trackers.setdefault(purpose, LatencyTracker())
+
+    def _attempt(self, fn, ticket, purpose, kind):
+        start = time.perf_counter()
+        try:
+            result = fn()
+            # Chỉ latency thành công của lời gọi chính phản ánh phân phối thật (hedge luôn bắt đầu muộn hơn)
+            if kind == "primary":
+                self.tracker(purpose).record(time.perf_counter() - start)
+            return result
+        finally:
+            self.scheduler.release(ticket)
+            LLM_UPSTREAM_LATENCY.labels(attempt=kind).observe(time.perf_counter() - start)
+
+    def invoke(self, fn, ticket, purpose, session_id, cost):
+        """Chạy `fn` với slot `ticket` đã được cấp; trả kết quả của attempt xong trước"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        LLM_UPSTREAM_CALLS.labels(attempt="primary").inc()
+        primary = self._executor.submit(self._attempt, fn, ticket, purpose, "primary")
+        attempts = {primary: "primary"}
+
+        if self.hedging:
+            self.budget.on_call()
+            delay = self.tracker(purpose).percentile(self.percentile)
+            if delay is not None:
+                delay = max(delay, self.min_delay)
+                done, _ = wait([primary], timeout=min(delay, self.timeout))
+                if not done:
+                    hedge = self._start_hedge(fn, purpose, session_id, cost)
+                    if hedge is not None:
+                        attempts[hedge] = "hedge"
+
+        pending = set(attempts)
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                LLM_TIMEOUTS.labels(purpose=purpose).inc()
+                if len(attempts) > 1:
+                    LLM_HEDGES.labels(result="timeout").inc()
+                raise LLMTimeout(f"LLM không phản hồi sau {self.timeout}s")
+            # Ưu tiên attempt thành công nếu cả hai cùng xong
+            for future in sorted(done, key=lambda f: f.exception() is not None):
+                if future.exception() is not None and pending:
+                    # Một attempt lỗi thì chờ attempt còn lại
+                    continue
+                if len(attempts) > 1:
+                    LLM_HEDGES.labels(result="won" if attempts[future] == "hedge" else "lost").inc()
+                return future.result()
+
+    def _start_hedge(self, fn, purpose, session_id, cost):
+        if not self.budget.try_spend():
+            LLM_HEDGES.labels(result="skipped_budget").inc()
+            return None
+        ticket = self.scheduler.try_acquire(session_id, purpose, cost)
+        if ticket is None:
+            self.budget.refund()
+            LLM_HEDGES.labels(result="skipped_capacity").inc()
+            return None
+        LLM_UPSTREAM_CALLS.labels(attempt="hedge").inc()
+        return self._executor.submit(self._attempt, fn, ticket, purpose, "hedge")
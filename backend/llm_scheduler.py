@@ -0,0 +1,228 @@
+"""Scheduler trung tâm cho mọi lời gọi LLM: admission control, fair queuing và load shedding.
+
+- Giới hạn số lời gọi đồng thời và tokens/phút (token bucket) của mỗi worker.
+- Weighted fair queuing (self-clocked): mỗi flow (session, loại request) có finish tag riêng nên
+  một session gửi 200 câu batch không chặn được session khác; chat có weight lớn hơn batch và summary.
+- Quá số request chờ hoặc chờ quá lâu thì từ chối ngay (429/503) thay vì để Gemini trả lỗi rate limit.
+"""
+import hashlib
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from .config import (
+    LLM_MAX_CONCURRENCY, LLM_TOKENS_PER_MINUTE, LLM_MAX_QUEUE_SECONDS, LLM_MAX_QUEUE_DEPTH,
+    LLM_MAX_QUEUED_PER_SESSION, LLM_EXPECTED_OUTPUT_TOKENS, REQUEST_COALESCING
+)
+from .context_builder import estimate_tokens
+from .metrics import LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT, LLM_SHED, LLM_IN_FLIGHT
+from .singleflight import SingleFlight
+
+# Loại request -> (priority class, weight). Weight càng lớn thì càng được phục vụ nhiều hơn khi có tranh chấp
+PURPOSE_CLASSES = {
+    "rewrite": "interactive",
+    "answer": "interactive",
+    "batch": "batch",
+    "summary": "background",
+}
+CLASS_WEIGHTS = {"interactive": 8.0, "batch": 2.0, "background": 1.0}
+
+
+class LLMOverloaded(Exception):
+    """LLM đang quá tải: 429 khi session tự gửi quá nhiều, 503 khi cả hệ thống quá tải"""
+
+    def __init__(self, status_code, detail, retry_after=1):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    __slots__ = ("flow", "priority", "cost", "granted", "cancelled")
+
+    def __init__(self, flow, priority, cost):
+        self.flow = flow
+        self.priority = priority
+        self.cost = cost
+        self.granted = False
+        self.cancelled = False
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+                 max_queue_seconds=LLM_MAX_QUEUE_SECONDS, max_queue_depth=LLM_MAX_QUEUE_DEPTH,
+                 max_queued_per_session=LLM_MAX_QUEUED_PER_SESSION):
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.max_queue_seconds = max_queue_seconds
+        self.max_queue_depth = max_queue_depth
+        self.max_queued_per_session = max_queued_per_session
+        self.running = 0
+        self.tokens = float(tokens_per_minute)
+        self.last_refill = time.monotonic()
+        self.virtual_time = 0.0
+        self.flow_finish = {}
+        self.queued_per_session = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+
+    def _refill(self):
+        if not self.tokens_per_minute:
+            return
+        now = time.monotonic()
+        self.tokens = min(self.tokens_per_minute, self.tokens + (now - self.last_refill) * self.tokens_per_minute / 60)
+        self.last_refill = now
+
+    def _token_wait(self, cost):
+        """Số giây cần chờ để bucket đủ token (request lớn hơn cả bucket chỉ cần bucket đầy)"""
+        if not self.tokens_per_minute:
+            return 0.0
+        needed = min(cost, self.tokens_per_minute) - self.tokens
+        return max(0.0, needed * 60 / self.tokens_per_minute)
+
+    def _dispatch(self):
+        """Cấp slot cho các ticket có finish tag nhỏ nhất khi còn slot và còn token. Gọi khi đang giữ lock"""
+        self._refill()
+        while self._heap and self.running < self.max_concurrency:
+            finish, _, ticket = self._heap[0]
+            if ticket.cancelled:
+                heapq.heappop(self._heap)
+                continue
+            if self._token_wait(ticket.cost) > 0:
+                break
+            heapq.heappop(self._heap)
+            if self.tokens_per_minute:
+                self.tokens -= min(ticket.cost, self.tokens_per_minute)
+            self.virtual_time = finish
+            self.running += 1
+            ticket.granted = True
+            self._cond.notify_all()
+
+    def _dequeue(self, ticket, session_id):
+        LLM_QUEUE_DEPTH.labels(priority=ticket.priority).dec()
+        count = self.queued_per_session.get(session_id, 1) - 1
+        if count > 0:
+            self.queued_per_session[session_id] = count
+        else:
+            self.queued_per_session.pop(session_id, None)
+
+    def acquire(self, session_id, purpose, cost):
+        priority = PURPOSE_CLASSES.get(purpose, "interactive")
+        flow = (session_id, priority)
+        start = time.monotonic()
+        with self._cond:
+            if len(self._heap) >= self.max_queue_depth:
+                LLM_SHED.labels(priority=priority, reason="queue_full").inc()
+                raise LLMOverloaded(503, "Hệ thống đang quá tải, vui lòng thử lại sau.")
+            if session_id and self.queued_per_session.get(session_id, 0) >= self.max_queued_per_session:
+                LLM_SHED.labels(priority=priority, reason="session_limit").inc()
+                raise LLMOverloaded(429, "Session gửi quá nhiều yêu cầu cùng lúc, vui lòng chờ.")
+
+            # Self-clocked fair queuing: tag = max(V, finish của flow) + cost / weight
+            finish = max(self.virtual_time, self.flow_finish.get(flow, 0.0)) + cost / CLASS_WEIGHTS[priority]
+            self.flow_finish[flow] = finish
+            ticket = _Ticket(flow, priority, cost)
+            heapq.heappush(self._heap, (finish, next(self._counter), ticket))
+            self.queued_per_session[session_id] = self.queued_per_session.get(session_id, 0) + 1
+            LLM_QUEUE_DEPTH.labels(priority=priority).inc()
+
+            deadline = start + self.max_queue_seconds
+            self._dispatch()
+            while not ticket.granted:
+                now = time.monotonic()
+                if now >= deadline:
+                    ticket.cancelled = True
+                    self._dequeue(ticket, session_id)
+                    LLM_SHED.labels(priority=priority, reason="queue_timeout").inc()
+                    raise LLMOverloaded(503, "Hệ thống đang quá tải, vui lòng thử lại sau.",
+                                        retry_after=max(1, int(self.max_queue_seconds)))
+                # Thức dậy khi có slot trống hoặc khi bucket đủ token cho ticket đầu hàng đợi
+                head_wait = self._token_wait(self._heap[0][2].cost) if self._heap else 0
+                self._cond.wait(timeout=min(deadline - now, head_wait or deadline - now))
+                self._dispatch()
+            self._dequeue(ticket, session_id)
+        LLM_QUEUE_WAIT.labels(priority=priority).observe(time.monotonic() - start)
+        LLM_IN_FLIGHT.inc()
+        return ticket
+
+    def try_acquire(self, session_id, purpose, cost):
+        """Cấp slot ngay nếu còn trống và không có ai chờ (dùng cho hedge), ngược lại trả về None"""
+        priority = PURPOSE_CLASSES.get(purpose, "interactive")
+        with self._cond:
+            self._refill()
+            if self.running >= self.max_concurrency or self._heap or self._token_wait(cost) > 0:
+                return None
+            if self.tokens_per_minute:
+                self.tokens -= min(cost, self.tokens_per_minute)
+            self.running += 1
+        ticket = _Ticket((session_id, priority), priority, cost)
+        ticket.granted = True
+        LLM_IN_FLIGHT.inc()
+        return ticket
+
+    def release(self, ticket):
+        LLM_IN_FLIGHT.dec()
+        with self._cond:
+            self.running -= 1
+            # Flow không còn request chờ thì bỏ finish tag để dict không phình theo số session
+            if self.flow_finish.get(ticket.flow, 0.0) <= self.virtual_time:
+                self.flow_finish.pop(ticket.flow, None)
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, session_id, purpose, cost):
+        ticket = self.acquire(session_id, purpose, cost)
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = LLMScheduler()
+    return _scheduler
+
+_invoker = None
+
+def get_invoker():
+    global _invoker
+    if _invoker is None:
+        with _scheduler_lock:
+            if _invoker is None:
+                from .llm_hedging import HedgedInvoker
+                _invoker = HedgedInvoker(get_scheduler())
+    return _invoker
+
+# LLMOverloaded của leader (429 theo session, 503 khi hàng đợi đầy) không chia sẻ: follower tự qua admission
+_llm_flights = SingleFlight("llm", unshared_errors=(LLMOverloaded,))
+
+def _scheduled_invoke(prompt, purpose, session_id):
+    from .rag_pipeline import get_llm
+
+    cost = estimate_tokens(prompt) + LLM_EXPECTED_OUTPUT_TOKENS
+    scheduler = get_scheduler()
+    invoker = get_invoker()
+    ticket = scheduler.acquire(session_id, purpose, cost)
+    # Slot được trả trong thread chạy lời gọi (kể cả khi caller đã timeout hoặc hedge thắng)
+    return invoker.invoke(lambda: get_llm().invoke(prompt), ticket, purpose, session_id, cost)
+
+def invoke_llm(prompt, purpose, session_id=None):
+    """Gọi LLM qua scheduler. Blocking (chờ slot) nên từ code async phải gọi qua asyncio.to_thread.
+
+    Prompt giống hệt một lời gọi đang chạy thì chờ và dùng chung kết quả (chỉ chiếm một slot, một lần gọi Gemini).
+    Lời gọi đầu bị từ chối (LLMOverloaded) thì các lời gọi đang chờ tự xin slot theo session của chúng.
+    """
+    if not REQUEST_COALESCING:
+        return _scheduled_invoke(prompt, purpose, session_id)
+    key = hashlib.sha256(str(prompt).encode()).hexdigest()
+    return _llm_flights.do(key, _scheduled_invoke, prompt, purpose, session_id)
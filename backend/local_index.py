@@ -0,0 +1,171 @@
+"""Tầng retrieval trong process cho session nhỏ: exact cosine top-k bằng NumPy, không gọi Qdrant.
+
+Collection <= LOCAL_INDEX_MAX_POINTS point được scroll về một lần và giữ thành ma trận float32 đã
+chuẩn hóa (mỗi hàng ứng với payload cùng vị trí), search = một phép nhân ma trận-vector.
+Index gắn với version tập tài liệu của session: upload/xóa tài liệu tăng version (ở bất kỳ worker nào)
+nên index cũ tự bị bỏ ở lần dùng sau; worker thực hiện upload/xóa còn invalidate ngay để giải phóng RAM.
+Các index được giữ theo LRU, tổng dung lượng không vượt quá LOCAL_INDEX_MAX_MB.
+"""
+import sys
+import threading
+from collections import OrderedDict, namedtuple
+import numpy as np
+from qdrant_client.models import FieldCondition, MatchAny, MatchValue
+from .config import LOCAL_INDEX_MAX_MB
+from .metrics import LOCAL_INDEX_BYTES
+
+# Cùng các field mà retriever đọc từ ScoredPoint của Qdrant
+LocalHit = namedtuple("LocalHit", ["id", "score", "payload", "vector"])
+
+# Overhead ước lượng của dict payload + id mỗi point (ngoài text)
+PAYLOAD_OVERHEAD_BYTES = 512
+
+
+def _payload_value(payload, key):
+    value = payload
+    for part in key.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _in_range(value, condition_range):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return False
+    r = condition_range
+    return ((r.gte is None or value >= r.gte) and (r.lte is None or value <= r.lte)
+            and (r.gt is None or value > r.gt) and (r.lt is None or value < r.lt))
+
+
+class LocalIndex:
+    def __init__(self, ids, vectors, payloads, version):
+        matrix = np.asarray(vectors, dtype=np.float32) if ids else np.zeros((0, 1), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.matrix = matrix / norms
+        self.ids = ids
+        self.payloads = payloads
+        self.version = version
+        self.nbytes = self.matrix.nbytes + sum(
+            sys.getsizeof(payload.get("text") or payload.get("text_zstd", "")) + PAYLOAD_OVERHEAD_BYTES for payload in payloads
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def filter_mask(self, query_filter):
+        """Mask các point thỏa Filter (chỉ hỗ trợ must + match/range), None nếu Filter có điều kiện khác"""
+        if query_filter.should or query_filter.must_not or getattr(query_filter, "min_should", None):
+            return None
+        conditions = query_filter.must or []
+        if not isinstance(conditions, list):
+            conditions = [conditions]
+        mask = np.ones(len(self), dtype=bool)
+        for condition in conditions:
+            if not isinstance(condition, FieldCondition):
+                return None
+            values = [_payload_value(payload, condition.key) for payload in self.payloads]
+            if isinstance(condition.match, MatchValue):
+                matched = [value == condition.match.value for value in values]
+            elif isinstance(condition.match, MatchAny):
+                allowed = set(condition.match.any)
+                matched = [value in allowed for value in values]
+            elif condition.match is None and condition.range is not None:
+                matched = [_in_range(value, condition.range) for value in values]
+            else:
+                return None
+            mask &= np.array(matched, dtype=bool)
+        return mask
+
+    def supports(self, query_filter):
+        return query_filter is None or self.filter_mask(query_filter) is not None
+
+    def search(self, query_vector, limit, query_filter=None, score_threshold=None):
+        """Exact cosine top-k, kết quả giảm dần theo score (giống search của Qdrant)"""
+        if not len(self) or limit <= 0:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        scores = self.matrix @ (query / (np.linalg.norm(query) or 1.0))
+        if query_filter is not None:
+            scores = np.where(self.filter_mask(query_filter), scores, -np.inf)
+        if score_threshold is not None:
+            scores = np.where(scores >= score_threshold, scores, -np.inf)
+        limit = min(limit, len(self))
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        return [
+            LocalHit(self.ids[i], float(scores[i]), self.payloads[i], self.matrix[i])
+            for i in top if np.isfinite(scores[i])
+        ]
+
+
+def build_local_index(client, collection_name, version, batch_size=256):
+    """Scroll toàn bộ point (kèm vector) của collection thành LocalIndex"""
+    ids, vectors, payloads = [], [], []
+    offset = None
+    while True:
+        records, offset = client.scroll(
+            collection_name=collection_name,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        for record in records:
+            ids.append(record.id)
+            vectors.append(record.vector)
+            payloads.append(record.payload or {})
+        if offset is None:
+            break
+    return LocalIndex(ids, vectors, payloads, version)
+
+
+class LocalIndexCache:
+    """LRU các LocalIndex theo collection, giới hạn tổng dung lượng"""
+
+    def __init__(self, max_bytes=int(LOCAL_INDEX_MAX_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pop(self, collection_name):
+        index = self._entries.pop(collection_name, None)
+        if index is not None:
+            self.total_bytes -= index.nbytes
+            LOCAL_INDEX_BYTES.dec(index.nbytes)
+
+    def get(self, collection_name, version):
+        with self._lock:
+            index = self._entries.get(collection_name)
+            if index is None:
+                return None
+            if index.version != version:
+                self._pop(collection_name)
+                return None
+            self._entries.move_to_end(collection_name)
+            return index
+
+    def put(self, collection_name, index):
+        """Lưu index, bỏ các index ít dùng nhất cho tới khi tổng dung lượng <= max_bytes"""
+        if index.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(collection_name)
+            self._entries[collection_name] = index
+            self.total_bytes += index.nbytes
+            LOCAL_INDEX_BYTES.inc(index.nbytes)
+            while self.total_bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def invalidate(self, collection_name):
+        with self._lock:
+            self._pop(collection_name)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+local_indexes = LocalIndexCache()
@@ -1,14 +1,37 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+import time
+_IMPORT_START = time.perf_counter()
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from .rag_pipeline import load_and_setup_rag, batch_vector_search
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, PlainTextResponse, JSONResponse, ORJSONResponse
+from pydantic import BaseModel, Field
+from .rag_pipeline import load_and_setup_rag, batch_vector_search, copy_document_vectors, build_search_filter
+from .rag_pipeline import copy_collection_points, collapse_to_parents, points_to_documents
 import json
-from .config import SUMMARY_EVERY_N, REWRITE_HISTORY_M
-from .rag_pipeline import llm
+import orjson
+from .config import SUMMARY_EVERY_N, REWRITE_HISTORY_M, REWRITE_GATE_ENABLED
+from .config import SPECULATIVE_RETRIEVAL, SPECULATION_SIMILARITY_THRESHOLD, WARMUP_ON_STARTUP, WARMUP_RETRY_SECONDS
+from .config import MAX_UPLOAD_FILE_MB, MAX_SESSION_UPLOAD_MB, ANSWER_CACHE_TTL, RETRIEVAL_CACHE_TTL
+from .config import HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE, GZIP_MIN_SIZE, QDRANT_COLLECTION_NAME
+from .rag_pipeline import cosine_similarity, warmup, get_qdrant_client
+from .context_builder import assemble_context, estimate_tokens
+from .llm_scheduler import invoke_llm, LLMOverloaded
+from .uploads import save_upload_to_disk, remove_temp_files, MB
+from .text_codec import CODECS
 from .db import create_session, is_valid_session, save_chat, save_evaluation, get_eval_stats, delete_chat_history, delete_summary_for_session
+from .db import get_rewrite_cache, set_rewrite_cache, get_cache, set_cache, get_retrieval_cache, set_retrieval_cache
+from .db import get_cache_scope, bump_docset_version, get_docset_version
+from .db import get_document_locations, add_document_location, remove_document_location, copy_collection_codec
+from .rewrite_gate import needs_rewrite, rewrite_cache_key, history_to_chats
+from .profiling import get_debug_options, RequestDebug, profile_path, profile_summary
+from .metrics import (
+    track_stage, render_metrics, mark_worker_dead, REQUEST_LATENCY, REQUESTS_IN_FLIGHT, STARTUP_SECONDS,
+    LLM_CALLS, CACHE_EVENTS, REWRITE_DECISIONS, SPECULATION, SPECULATION_SAVED, PROMPT_TOKENS
+)
 # from .rag_pipeline import cache_key
-import tempfile
-import time
+import os
+import threading
+import asyncio
 import uuid
 import redis
 from .config import REDIS_URL
@@ -27,12 +50,124 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if GZIP_MIN_SIZE > 0:
+    app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE)
+
+# Chỉ gắn label cho các route cố định để tránh bùng nổ cardinality
+_tracked_endpoints = None
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    global _tracked_endpoints
+    if _tracked_endpoints is None:
+        _tracked_endpoints = {route.path for route in app.routes if "{" not in route.path}
+    endpoint = request.url.path if request.url.path in _tracked_endpoints else "other"
+    if endpoint == "/metrics":
+        return await call_next(request)
+    start = time.perf_counter()
+    REQUESTS_IN_FLIGHT.labels(endpoint=endpoint).inc()
+    try:
+        return await call_next(request)
+    finally:
+        REQUESTS_IN_FLIGHT.labels(endpoint=endpoint).dec()
+        REQUEST_LATENCY.labels(endpoint=endpoint).observe(time.perf_counter() - start)
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    # Body multipart được parse trước khi vào handler -> chặn sớm request chắc chắn vượt giới hạn session
+    if request.url.path == "/upload_doc":
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > MAX_SESSION_UPLOAD_MB * MB + MB:
+            return JSONResponse(status_code=413, content={"detail": f"Upload vượt quá giới hạn {MAX_SESSION_UPLOAD_MB}MB mỗi session."})
+    return await call_next(request)
+
+@app.exception_handler(LLMOverloaded)
+async def llm_overloaded_handler(request: Request, exc: LLMOverloaded):
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+# Trạng thái khởi động: warmup chạy nền, /readyz trả 503 cho tới khi xong
+startup_state = {"ready": False, "error": None, "import_seconds": None, "warmup": None, "time_to_ready_seconds": None}
+
+def run_warmup():
+    """Warmup tới khi thành công (lỗi tạm thời của Qdrant/model không làm worker 503 mãi), backoff tối đa 5 phút"""
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            startup_state["warmup"] = warmup()
+        except Exception as e:
+            startup_state["error"] = str(e)
+            delay = min(WARMUP_RETRY_SECONDS * 2 ** (attempt - 1), 300)
+            logger.error(f"[STARTUP] Warmup failed (attempt {attempt}), retry in {delay}s: {e}")
+            time.sleep(delay)
+            continue
+        startup_state["error"] = None
+        startup_state["ready"] = True
+        startup_state["time_to_ready_seconds"] = time.perf_counter() - _IMPORT_START
+        STARTUP_SECONDS.labels(phase="ready").set(startup_state["time_to_ready_seconds"])
+        logger.info(f"[STARTUP] Ready after {startup_state['time_to_ready_seconds']:.2f}s, warmup={startup_state['warmup']}")
+        return
+
+@app.on_event("startup")
+def on_startup():
+    if WARMUP_ON_STARTUP:
+        threading.Thread(target=run_warmup, name="warmup", daemon=True).start()
+    else:
+        startup_state["ready"] = True
+
+@app.on_event("shutdown")
+def on_shutdown():
+    mark_worker_dead()
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: process còn sống và event loop còn phản hồi"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz(response: Response):
+    """Readiness: warmup xong và Redis, Qdrant kết nối được"""
+    checks = {"warmup": startup_state["ready"]}
+    try:
+        checks["redis"] = bool(redis_client.ping())
+    except Exception:
+        checks["redis"] = False
+    if startup_state["ready"]:
+        try:
+            get_qdrant_client().get_collections()
+            checks["qdrant"] = True
+        except Exception:
+            checks["qdrant"] = False
+    ready = all(checks.values())
+    if not ready:
+        response.status_code = 503
+    return {
+        "ready": ready,
+        "checks": checks,
+        "error": startup_state["error"],
+        "import_seconds": startup_state["import_seconds"],
+        "warmup_seconds": startup_state["warmup"],
+        "time_to_ready_seconds": startup_state["time_to_ready_seconds"],
+    }
 
 # Schemas pydantic model
 # dữ liệu gửi lên khi người dùng chat
 class ChatRequest(BaseModel):
     question: str
     session_id: str = None
+    speculative: bool = None  # None: dùng SPECULATIVE_RETRIEVAL trong config
+    # Tham số search per request (None: dùng config/adaptive policy)
+    hnsw_ef: int = Field(None, ge=1)  # ef <= 0 bị Qdrant từ chối
+    exact: bool = None
+    score_threshold: float = None
+    latency_target_ms: float = None
+    mmr: bool = None  # None: dùng MMR_ENABLED trong config
+    # Chỉ search trong các tài liệu/tên file/khoảng trang này (None: toàn bộ tài liệu của session)
+    document_ids: list[str] = None
+    sources: list[str] = None
+    page_from: int = None
+    page_to: int = None
 
 # dữ liệu khi đánh gía câu trả lời
 class EvalRequest(BaseModel):
@@ -44,6 +179,13 @@ class EvalRequest(BaseModel):
 class BatchQueryRequest(BaseModel):
     queries: list[str]
     session_id: str = None
+    hnsw_ef: int = Field(None, ge=1)  # ef <= 0 bị Qdrant từ chối
+    exact: bool = None
+    score_threshold: float = None
+    document_ids: list[str] = None
+    sources: list[str] = None
+    page_from: int = None
+    page_to: int = None
 
 # Quản lý pipeline theo session_id
 session_rag_chains = {}
@@ -51,6 +193,7 @@ session_rag_chains = {}
 # Kết nối Redis
 redis_client = redis.Redis.from_url(REDIS_URL)
 
+@track_stage("redis")
 def get_session_collection(session_id):
     key = f"session:{session_id}:collection"
     collection = redis_client.get(key)
@@ -61,17 +204,24 @@ def get_session_collection(session_id):
     redis_client.set(key, collection)
     return collection
 
-def add_document_to_session(session_id, document_id, filename, size_mb):
+@track_stage("redis")
+def add_document_to_session(session_id, document_id, filename, size_mb, size_bytes=None, content_hash=None):
     redis_client.rpush(f"session:{session_id}:documents", document_id)
     meta = {"filename": filename, 
             "session_id": session_id, 
             "size_mb": size_mb}
+    if size_bytes is not None:
+        meta["size_bytes"] = size_bytes
+    if content_hash:
+        meta["content_hash"] = content_hash
     redis_client.hset(f"document:{document_id}:meta", mapping=meta)
 
+@track_stage("redis")
 def remove_document_from_session(session_id, document_id):
     redis_client.lrem(f"session:{session_id}:documents", 0, document_id)
     redis_client.delete(f"document:{document_id}:meta")
 
+@track_stage("redis")
 def get_documents_of_session(session_id):
     doc_ids = redis_client.lrange(f"session:{session_id}:documents", 0, -1)
     docs = []
@@ -83,11 +233,19 @@ def get_documents_of_session(session_id):
         docs.append(meta)
     return docs
 
+def get_session_upload_bytes(session_id):
+    """Tổng dung lượng tài liệu đã upload của session (tài liệu cũ chỉ có size_mb)"""
+    total = 0
+    for doc in get_documents_of_session(session_id):
+        total += int(doc["size_bytes"]) if "size_bytes" in doc else int(float(doc.get("size_mb", 0)) * MB)
+    return total
+
 def get_llm_text(llm_result):
     if hasattr(llm_result, 'content'):
         return llm_result.content.strip()
     return str(llm_result).strip()
 
+@track_stage("redis")
 def save_chat_pair(session_id, question, answer, metrics=None):
     chat_pair = {
         "id": str(uuid.uuid4()),
@@ -96,11 +254,14 @@ def save_chat_pair(session_id, question, answer, metrics=None):
         "created_at": datetime.now().isoformat(),
         # "metrics": metrics or {}
     }
-    redis_client.rpush(f"chat:{session_id}:history", json.dumps(chat_pair))
+    redis_client.rpush(f"chat:{session_id}:history", orjson.dumps(chat_pair))
     redis_client.expire(f"chat:{session_id}:history", 3600 * 24 * 7)
+    # Epoch phải sống ít nhất bằng list, nếu không cursor cũ có thể khớp lại epoch 0
+    redis_client.expire(f"chat:{session_id}:history_epoch", 3600 * 24 * 7)
     return chat_pair["id"]
 
 
+@track_stage("redis")
 def update_chat_metrics(session_id, chat_id, metrics):
     key = f"chat:{session_id}:history"
     items = redis_client.lrange(key, 0, -1)
@@ -108,17 +269,67 @@ def update_chat_metrics(session_id, chat_id, metrics):
         chat_pair = json.loads(item)
         if chat_pair.get("id") == chat_id:
             chat_pair["metrics"] = metrics
-            redis_client.lset(key, idx, json.dumps(chat_pair))
+            redis_client.lset(key, idx, orjson.dumps(chat_pair))
             break
 
 
+@track_stage("redis")
 def get_chat_history_pairs(session_id):
     items = redis_client.lrange(f"chat:{session_id}:history", 0, -1)
-    return [json.loads(item) for item in items]
+    return [orjson.loads(item) for item in items]
+
+@track_stage("redis")
+def get_recent_chat_pairs(session_id, n):
+    """n lượt chat gần nhất (cũ -> mới), chỉ đọc n phần tử cuối list"""
+    if n <= 0:
+        return []
+    items = redis_client.lrange(f"chat:{session_id}:history", -n, -1)
+    return [orjson.loads(item) for item in items]
 
+@track_stage("redis")
+def count_chat_pairs(session_id):
+    return redis_client.llen(f"chat:{session_id}:history")
+
+class StaleHistoryCursor(Exception):
+    """Cursor thuộc epoch lịch sử cũ (history đã bị tóm tắt/xóa sau khi cursor được trả về)"""
+
+
+def parse_history_cursor(cursor):
+    """Cursor dạng "{epoch}:{index}" -> (epoch, index)"""
+    try:
+        epoch, index = cursor.split(":", 1)
+        return int(epoch), int(index)
+    except (AttributeError, ValueError):
+        raise ValueError(f"Cursor không hợp lệ: {cursor}")
+
+
+@track_stage("redis")
+def get_chat_history_page(session_id, limit, before=None):
+    """Một trang lịch sử mới -> cũ gồm các lượt chat có vị trí < `before` (None: từ lượt mới nhất).
+
+    Vị trí trong list không đổi khi có chat mới (RPUSH) nên dùng được làm cursor, nhưng tóm tắt/xóa
+    history thì ghi lại list từ đầu: cursor kèm epoch của history và cursor của epoch cũ bị từ chối
+    (StaleHistoryCursor) thay vì trả về trang sai.
+    Trả về (chats, next_cursor, total); next_cursor là None khi đã tới lượt cũ nhất.
+    """
+    key = f"chat:{session_id}:history"
+    pipe = redis_client.pipeline()
+    pipe.llen(key)
+    pipe.get(f"chat:{session_id}:history_epoch")
+    total, epoch = pipe.execute()
+    epoch = int(epoch or 0)
+    if before is None:
+        end = total
+    else:
+        cursor_epoch, index = parse_history_cursor(before)
+        if cursor_epoch != epoch:
+            raise StaleHistoryCursor(before)
+        end = max(0, min(index, total))
+    start = max(0, end - limit)
+    items = redis_client.lrange(key, start, end - 1) if end > start else []
+    chats = [orjson.loads(item) for item in reversed(items)]
+    return chats, (f"{epoch}:{start}" if start > 0 else None), total
 
-def delete_chat_history(session_id):
-    redis_client.delete(f"chat:{session_id}:history")
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("chat-debug")
@@ -129,6 +340,61 @@ def create_new_session():
     session_id = create_session()
     return {"session_id": session_id}
 
+@app.post("/session/{session_id}/fork")
+def fork_session(session_id: str):
+    """Tạo session mới có cùng tài liệu (copy vector, không ingest lại) và lịch sử chat trống"""
+    start = time.time()
+    if not is_valid_session(session_id):
+        raise HTTPException(status_code=400, detail="Session không hợp lệ.")
+    source_collection = get_session_collection(session_id)
+    documents = get_documents_of_session(session_id)
+    new_session_id = create_session()
+    new_collection = f"session_{new_session_id}"
+    # document_id là key toàn cục (document:{id}:meta) nên tài liệu của session mới cần id mới
+    document_id_map = {doc["document_id"]: str(uuid.uuid4()) for doc in documents}
+
+    copy_start = time.time()
+    points_copied = 0
+    if documents:
+        try:
+            points_copied = copy_collection_points(source_collection, new_collection, document_id_map)
+        except Exception as e:
+            logger.error(f"[FORK] Copy {source_collection} -> {new_collection} failed: {e}")
+            try:
+                get_qdrant_client().delete_collection(new_collection)
+            except Exception:
+                pass
+            raise HTTPException(status_code=500, detail=f"Fork thất bại: {e}")
+    copy_seconds = time.time() - copy_start
+
+    # Metadata tài liệu của session mới ghi trong một pipeline (một round trip, atomic)
+    with track_stage("redis"):
+        pipe = redis_client.pipeline()
+        pipe.set(f"session:{new_session_id}:collection", new_collection)
+        copy_collection_codec(source_collection, new_collection, pipe=pipe)
+        for doc in documents:
+            new_document_id = document_id_map[doc["document_id"]]
+            meta = {k: v for k, v in doc.items() if k != "document_id"}
+            meta["session_id"] = new_session_id
+            pipe.rpush(f"session:{new_session_id}:documents", new_document_id)
+            pipe.hset(f"document:{new_document_id}:meta", mapping=meta)
+            if doc.get("content_hash"):
+                add_document_location(doc["content_hash"], new_collection, new_document_id, pipe=pipe)
+        pipe.execute()
+    points_per_second = round(points_copied / copy_seconds, 1) if copy_seconds > 0 else None
+    logger.info(f"[FORK] {session_id} -> {new_session_id}: {len(documents)} documents, "
+                f"{points_copied} points in {copy_seconds:.2f}s ({points_per_second} points/s)")
+    return {
+        "session_id": new_session_id,
+        "source_session_id": session_id,
+        "documents": [{"document_id": document_id_map[doc["document_id"]], "filename": doc.get("filename")}
+                      for doc in documents],
+        "points_copied": points_copied,
+        "copy_seconds": round(copy_seconds, 3),
+        "points_per_second": points_per_second,
+        "latency": round(time.time() - start, 3),
+    }
+
 def clean_rewrite_output(text):
     """Làm sạch output từ LLM rewrite để chỉ lấy câu hỏi đầu tiên"""
     lines = text.strip().split('\n')
@@ -159,11 +425,40 @@ def clean_rewrite_output(text):
             return line
     return text.strip()
 
-def rewrite_query_with_history(question, history):
-    """Dùng LLM rewrite truy vấn follow-up thành câu hỏi đầy đủ dựa trên m lịch sử gần nhất."""
+def rewrite_query_with_history(question, history, scope, session_id=None):
+    """Rewrite truy vấn follow-up: bỏ qua nếu câu hỏi tự đủ nghĩa, dùng cache nếu đã rewrite trước đó.
+
+    `scope` ("{session_id}:{docset_version}") giới hạn cache trong session và version tập tài liệu hiện tại.
+    """
     if not history:
         return question
-    
+
+    if REWRITE_GATE_ENABLED:
+        need, reason = needs_rewrite(question, history)
+        if not need:
+            REWRITE_DECISIONS.labels(result="skipped").inc()
+            logger.info(f"[REWRITE] Skipped ({reason})")
+            return question
+
+    key = rewrite_cache_key(question, history)
+    with track_stage("redis"):
+        cached = get_rewrite_cache(scope, key)
+    if cached:
+        REWRITE_DECISIONS.labels(result="cached").inc()
+        CACHE_EVENTS.labels(cache="rewrite", result="hit").inc()
+        logger.info(f"[REWRITE] Cache hit: {cached}")
+        return cached
+
+    REWRITE_DECISIONS.labels(result="llm").inc()
+    CACHE_EVENTS.labels(cache="rewrite", result="miss").inc()
+    rewritten = llm_rewrite_query(question, history, session_id)
+    if rewritten != question:
+        with track_stage("redis"):
+            set_rewrite_cache(scope, key, rewritten)
+    return rewritten
+
+def llm_rewrite_query(question, history, session_id=None):
+    """Dùng LLM rewrite truy vấn follow-up thành câu hỏi đầy đủ dựa trên m lịch sử gần nhất."""
     # Lấy m lịch sử gần nhất
     m = REWRITE_HISTORY_M
     selected_history = history[-m:] if len(history) >= m else history
@@ -183,7 +478,9 @@ Your rewritten query:
 """
     logger.info(f"[REWRITE] Prompt: {prompt}")
     try:
-        rewritten = llm.invoke(prompt)
+        LLM_CALLS.labels(purpose="rewrite").inc()
+        with track_stage("rewrite_llm"):
+            rewritten = invoke_llm(prompt, "rewrite", session_id)
         rewritten_text = get_llm_text(rewritten)
         logger.info(f"[REWRITE] LLM raw output: {rewritten_text}")
         
@@ -196,31 +493,134 @@ Your rewritten query:
         logger.error(f"[REWRITE] LLM error: {e}")
         return question
 
-# Thống kê hiệu năng
-stats = {"cache_hit": 0, "cache_miss": 0, "llm_calls": 0, "total_latency": 0, "num_chats": 0}
+async def speculative_retrieve(retriever, question, history, scope, session_id=None):
+    """Retrieval câu hỏi gốc chạy song song với rewrite.
+
+    Nếu câu hỏi sau rewrite đủ gần câu gốc trong không gian embedding thì dùng lại
+    kết quả speculative, ngược lại search lần 2 với vector của câu đã rewrite.
+    Trả về (full_question, docs).
+    """
+    start = time.time()
+
+    def retrieve_raw():
+        t0 = time.time()
+        raw_vector = retriever.embed(question)
+        t1 = time.time()
+        raw_docs = retriever.search_by_vector(raw_vector)
+        return raw_vector, raw_docs, t1 - t0, time.time() - t1
+
+    def timed_rewrite():
+        t0 = time.time()
+        return rewrite_query_with_history(question, history, scope, session_id), time.time() - t0
+
+    speculative, (full_question, rewrite_time) = await asyncio.gather(
+        asyncio.to_thread(retrieve_raw),
+        asyncio.to_thread(timed_rewrite),
+    )
+    raw_vector, raw_docs, embed_time, search_time = speculative
+
+    if full_question.strip() == question.strip():
+        similarity = 1.0
+        rewritten_vector = raw_vector
+    else:
+        t0 = time.time()
+        rewritten_vector = await asyncio.to_thread(retriever.embed, full_question)
+        embed_time = time.time() - t0
+        similarity = cosine_similarity(raw_vector, rewritten_vector)
+    logger.info(f"[SPECULATE] Similarity raw vs rewritten: {similarity:.4f}")
+
+    if similarity >= SPECULATION_SIMILARITY_THRESHOLD:
+        SPECULATION.labels(result="used").inc()
+        docs = raw_docs
+    else:
+        SPECULATION.labels(result="missed").inc()
+        docs = await asyncio.to_thread(retriever.search_by_vector, rewritten_vector)
+
+    # Latency tiết kiệm = (rewrite + embed + search tuần tự) - thời gian thực tế
+    serial_estimate = rewrite_time + embed_time + search_time
+    saved = serial_estimate - (time.time() - start)
+    SPECULATION_SAVED.observe(saved)
+    logger.info(f"[SPECULATE] used={similarity >= SPECULATION_SIMILARITY_THRESHOLD}, saved={saved:.3f}s")
+    return full_question, docs
+
+async def cached_retrieve(retriever, query, req, scope):
+    """Retrieval có cache theo (câu hỏi, tham số search) trong scope session + version tập tài liệu"""
+    key = None
+    if RETRIEVAL_CACHE_TTL > 0:
+        raw = json.dumps([query.strip().lower(), retriever.k, req.hnsw_ef, req.exact, req.score_threshold,
+                          req.latency_target_ms, sorted(req.document_ids or []), sorted(req.sources or []),
+                          req.page_from, req.page_to, req.mmr])
+        key = hashlib.sha256(raw.encode()).hexdigest()
+        with track_stage("redis"):
+            cached = get_retrieval_cache(scope, key)
+        if cached is not None:
+            from langchain.docstore.document import Document
+            CACHE_EVENTS.labels(cache="retrieval", result="hit").inc()
+            return [Document(page_content=d["page_content"], metadata=d["metadata"]) for d in cached]
+        CACHE_EVENTS.labels(cache="retrieval", result="miss").inc()
+    # Chạy trong thread để các /chat đồng thời không chặn event loop và embed_query được gom batch
+    docs = await asyncio.to_thread(retriever.invoke, query)
+    if key:
+        with track_stage("redis"):
+            set_retrieval_cache(scope, key, [{"page_content": d.page_content, "metadata": d.metadata} for d in docs])
+    return docs
+
+def search_threshold_kwargs(req):
+    # Chỉ override score_threshold khi request truyền vào, không thì giữ SEARCH_SCORE_THRESHOLD
+    return {"score_threshold": req.score_threshold} if req.score_threshold is not None else {}
+
+def search_filter_from_request(req):
+    return build_search_filter(req.document_ids, req.sources, req.page_from, req.page_to)
+
+async def run_with_debug(request, handler):
+    """Chạy handler, nếu request bật debug thì gắn breakdown latency theo stage vào response"""
+    debug = get_debug_options(request)
+    if debug is None:
+        return await handler()
+    with RequestDebug(profile=debug["profile"]) as request_debug:
+        result = await handler()
+    if isinstance(result, dict):
+        result["debug"] = request_debug.report()
+    return result
 
 @app.post("/chat")
-async def chat(req: ChatRequest):
+async def chat(req: ChatRequest, request: Request):
+    return await run_with_debug(request, lambda: run_chat(req))
+
+async def run_chat(req: ChatRequest):
     start = time.time()
     if not req.session_id or not is_valid_session(req.session_id):
         req.session_id = create_session()
     collection_name = get_session_collection(req.session_id)
+    with track_stage("redis"):
+        scope = get_cache_scope(req.session_id)
     try:
         from .rag_pipeline import get_retriever_for_collection
-        retriever = get_retriever_for_collection(collection_name)
+        # scope đổi khi upload/xóa tài liệu nên dùng làm version cho local index của session
+        retriever = get_retriever_for_collection(
+            collection_name, hnsw_ef=req.hnsw_ef, exact=req.exact,
+            latency_target_ms=req.latency_target_ms, query_filter=search_filter_from_request(req),
+            mmr=req.mmr, index_version=scope, **search_threshold_kwargs(req)
+        )
     except HTTPException as e:
         return {"answer": "Vui lòng upload tài liệu trước khi đặt câu hỏi.", "session_id": req.session_id, "latency": 0}
-    prev_pairs = get_chat_history_pairs(req.session_id)[-REWRITE_HISTORY_M:]
-    prev_chats = [
-        {"is_user": "1", "message": pair["question"]} for pair in prev_pairs
-    ] + [
-        {"is_user": "0", "message": pair["answer"]} for pair in prev_pairs
-    ]
+    prev_pairs = get_recent_chat_pairs(req.session_id, REWRITE_HISTORY_M)
+    prev_chats = history_to_chats(prev_pairs)
     logger.info(f"[CHAT] Prev chats: {prev_chats}")
-    full_question = rewrite_query_with_history(req.question, prev_chats)
+    speculative = SPECULATIVE_RETRIEVAL if req.speculative is None else req.speculative
+    docs = None
+    if speculative and prev_chats:
+        try:
+            full_question, docs = await speculative_retrieve(retriever, req.question, prev_chats, scope, req.session_id)
+        except Exception as e:
+            logger.error(f"[SPECULATE] Speculative retrieval failed, fallback to sequential: {e}")
+            docs = None
+    if docs is None:
+        full_question = await asyncio.to_thread(rewrite_query_with_history, req.question, prev_chats, scope, req.session_id)
     logger.info(f"[CHAT] Full question after rewrite: {full_question}")
     try:
-        docs = retriever.invoke(full_question)
+        if docs is None:
+            docs = await cached_retrieve(retriever, full_question, req, scope)
         logger.info(f"[CHAT] Retrieved {len(docs)} documents")
         for i, doc in enumerate(docs):
             logger.info(f"[CHAT] Doc {i}: content_length={len(doc.page_content)}, metadata={doc.metadata}")
@@ -233,7 +633,8 @@ async def chat(req: ChatRequest):
         logger.warning("[CHAT] No valid documents found")
         context = ""
     else:
-        context = "\n".join([doc.page_content for doc in valid_docs])
+        context, context_docs, context_tokens = assemble_context(valid_docs)
+        logger.info(f"[CHAT] Context assembled: {len(context_docs)}/{len(valid_docs)} chunks, ~{context_tokens} tokens")
     logger.info(f"[CHAT] Context length: {len(context)}")
     if not context.strip():
         answer_prompt = f"""Câu hỏi: {full_question}
@@ -251,26 +652,38 @@ Hãy trả lời câu hỏi dựa trên tài liệu tham khảo trên. Nếu tà
 
 Trả lời:"""
     logger.info(f"[CHAT] Answer prompt: {answer_prompt}")
-    # cached_answer = get_prompt_cache(answer_prompt)
-    stats["num_chats"] += 1
+    prompt_tokens = estimate_tokens(answer_prompt)
+    PROMPT_TOKENS.labels(endpoint="/chat").observe(prompt_tokens)
     chat_count_key = f"chat:{req.session_id}:count"
-    chat_count = redis_client.incr(chat_count_key)
-    stats["cache_miss"] += 1
-    from .rag_pipeline import llm
-    stats["llm_calls"] += 1
-    try:
-        answer_raw = llm.invoke(answer_prompt)
-        answer = get_llm_text(answer_raw)
-        logger.info(f"[CHAT] LLM answer: {answer}")
-    except Exception as e:
-        logger.error(f"[CHAT] LLM error: {e}")
-        answer = "Không thể trả lời câu hỏi này."
+    prompt_hash = hashlib.sha256(answer_prompt.encode()).hexdigest()
+    with track_stage("redis"):
+        chat_count = redis_client.incr(chat_count_key)
+        cached_answer = get_cache(scope, prompt_hash) if ANSWER_CACHE_TTL > 0 else None
+    if cached_answer:
+        CACHE_EVENTS.labels(cache="answer", result="hit").inc()
+        answer = cached_answer["response"]
+        logger.info(f"[CHAT] Answer cache hit: {answer}")
+    else:
+        CACHE_EVENTS.labels(cache="answer", result="miss").inc()
+        LLM_CALLS.labels(purpose="answer").inc()
+        try:
+            with track_stage("answer_llm"):
+                answer_raw = await asyncio.to_thread(invoke_llm, answer_prompt, "answer", req.session_id)
+            answer = get_llm_text(answer_raw)
+            logger.info(f"[CHAT] LLM answer: {answer}")
+            if ANSWER_CACHE_TTL > 0:
+                with track_stage("redis"):
+                    set_cache(scope, prompt_hash, answer_prompt, context, answer)
+        except LLMOverloaded:
+            raise
+        except Exception as e:
+            logger.error(f"[CHAT] LLM error: {e}")
+            answer = "Không thể trả lời câu hỏi này."
 
     chat_id = save_chat_pair(req.session_id, req.question, answer)  # , metrics)
     latency = time.time() - start
-    stats["total_latency"] += latency
-    chat_history = get_chat_history_pairs(req.session_id)
-    if len(chat_history) >= SUMMARY_EVERY_N:
+    if count_chat_pairs(req.session_id) >= SUMMARY_EVERY_N:
+        chat_history = get_chat_history_pairs(req.session_id)
         chat_text = "\n".join([
             f"User: {pair['question']}\nBot: {pair['answer']}" for pair in chat_history
         ])
@@ -278,20 +691,23 @@ Trả lời:"""
         logger.info(f"[SUMMARY] Prompt: {summary_prompt}")
 
         try:
-            from .rag_pipeline import llm
-            summary_raw = llm.invoke(summary_prompt)
+            LLM_CALLS.labels(purpose="summary").inc()
+            with track_stage("summary_llm"):
+                summary_raw = await asyncio.to_thread(invoke_llm, summary_prompt, "summary", req.session_id)
             summary_text = get_llm_text(summary_raw)
             logger.info(f"[SUMMARY] LLM output: {summary_text}")
             # set_prompt_cache(summary_prompt, summary_text)
         except Exception as e:
             logger.error(f"[SUMMARY] LLM error: {e}")
             summary_text = "Không thể tóm tắt."
-        delete_chat_history(req.session_id)
+        with track_stage("redis"):
+            delete_chat_history(req.session_id)
         save_chat_pair(req.session_id, "Tóm tắt hội thoại", summary_text)
         logger.info(f"[SUMMARY] Chat history reset, only summary kept.")
     return {"answer": answer, 
             "latency": latency, "session_id": req.session_id, 
-            "chat_id": chat_id
+            "chat_id": chat_id,
+            "prompt_tokens": prompt_tokens
             }  # , "metrics": metrics
 
 @app.post("/batch_query")
@@ -303,9 +719,17 @@ async def batch_query(req: BatchQueryRequest):
     if not req.session_id or not is_valid_session(req.session_id):
         req.session_id = create_session()
     
+    # Search trong collection của session nếu session đã có tài liệu, không thì dùng collection chung
+    collection_name = get_session_collection(req.session_id)
+    if not get_documents_of_session(req.session_id):
+        collection_name = QDRANT_COLLECTION_NAME
+
     # Thực hiện batch vector search
     try:
-        batch_results = await batch_vector_search(req.queries)
+        batch_results = await batch_vector_search(
+            req.queries, hnsw_ef=req.hnsw_ef, exact=req.exact, collection_name=collection_name,
+            query_filter=search_filter_from_request(req), **search_threshold_kwargs(req)
+        )
         
         # Xử lý kết quả và tạo câu trả lời
         answers = []
@@ -313,13 +737,19 @@ async def batch_query(req: BatchQueryRequest):
             # Lưu câu hỏi
             save_chat(req.session_id, query, 1)
             
-            # Tạo context từ search results
-            context = "\n".join([result.payload.get("text", "") for result in search_result])
+            # Tạo context từ search results (dedup + token budget)
+            result_docs = points_to_documents(collection_name, collapse_to_parents(search_result))
+            context, _, _ = assemble_context(result_docs)
             
             # Gọi LLM để trả lời
             prompt = f"Context: {context}\nQuestion: {query}\nAnswer:"
+            PROMPT_TOKENS.labels(endpoint="/batch_query").observe(estimate_tokens(prompt))
+            LLM_CALLS.labels(purpose="batch").inc()
             try:
-                answer = llm.invoke(prompt)
+                with track_stage("answer_llm"):
+                    answer = await asyncio.to_thread(invoke_llm, prompt, "batch", req.session_id)
+            except LLMOverloaded:
+                raise
             except Exception:
                 answer = "Không thể trả lời câu hỏi này."
             
@@ -329,9 +759,6 @@ async def batch_query(req: BatchQueryRequest):
             save_chat(req.session_id, answer, 0)
         
         latency = time.time() - start
-        stats["num_chats"] += len(req.queries)
-        stats["llm_calls"] += len(req.queries)
-        stats["total_latency"] += latency
         
         return {
             "answers": answers, 
@@ -340,41 +767,131 @@ async def batch_query(req: BatchQueryRequest):
             "batch_size": len(req.queries)
         }
         
+    except LLMOverloaded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Batch query failed: {str(e)}")
 
 @app.post("/upload_doc")
 async def upload_doc(
+    request: Request,
     session_id: str = Form(...), 
-    files: list[UploadFile] = File(...)
+    files: list[UploadFile] = File(...),
+    text_compression: str = Form(None)  # Codec text payload của collection (chỉ áp dụng lần upload đầu)
 ):
+    return await run_with_debug(request, lambda: run_upload_doc(session_id, files, text_compression))
+
+def reuse_document_vectors(content_hash, collection_name, document_id, filename=None):
+    """Copy vector từ một bản đã ingest của cùng nội dung, trả về False nếu không còn bản nào dùng được"""
+    for source_collection, source_document_id in get_document_locations(content_hash):
+        try:
+            copied = copy_document_vectors(source_collection, source_document_id, collection_name, document_id,
+                                           source=filename)
+        except Exception as e:
+            logger.warning(f"[DEDUP] Copy from {source_collection}/{source_document_id} failed: {e}")
+            continue
+        if copied:
+            logger.info(f"[DEDUP] Reused {copied} points of {source_collection}/{source_document_id} for {document_id}")
+            return True
+        # Bản nguồn đã bị xóa khỏi Qdrant -> bỏ khỏi registry
+        remove_document_location(content_hash, source_collection, source_document_id)
+    return False
+
+def discard_document_vectors(collection_name, document_ids):
+    """Xóa vector + parent của các tài liệu đã ghi khi upload thất bại giữa chừng"""
+    from .rag_pipeline import delete_document_vectors
+    for document_id in document_ids:
+        try:
+            delete_document_vectors(collection_name, document_id)
+        except Exception as e:
+            logger.warning(f"[UPLOAD] Cleanup of {collection_name}/{document_id} failed: {e}")
+
+async def run_upload_doc(session_id, files, text_compression=None):
     start = time.time()
     if not is_valid_session(session_id):
         raise HTTPException(status_code=400, detail="Session không hợp lệ. Hãy tạo session trước khi upload file.")
+    if text_compression and text_compression not in CODECS:
+        raise HTTPException(status_code=400, detail=f"text_compression phải là một trong: {', '.join(CODECS)}")
     collection_name = get_session_collection(session_id)
-    doc_paths = []
-    document_ids = []
+    session_remaining = int(MAX_SESSION_UPLOAD_MB * MB) - get_session_upload_bytes(session_id)
+    if session_remaining <= 0:
+        raise HTTPException(status_code=413, detail=f"Session đã dùng hết giới hạn {MAX_SESSION_UPLOAD_MB}MB tài liệu.")
+    # Tài liệu đã có trong session (kể cả trùng nhau trong cùng request): content_hash -> document_id
+    session_hashes = {doc["content_hash"]: doc["document_id"]
+                      for doc in get_documents_of_session(session_id) if doc.get("content_hash")}
+    tmp_paths = []
     file_infos = []
-    for file in files:
-        file_start = time.time()
-        document_id = str(uuid.uuid4())
-        content = await file.read()
-        size_mb = round(len(content) / (1024 * 1024), 2)
-        with tempfile.NamedTemporaryFile(delete=False, suffix="_" + file.filename) as tmp:
-            tmp.write(content)
-            tmp_path = tmp.name
-        doc_paths.append(tmp_path)
-        document_ids.append(document_id)
-        add_document_to_session(session_id, document_id, file.filename, size_mb)
-        file_infos.append({
-            "filename": file.filename,
-            "size_mb": size_mb,
-            "upload_time": round(time.time() - file_start, 3)
-        })
+    reuse_infos = []  # (info, tmp_path): nội dung đã ingest ở session khác, thử copy vector
+    ingest_infos = []  # (info, tmp_path): cần parse/chunk/embed
     try:
-        retriever = load_and_setup_rag(doc_paths, collection_name, document_ids)
-    except Exception as e:
-        return HTTPException(status_code=500, detail=f"Upload thất bại: {e}")
+        # Đọc và kiểm tra giới hạn mọi file trước khi ghi gì vào Qdrant: file sau bị 413 thì chưa có vector nào
+        for file in files:
+            file_start = time.time()
+            document_id = str(uuid.uuid4())
+            max_bytes = min(int(MAX_UPLOAD_FILE_MB * MB), session_remaining)
+            tmp_path, size_bytes, content_hash = await save_upload_to_disk(file, max_bytes)
+            tmp_paths.append(tmp_path)
+            info = {
+                "filename": file.filename,
+                "document_id": document_id,
+                "size_mb": round(size_bytes / MB, 2),
+                "size_bytes": size_bytes,
+                "content_hash": content_hash,
+                "deduplicated": None,
+            }
+            file_infos.append(info)
+            if content_hash in session_hashes:
+                # Upload lại file session đã có: không tạo tài liệu mới
+                info["document_id"] = session_hashes[content_hash]
+                info["deduplicated"] = "session"
+                CACHE_EVENTS.labels(cache="document_dedup", result="hit").inc()
+            else:
+                if get_document_locations(content_hash):
+                    reuse_infos.append((info, tmp_path))
+                else:
+                    CACHE_EVENTS.labels(cache="document_dedup", result="miss").inc()
+                    ingest_infos.append((info, tmp_path))
+                session_remaining -= size_bytes
+                session_hashes[content_hash] = document_id
+            info["upload_time"] = round(time.time() - file_start, 3)
+        written_ids = []
+        try:
+            for info, tmp_path in reuse_infos:
+                copy_start = time.time()
+                written_ids.append(info["document_id"])
+                # Scroll/upsert Qdrant là blocking: chạy ngoài event loop
+                reused = await asyncio.to_thread(reuse_document_vectors, info["content_hash"], collection_name,
+                                                 info["document_id"], info["filename"])
+                if reused:
+                    # Tài liệu đã ingest ở session khác: copy vector, bỏ qua parse/chunk/embed
+                    info["deduplicated"] = "reused"
+                    CACHE_EVENTS.labels(cache="document_dedup", result="hit").inc()
+                else:
+                    CACHE_EVENTS.labels(cache="document_dedup", result="miss").inc()
+                    ingest_infos.append((info, tmp_path))
+                info["upload_time"] = round(info["upload_time"] + time.time() - copy_start, 3)
+            if ingest_infos:
+                # Ingest từng file một: file N lỗi thì file 1..N-1 đã upsert, nên dọn cả các document_id này
+                written_ids.extend(info["document_id"] for info, _ in ingest_infos)
+                retriever = load_and_setup_rag([path for _, path in ingest_infos], collection_name,
+                                               [info["document_id"] for info, _ in ingest_infos],
+                                               [info["filename"] for info, _ in ingest_infos], text_compression)
+        except Exception as e:
+            # Chưa có metadata nên /list_docs, /delete_doc không thấy các vector/parent này: xóa ngay
+            await asyncio.to_thread(discard_document_vectors, collection_name, written_ids)
+            raise HTTPException(status_code=500, detail=f"Upload thất bại: {e}")
+    finally:
+        # Temp file chỉ cần trong lúc ingest, xóa dù thành công hay thất bại
+        remove_temp_files(tmp_paths)
+    new_infos = [info for info, _ in reuse_infos if info["deduplicated"] == "reused"] + [info for info, _ in ingest_infos]
+    # Chỉ ghi metadata khi ingest thành công để /list_docs không hiện tài liệu không có vector
+    for info in new_infos:
+        add_document_to_session(session_id, info["document_id"], info["filename"], info["size_mb"],
+                                info["size_bytes"], info["content_hash"])
+        add_document_location(info["content_hash"], collection_name, info["document_id"])
+    if new_infos:
+        # Dọn cache version cũ ngoài event loop
+        await asyncio.to_thread(bump_docset_version, session_id)
     latency = round(time.time() - start, 3)
     return {
         "success": True,
@@ -391,9 +908,9 @@ def list_docs(session_id: str):
     docs = get_documents_of_session(session_id)
     if not docs:
         logger.warning(f"[LIST_DOCS] No documents found for session {session_id}")
-        return {"documents": [], "latency": round(time.time() - start, 3)}
+        return {"documents": [], "docset_version": get_docset_version(session_id), "latency": round(time.time() - start, 3)}
     latency = time.time() - start
-    return {"documents": docs, "latency": latency}
+    return {"documents": docs, "docset_version": get_docset_version(session_id), "latency": latency}
 
 @app.delete("/delete_doc")
 def delete_doc(session_id: str, document_id: str):
@@ -404,19 +921,33 @@ def delete_doc(session_id: str, document_id: str):
     # Xóa vector trong Qdrant
     from .rag_pipeline import delete_document_vectors
     delete_document_vectors(collection_name, document_id)
+    content_hash = redis_client.hget(f"document:{document_id}:meta", "content_hash")
+    if content_hash:
+        remove_document_location(content_hash.decode(), collection_name, document_id)
     # Xóa metadata
     remove_document_from_session(session_id, document_id)
+    bump_docset_version(session_id)
     latency = time.time() - start
     return {"success": True, "deleted": document_id, "latency": latency}
 
 @app.get("/history")
-def history(session_id: str):
+def history(session_id: str, limit: int = HISTORY_PAGE_SIZE, before: str = None):
+    """Lịch sử chat mới -> cũ theo trang; trang tiếp theo: `before=<next_cursor>`.
+
+    409 nếu cursor thuộc history đã bị tóm tắt/xóa: client tải lại từ trang mới nhất.
+    """
     start = time.time()
     if not is_valid_session(session_id):
-        return {"history": [], "latency": 0}
-    chats = get_chat_history_pairs(session_id)
+        return ORJSONResponse({"history": [], "next_cursor": None, "total": 0, "latency": 0})
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    try:
+        chats, next_cursor, total = get_chat_history_page(session_id, limit, before)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except StaleHistoryCursor:
+        raise HTTPException(status_code=409, detail="Lịch sử chat đã thay đổi (tóm tắt/xóa), hãy tải lại từ trang mới nhất.")
     latency = time.time() - start
-    return {"history": chats, "latency": latency}
+    return ORJSONResponse({"history": chats, "next_cursor": next_cursor, "total": total, "latency": latency})
 
 @app.delete("/history")
 def delete_history(session_id: str):
@@ -455,11 +986,34 @@ def summary(session_id: str):
     # Tóm tắt bằng Gemini
     prompt = f"Tóm tắt ngắn gọn đoạn hội thoại sau (dưới 3 câu):\n{chat_text}"
     try:
-        from .rag_pipeline import llm
-        summary_raw = llm.invoke(prompt)
+        LLM_CALLS.labels(purpose="summary").inc()
+        with track_stage("summary_llm"):
+            summary_raw = invoke_llm(prompt, "summary", session_id)
         summary_text = get_llm_text(summary_raw)
         redis_client.set(summary_key, summary_text)
     except Exception:
         summary_text = "Không thể tóm tắt."
     latency = time.time() - start
-    return {"summary": summary_text, "latency": latency}
\ No newline at end of file
+    return {"summary": summary_text, "latency": latency}
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics (gộp từ mọi worker khi đặt PROMETHEUS_MULTIPROC_DIR)"""
+    data, content_type = render_metrics()
+    return Response(content=data, media_type=content_type)
+
+@app.get("/debug/profile/{profile_id}")
+def get_profile(profile_id: str, format: str = "prof"):
+    """Tải file cProfile (.prof, mở bằng snakeviz/pstats) hoặc bản text tóm tắt (?format=text)"""
+    try:
+        path = profile_path(profile_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="profile_id không hợp lệ.")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Không tìm thấy profile.")
+    if format == "text":
+        return PlainTextResponse(profile_summary(profile_id))
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
+
+startup_state["import_seconds"] = time.perf_counter() - _IMPORT_START
+STARTUP_SECONDS.labels(phase="import").set(startup_state["import_seconds"])
@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess, REGISTRY
+)
+
+# Khi chạy nhiều uvicorn worker, đặt PROMETHEUS_MULTIPROC_DIR (thư mục rỗng, xóa sạch mỗi lần khởi động)
+# để các worker ghi metric ra file mmap và /metrics gộp lại từ tất cả worker.
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+STAGE_LATENCY = Histogram(
+    "rag_stage_latency_seconds", "Latency của từng stage trong pipeline",
+    ["stage"], buckets=LATENCY_BUCKETS,
+)
+REQUEST_LATENCY = Histogram(
+    "rag_request_latency_seconds", "Latency end-to-end theo endpoint",
+    ["endpoint"], buckets=LATENCY_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "rag_requests_in_flight", "Số request đang xử lý theo endpoint",
+    ["endpoint"], multiprocess_mode="livesum",
+)
+LLM_CALLS = Counter("rag_llm_calls_total", "Số lần gọi LLM", ["purpose"])
+ERRORS = Counter("rag_errors_total", "Số lỗi theo stage", ["stage"])
+CACHE_EVENTS = Counter("rag_cache_events_total", "Cache hit/miss theo loại cache", ["cache", "result"])
+REWRITE_DECISIONS = Counter("rag_rewrite_decisions_total", "Kết quả bước rewrite query", ["result"])
+SPECULATION = Counter("rag_speculation_total", "Kết quả speculative retrieval", ["result"])
+SPECULATION_SAVED = Histogram(
+    "rag_speculation_saved_seconds", "Latency tiết kiệm được nhờ speculative retrieval (ước lượng)",
+    buckets=(-0.5, -0.1, 0, 0.05, 0.1, 0.25, 0.5, 1, 2),
+)
+STARTUP_SECONDS = Gauge(
+    "rag_startup_seconds", "Thời gian import module và tới khi worker sẵn sàng", ["phase"], multiprocess_mode="max",
+)
+EMBEDDING_BATCH_SIZE = Histogram(
+    "rag_embedding_batch_size", "Số query được gom vào một lần embed (micro-batching)",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+LLM_QUEUE_DEPTH = Gauge(
+    "rag_llm_queue_depth", "Số lời gọi LLM đang chờ trong scheduler", ["priority"], multiprocess_mode="livesum",
+)
+LLM_IN_FLIGHT = Gauge("rag_llm_in_flight", "Số lời gọi LLM đang chạy", multiprocess_mode="livesum")
+LLM_QUEUE_WAIT = Histogram(
+    "rag_llm_queue_wait_seconds", "Thời gian chờ slot LLM trong scheduler", ["priority"], buckets=LATENCY_BUCKETS,
+)
+LLM_SHED = Counter("rag_llm_shed_total", "Số lời gọi LLM bị từ chối do quá tải", ["priority", "reason"])
+COALESCED_CALLS = Counter(
+    "rag_coalesced_calls_total", "Số lời gọi dùng chung kết quả của lời gọi giống hệt đang chạy", ["kind"],
+)
+LLM_UPSTREAM_CALLS = Counter(
+    "rag_llm_upstream_calls_total", "Số lời gọi thực sự gửi tới LLM (hedge / primary = chi phí hedging)", ["attempt"],
+)
+LLM_UPSTREAM_LATENCY = Histogram(
+    "rag_llm_upstream_latency_seconds", "Latency từng lời gọi LLM", ["attempt"], buckets=LATENCY_BUCKETS,
+)
+LLM_HEDGES = Counter(
+    "rag_llm_hedges_total", "Kết quả hedging: won/lost/timeout/skipped_budget/skipped_capacity", ["result"],
+)
+LOCAL_INDEX_BYTES = Gauge(
+    "rag_local_index_bytes", "Dung lượng ước lượng của các local index đang giữ", multiprocess_mode="livesum",
+)
+LLM_TIMEOUTS = Counter("rag_llm_timeouts_total", "Số lời gọi LLM vượt deadline", ["purpose"])
+PROMPT_TOKENS = Histogram("rag_prompt_tokens", "Số token ước lượng của prompt", ["endpoint"], buckets=TOKEN_BUCKETS)
+
+
+class RequestTimings:
+    """Gom latency theo stage của một request (chỉ tồn tại khi request bật debug)"""
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()  # stage có thể chạy trong worker thread (asyncio.to_thread)
+
+    def add(self, stage, elapsed):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"seconds": 0.0, "count": 0})
+            entry["seconds"] += elapsed
+            entry["count"] += 1
+
+
+# None khi request không bật debug -> track_stage chỉ tốn 1 lần get()
+current_request_timings = ContextVar("current_request_timings", default=None)
+
+
+@contextmanager
+def track_stage(stage):
+    """Đo latency của một stage, đếm lỗi nếu có exception. Dùng được như context manager hoặc decorator"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.labels(stage=stage).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.labels(stage=stage).observe(elapsed)
+        timings = current_request_timings.get()
+        if timings is not None:
+            timings.add(stage, elapsed)
+
+
+def render_metrics():
+    """Xuất metrics theo Prometheus text format, gộp từ mọi worker nếu chạy multiprocess"""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_worker_dead(pid=None):
+    """Dọn file gauge 'live' của worker khi shutdown"""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid or os.getpid())
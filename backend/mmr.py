@@ -0,0 +1,43 @@
+"""Maximal marginal relevance (MMR): chọn k chunk vừa liên quan đến câu hỏi vừa khác nhau.
+
+Top-k thuần theo score hay lấy nhiều chunk gần giống nhau (các trang liên tiếp nói cùng một ý).
+MMR chọn tham lam: mỗi bước lấy candidate có
+    lambda * sim(query, c) - (1 - lambda) * max sim(c, đã chọn)
+lớn nhất. Mọi phép tính đều là phép nhân ma trận/vector của NumPy, không có vòng lặp Python theo cặp.
+"""
+import numpy as np
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def mmr_select(query_vector, candidate_vectors, k, lambda_mult=0.5):
+    """Trả về index (theo thứ tự được chọn) của tối đa k candidate.
+
+    query_vector: (dim,), candidate_vectors: (n, dim). lambda_mult = 1 tương đương top-k theo cosine.
+    """
+    candidates = _normalize_rows(np.asarray(candidate_vectors, dtype=np.float32))
+    n = candidates.shape[0]
+    if n == 0 or k <= 0:
+        return []
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+
+    relevance = candidates @ query
+    first = int(np.argmax(relevance))
+    selected = [first]
+    # Similarity lớn nhất của mỗi candidate với tập đã chọn, cập nhật bằng một matrix-vector product mỗi bước
+    max_similarity = candidates @ candidates[first]
+    chosen = np.zeros(n, dtype=bool)
+    chosen[first] = True
+    for _ in range(min(k, n) - 1):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[chosen] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        chosen[best] = True
+        np.maximum(max_similarity, candidates @ candidates[best], out=max_similarity)
+    return selected
@@ -0,0 +1,115 @@
+"""Embedding backend ONNX Runtime (int8 dynamic quantization) cho vietnamese-bi-encoder trên CPU.
+
+Cùng interface với HuggingFaceEmbeddings (`embed_documents`, `embed_query`), bật bằng EMBEDDING_PROVIDER=onnx.
+Lần đầu dùng sẽ export model sang ONNX và quantize nếu ONNX_MODEL_DIR chưa có sẵn.
+"""
+import os
+import numpy as np
+from .config import (
+    EMBEDDING_MODEL, ONNX_MODEL_DIR, ONNX_QUANTIZE, ONNX_INTRA_OP_THREADS, ONNX_BATCH_SIZE, EMBEDDING_MAX_LENGTH
+)
+
+FP32_FILE = "model.onnx"
+INT8_FILE = "model.int8.onnx"
+
+
+def export_onnx_model(model_name=EMBEDDING_MODEL, output_dir=ONNX_MODEL_DIR, max_length=EMBEDDING_MAX_LENGTH):
+    """Export transformer encoder sang ONNX (dynamic batch/seq) và tạo bản quantize int8 dynamic"""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+    tokenizer.save_pretrained(output_dir)
+
+    sample = tokenizer(["xin chào"], return_tensors="pt", padding=True, truncation=True, max_length=max_length)
+    fp32_path = os.path.join(output_dir, FP32_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"},
+            },
+            opset_version=14,
+        )
+    # Dynamic quantization: weight int8, activation quantize lúc chạy -> không cần dữ liệu calibration
+    quantize_dynamic(fp32_path, os.path.join(output_dir, INT8_FILE), weight_type=QuantType.QInt8)
+    print(f"[ONNX] Exported {model_name} to {output_dir}")
+    return output_dir
+
+
+class OnnxEmbeddings:
+    """Mean pooling trên last_hidden_state, giống pooling của sentence-transformers model gốc"""
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, quantized=ONNX_QUANTIZE, intra_op_threads=ONNX_INTRA_OP_THREADS,
+                 batch_size=ONNX_BATCH_SIZE, max_length=EMBEDDING_MAX_LENGTH):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_file = os.path.join(model_dir, INT8_FILE if quantized else FP32_FILE)
+        if not os.path.exists(model_file):
+            export_onnx_model(output_dir=model_dir, max_length=max_length)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(model_file, sess_options=options, providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.model_file = model_file
+
+    def _encode_batch(self, texts):
+        encoded = self.tokenizer(
+            texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np"
+        )
+        input_ids = encoded["input_ids"].astype(np.int64)
+        attention_mask = encoded["attention_mask"].astype(np.int64)
+        hidden = self.session.run(None, {"input_ids": input_ids, "attention_mask": attention_mask})[0]
+        mask = attention_mask[..., None].astype(np.float32)
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        # Sắp theo độ dài để mỗi batch ít padding, sau đó trả về đúng thứ tự ban đầu
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch_ids = order[start:start + self.batch_size]
+            batch_vectors = self._encode_batch([texts[i] for i in batch_ids])
+            for i, vector in zip(batch_ids, batch_vectors):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text):
+        return self._encode_batch([text])[0].tolist()
+
+
+def parity_check(reference, candidate, texts):
+    """So sánh cosine giữa embedding của model tham chiếu và backend mới trên cùng tập text"""
+    ref = np.asarray(reference.embed_documents(texts), dtype=np.float32)
+    cand = np.asarray(candidate.embed_documents(texts), dtype=np.float32)
+    ref /= np.linalg.norm(ref, axis=1, keepdims=True)
+    cand /= np.linalg.norm(cand, axis=1, keepdims=True)
+    cosines = (ref * cand).sum(axis=1)
+    # Độ trùng top-1 láng giềng: thứ tự tương đối giữa các text có được giữ nguyên không
+    ref_nn = np.argsort(-(ref @ ref.T), axis=1)[:, 1]
+    cand_nn = np.argsort(-(cand @ cand.T), axis=1)[:, 1]
+    return {
+        "mean_cosine": float(cosines.mean()),
+        "min_cosine": float(cosines.min()),
+        "p5_cosine": float(np.percentile(cosines, 5)),
+        "nearest_neighbor_agreement": float((ref_nn == cand_nn).mean()),
+    }
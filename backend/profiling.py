@@ -0,0 +1,115 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+from .config import DEBUG_PROFILING_ENABLED, PROFILE_DIR, PROFILE_MAX_FILES
+from .metrics import RequestTimings, current_request_timings
+
+_PROFILE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+# cProfile gắn với thread của event loop (dùng chung mọi request): chỉ cho một profile chạy tại một thời điểm
+_profile_lock = threading.Lock()
+PROFILE_SCOPE = "event loop thread only; includes other requests' coroutines, excludes asyncio.to_thread work"
+
+
+def get_debug_options(request):
+    """Đọc cờ debug từ header `X-Debug` hoặc query `?debug=` (giá trị: timing | profile).
+
+    Trả về None khi không bật debug để endpoint đi thẳng vào nhánh bình thường.
+    """
+    value = request.headers.get("x-debug") or request.query_params.get("debug")
+    if not value:
+        return None
+    value = value.lower()
+    return {"profile": value == "profile" and DEBUG_PROFILING_ENABLED}
+
+
+class RequestDebug:
+    """Bật breakdown latency theo stage (và cProfile nếu yêu cầu) trong phạm vi một request.
+
+    cProfile chỉ ghi nhận thread đang chạy event loop, nên các stage chạy trong
+    worker thread (asyncio.to_thread) chỉ xuất hiện trong breakdown, không có trong profile; ngược lại
+    coroutine của request khác chạy xen kẽ trên loop cũng bị ghi vào. Mỗi lúc chỉ một request được
+    profile, request khác yêu cầu profile trong lúc đó chỉ nhận breakdown.
+    """
+
+    def __init__(self, profile=False):
+        self.timings = RequestTimings()
+        self.profile = profile
+        self.profiler = None
+        self.profile_id = None
+        self.profile_skipped = None
+        self._token = None
+        self._start = None
+        self.total = 0.0
+
+    def __enter__(self):
+        self._token = current_request_timings.set(self.timings)
+        if self.profile:
+            if _profile_lock.acquire(blocking=False):
+                self.profiler = cProfile.Profile()
+                self.profiler.enable()
+            else:
+                self.profile_skipped = "another request is being profiled"
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.total = time.perf_counter() - self._start
+        if self.profiler is not None:
+            try:
+                self.profiler.disable()
+                self.profile_id = uuid.uuid4().hex
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                self.profiler.dump_stats(profile_path(self.profile_id))
+                prune_profiles()
+            finally:
+                _profile_lock.release()
+        current_request_timings.reset(self._token)
+        return False
+
+    def report(self):
+        stages = {
+            stage: {"seconds": round(entry["seconds"], 4), "count": entry["count"]}
+            for stage, entry in sorted(self.timings.stages.items(), key=lambda item: -item[1]["seconds"])
+        }
+        report = {"total_seconds": round(self.total, 4), "stages": stages}
+        if self.profile_id:
+            report["profile_id"] = self.profile_id
+            report["profile_url"] = f"/debug/profile/{self.profile_id}"
+            report["profile_scope"] = PROFILE_SCOPE
+        elif self.profile_skipped:
+            report["profile_skipped"] = self.profile_skipped
+        return report
+
+
+def profile_path(profile_id):
+    if not _PROFILE_ID_RE.match(profile_id):
+        raise ValueError(f"Invalid profile id: {profile_id}")
+    return os.path.join(PROFILE_DIR, f"{profile_id}.prof")
+
+
+def prune_profiles(max_files=PROFILE_MAX_FILES):
+    """Xóa các file .prof cũ nhất (theo mtime), chỉ giữ lại `max_files` file"""
+    try:
+        entries = [entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith(".prof")]
+    except FileNotFoundError:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[max_files:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def profile_summary(profile_id, limit=50):
+    """Text top hàm theo cumulative time từ file .prof"""
+    stream = io.StringIO()
+    stats = pstats.Stats(profile_path(profile_id), stream=stream)
+    stats.sort_stats("cumulative").print_stats(limit)
+    return stream.getvalue()
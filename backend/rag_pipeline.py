@@ -1,21 +1,30 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain.prompts import PromptTemplate
-from langchain.chains import ConversationalRetrievalChain
-from langchain_experimental.text_splitter import SemanticChunker
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
-from langchain_qdrant.qdrant import QdrantVectorStore
-from qdrant_client import QdrantClient
 from qdrant_client.http.exceptions import UnexpectedResponse
-from qdrant_client.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue, PayloadSchemaType
+from qdrant_client.models import (
+    Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue, MatchAny, Range, PayloadSchemaType,
+    HnswConfigDiff, SearchParams
+)
 from .config import (
     GEMINI_API_KEY, GEMINI_MODEL, QDRANT_URL, QDRANT_COLLECTION_NAME, QDRANT_API_KEY,
-    QDRANT_VECTOR_SIZE, QDRANT_BATCH_SIZE, CHUNK_SIZE, TOP_K, SEARCH_LIMIT
+    QDRANT_VECTOR_SIZE, QDRANT_BATCH_SIZE, QDRANT_COPY_BATCH_SIZE, CHUNK_SIZE, TOP_K, SEARCH_LIMIT,
+    LLM_PROVIDER, EMBEDDING_PROVIDER, EMBEDDING_MODEL, EMBEDDING_MICRO_BATCHING, REQUEST_COALESCING, HNSW_M, HNSW_EF_CONSTRUCT,
+    SEARCH_HNSW_EF, SEARCH_ADAPTIVE_EF, SEARCH_EXACT_THRESHOLD, SEARCH_LATENCY_TARGET_MS,
+    SEARCH_EF_MIN, SEARCH_EF_MAX, SEARCH_SCORE_THRESHOLD, MMR_ENABLED, MMR_FETCH_K, MMR_LAMBDA,
+    LOCAL_INDEX_ENABLED, LOCAL_INDEX_MAX_POINTS, PARENT_CHILD_INDEXING, CHILD_CHUNK_SIZE, CHILD_CHUNK_OVERLAP
 )
 import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
 from typing import List
 import uuid
 from fastapi import HTTPException
+from .metrics import track_stage, CACHE_EVENTS
+from .local_index import local_indexes, build_local_index
+from .mmr import mmr_select
+from .singleflight import SingleFlight
+from .db import set_parents, get_parents, copy_parents, delete_parents
+from .text_codec import get_text_encoder, payload_text
 
 # Prompt
 BASE_PROMPT = """
@@ -25,46 +34,145 @@ If you don't know, say you don't know. Be concise (max 3 sentences). Return only
 {"context": "...", "answer": "..."}
 """
 
-prompt = PromptTemplate.from_template(BASE_PROMPT)
-
-# LLM & Embedding
-llm = ChatGoogleGenerativeAI(model=GEMINI_MODEL, 
-                             google_api_key=GEMINI_API_KEY)
-
-embedding = HuggingFaceEmbeddings(
-    model_name="bkai-foundation-models/vietnamese-bi-encoder"
-    )
-
-# kết nối Qdrant client
-qdrant_client = QdrantClient(
-    url=QDRANT_URL,
-    api_key=QDRANT_API_KEY,
-    )
+# LLM, embedding, Qdrant client và chunker được khởi tạo lazy (lần dùng đầu tiên hoặc lúc warmup)
+# để import module nhanh và lỗi kết nối không làm hỏng cả worker.
+_components = {}
+_components_lock = threading.RLock()  # chunker khởi tạo lồng embedding
+
+def _get_component(name, factory):
+    component = _components.get(name)
+    if component is None:
+        with _components_lock:
+            component = _components.get(name)
+            if component is None:
+                start = time.perf_counter()
+                component = factory()
+                _components[name] = component
+                print(f"[INIT] {name} initialized in {time.perf_counter() - start:.2f}s")
+    return component
+
+def _create_llm():
+    if LLM_PROVIDER == "stub":
+        from .stubs import StubLLM
+        return StubLLM()
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model=GEMINI_MODEL, 
+                                  google_api_key=GEMINI_API_KEY)
+
+def _create_embedding():
+    if EMBEDDING_PROVIDER == "remote":
+        # Weights nằm ở embedding sidecar, sidecar tự gom batch giữa các worker
+        from .embedding_service import RemoteEmbeddings
+        backend = RemoteEmbeddings()
+    else:
+        backend = _create_embedding_backend()
+        if EMBEDDING_MICRO_BATCHING:
+            from .embedding_service import BatchingEmbeddings
+            backend = BatchingEmbeddings(backend)
+    if REQUEST_COALESCING:
+        from .embedding_service import CoalescingEmbeddings
+        backend = CoalescingEmbeddings(backend)
+    return backend
+
+def _create_embedding_backend(provider=EMBEDDING_PROVIDER):
+    if provider == "stub":
+        from .stubs import StubEmbeddings
+        return StubEmbeddings()
+    if provider == "onnx":
+        from .onnx_embedding import OnnxEmbeddings
+        return OnnxEmbeddings()
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL
+        )
 
-# Semantic chunking
-chunker = SemanticChunker(embeddings=embedding, min_chunk_size=CHUNK_SIZE)
+def _create_qdrant_client():
+    from qdrant_client import QdrantClient
+    # QDRANT_URL=":memory:" để chạy Qdrant local in-process
+    if QDRANT_URL == ":memory:":
+        return QdrantClient(location=":memory:")
+    return QdrantClient(
+        url=QDRANT_URL,
+        api_key=QDRANT_API_KEY,
+        )
 
-def create_collection_if_not_exists(collection_name):
-    """Tạo collection trên qdrant nếu chưa tồn tại và đảm bảo có index cho document_id"""
+def _create_chunker():
+    # Semantic chunking
+    from langchain_experimental.text_splitter import SemanticChunker
+    return SemanticChunker(embeddings=get_embedding(), min_chunk_size=CHUNK_SIZE)
+
+def get_llm():
+    return _get_component("llm", _create_llm)
+
+def get_embedding():
+    return _get_component("embedding", _create_embedding)
+
+def get_qdrant_client():
+    return _get_component("qdrant_client", _create_qdrant_client)
+
+def get_chunker():
+    return _get_component("chunker", _create_chunker)
+
+_LAZY_ATTRIBUTES = {"llm": get_llm, "embedding": get_embedding, "qdrant_client": get_qdrant_client, "chunker": get_chunker}
+
+def __getattr__(name):
+    # Giữ tương thích `rag_pipeline.llm`, `rag_pipeline.embedding`... cho code bên ngoài module
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def warmup():
+    """Khởi tạo mọi component và chạy embedding giả để load weights/kernel trước khi nhận traffic"""
+    timings = {}
+    start = time.perf_counter()
+    get_llm()
+    timings["llm"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    embedder = get_embedding()
+    embedder.embed_query("khởi động mô hình")
+    embedder.embed_documents(["khởi động mô hình embedding", "câu thứ hai để chạy batch"])
+    timings["embedding"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    get_qdrant_client().get_collections()
+    timings["qdrant"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    get_chunker()
+    timings["chunker"] = time.perf_counter() - start
+    return timings
+
+# Payload index cho các field dùng để lọc khi search (document_id, tên file, số trang)
+PAYLOAD_INDEXES = {
+    "document_id": PayloadSchemaType.KEYWORD,
+    "source": PayloadSchemaType.KEYWORD,
+    "metadata.page": PayloadSchemaType.INTEGER,
+}
+
+def create_collection_if_not_exists(collection_name, hnsw_config=None):
+    """Tạo collection trên qdrant nếu chưa tồn tại và đảm bảo có payload index cho các field lọc"""
     try:
-        qdrant_client.get_collection(collection_name)
+        get_qdrant_client().get_collection(collection_name)
     except Exception:
-        qdrant_client.create_collection(
+        get_qdrant_client().create_collection(
             collection_name=collection_name,
             vectors_config=VectorParams(
                 size=QDRANT_VECTOR_SIZE,
                 distance=Distance.COSINE
-            )
+            ),
+            hnsw_config=hnsw_config or HnswConfigDiff(m=HNSW_M, ef_construct=HNSW_EF_CONSTRUCT)
         )
-    # Đảm bảo luôn có index cho document_id
-    try:
-        qdrant_client.create_payload_index(
-            collection_name=collection_name,
-            field_name="document_id",
-            field_schema=PayloadSchemaType.KEYWORD
-        )
-    except Exception as e:
-        print(f"[DEBUG] Index for document_id may already exist: {e}")
+    # Đảm bảo luôn có index cho các field lọc
+    for field_name, field_schema in PAYLOAD_INDEXES.items():
+        try:
+            get_qdrant_client().create_payload_index(
+                collection_name=collection_name,
+                field_name=field_name,
+                field_schema=field_schema
+            )
+        except Exception as e:
+            print(f"[DEBUG] Index for {field_name} may already exist: {e}")
 
 def batch_embed_documents(documents: List, batch_size: int = QDRANT_BATCH_SIZE):
     """Embed documents theo batch để tối ưu IO"""
@@ -72,7 +180,8 @@ def batch_embed_documents(documents: List, batch_size: int = QDRANT_BATCH_SIZE):
     for i in range(0, len(documents), batch_size):
         batch = documents[i:i + batch_size]
         batch_texts = [doc.page_content for doc in batch]
-        batch_embeddings = embedding.embed_documents(batch_texts)
+        with track_stage("ingestion_embedding"):
+            batch_embeddings = get_embedding().embed_documents(batch_texts)
         embeddings.extend(batch_embeddings)
     return embeddings
 
@@ -82,7 +191,7 @@ def ingest_documents_batch(documents):
     create_collection_if_not_exists(QDRANT_COLLECTION_NAME)
 
     # Semantic chunking
-    docs = chunker.split_documents(documents)
+    docs = get_chunker().split_documents(documents)
 
     # Batch embedding
     embeddings = batch_embed_documents(docs)
@@ -104,16 +213,17 @@ def ingest_documents_batch(documents):
     # Batch upload to Qdrant
     for i in range(0, len(points), QDRANT_BATCH_SIZE):
         batch_points = points[i:i + QDRANT_BATCH_SIZE]
-        qdrant_client.upsert(
+        get_qdrant_client().upsert(
             collection_name=QDRANT_COLLECTION_NAME,
             points=batch_points
         )
 
     # Tạo Qdrant vector store cho LangChain
+    from langchain_qdrant.qdrant import QdrantVectorStore
     vector_store = QdrantVectorStore(
-        client=qdrant_client,
+        client=get_qdrant_client(),
         collection_name=QDRANT_COLLECTION_NAME,
-        embedding=embedding
+        embedding=get_embedding()
     )
 
     return vector_store
@@ -122,15 +232,47 @@ def ingest_documents(documents):
     """Wrapper cho backward compatibility"""
     return ingest_documents_batch(documents)
 
-def ingest_documents_to_collection(documents, collection_name, document_id):
+def ingest_documents_to_collection(documents, collection_name, document_id, source=None, text_compression=None):
+    """Ingest tài liệu vào collection. `source` là tên file gốc (mặc định lấy từ loader, thường là đường dẫn temp).
+
+    text_compression ("none" | "zstd"): codec text payload, chỉ có hiệu lực ở lần ingest đầu của collection.
+    """
     create_collection_if_not_exists(collection_name)
-    docs = chunker.split_documents(documents)
+    local_indexes.invalidate(collection_name)
+    if source:
+        for doc in documents:
+            doc.metadata["source"] = source
+    with track_stage("chunking"):
+        docs = get_chunker().split_documents(documents)
     
     # DEBUG: Log document processing
     print(f"[DEBUG] Processing {len(documents)} documents into {len(docs)} chunks")
     for i, doc in enumerate(docs[:3]):  # Log first 3 chunks
         print(f"[DEBUG] Chunk {i}: content_length={len(doc.page_content)}, content_preview={doc.page_content[:100]}...")
     
+    if PARENT_CHILD_INDEXING:
+        points = build_parent_child_points(docs, collection_name, document_id, text_compression)
+    else:
+        points = build_chunk_points(docs, collection_name, document_id, text_compression)
+    
+    print(f"[DEBUG] Created {len(points)} valid points for ingestion")
+    
+    # Batch upload to Qdrant
+    for i in range(0, len(points), QDRANT_BATCH_SIZE):
+        batch_points = points[i:i + QDRANT_BATCH_SIZE]
+        try:
+            with track_stage("upsert"):
+                get_qdrant_client().upsert(
+                    collection_name=collection_name,
+                    points=batch_points
+                )
+            print(f"[DEBUG] Uploaded batch {i//QDRANT_BATCH_SIZE + 1}: {len(batch_points)} points")
+        except Exception as e:
+            print(f"[ERROR] Failed to upload batch {i//QDRANT_BATCH_SIZE + 1}: {e}")
+
+def build_chunk_points(docs, collection_name, document_id, text_compression=None):
+    """Mỗi chunk là một point, payload chứa toàn bộ text (nén nếu collection dùng zstd) + metadata"""
+    encoder = get_text_encoder(collection_name, [doc.page_content.strip() for doc in docs], text_compression)
     embeddings = batch_embed_documents(docs)
     points = []
     
@@ -144,7 +286,7 @@ def ingest_documents_to_collection(documents, collection_name, document_id):
             id=str(uuid.uuid4()),
             vector=embedding_vector,
             payload={
-                "text": doc.page_content.strip(),  # FIX: Strip whitespace
+                **encoder.encode(doc.page_content.strip()),  # FIX: Strip whitespace
                 "metadata": doc.metadata,
                 "chunk_id": i,
                 "document_id": document_id,
@@ -154,24 +296,55 @@ def ingest_documents_to_collection(documents, collection_name, document_id):
             }
         )
         points.append(point)
-    
-    print(f"[DEBUG] Created {len(points)} valid points for ingestion")
-    
-    # Batch upload to Qdrant
-    for i in range(0, len(points), QDRANT_BATCH_SIZE):
-        batch_points = points[i:i + QDRANT_BATCH_SIZE]
-        try:
-            qdrant_client.upsert(
-                collection_name=collection_name,
-                points=batch_points
-            )
-            print(f"[DEBUG] Uploaded batch {i//QDRANT_BATCH_SIZE + 1}: {len(batch_points)} points")
-        except Exception as e:
-            print(f"[ERROR] Failed to upload batch {i//QDRANT_BATCH_SIZE + 1}: {e}")
+    return points
+
+def build_parent_child_points(docs, collection_name, document_id, text_compression=None):
+    """Parent = chunk semantic (đưa vào prompt), child = đoạn nhỏ cắt từ parent (được embed và search).
+
+    Parent được lưu một lần trong Redis, text nén theo codec của collection như payload chunk thường.
+    Payload của child chỉ có id (document_id, parent_id) cùng source/page để lọc bằng payload index.
+    """
+    from langchain.docstore.document import Document
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHILD_CHUNK_SIZE, chunk_overlap=CHILD_CHUNK_OVERLAP)
+    encoder = get_text_encoder(collection_name, [doc.page_content.strip() for doc in docs], text_compression)
+    parents = {}
+    children = []
+    for i, doc in enumerate(docs):
+        text = doc.page_content.strip()
+        if not text:
+            print(f"[WARNING] Empty content in chunk {i}, skipping")
+            continue
+        parent_id = str(i)
+        parents[parent_id] = {**encoder.encode(text), "metadata": doc.metadata}
+        for child_text in splitter.split_text(text):
+            children.append(Document(page_content=child_text, metadata={"parent_id": parent_id, **doc.metadata}))
+    # Lưu parent trước khi upsert child để search không trả về child thiếu parent
+    with track_stage("redis"):
+        set_parents(collection_name, document_id, parents)
+    embeddings = batch_embed_documents(children)
+    points = []
+    for i, (child, embedding_vector) in enumerate(zip(children, embeddings)):
+        page = child.metadata.get("page")
+        points.append(PointStruct(
+            id=str(uuid.uuid4()),
+            vector=embedding_vector,
+            payload={
+                "document_id": document_id,
+                "parent_id": child.metadata["parent_id"],
+                "chunk_id": i,
+                "source": child.metadata.get("source", "unknown"),
+                "metadata": {"page": page} if page is not None else {},
+            }
+        ))
+    print(f"[DEBUG] Parent-child: {len(parents)} parents, {len(points)} children")
+    return points
 
 def delete_document_vectors(collection_name, document_id):
     # Xóa tất cả vector có payload document_id trong collection_name
-    qdrant_client.delete(
+    local_indexes.invalidate(collection_name)
+    delete_parents(collection_name, document_id)
+    get_qdrant_client().delete(
         collection_name=collection_name,
         points_selector=Filter(
             must=[
@@ -183,63 +356,335 @@ def delete_document_vectors(collection_name, document_id):
         )
     )
 
-def get_retriever_for_collection(collection_name):
-    try:
-        collection_info = qdrant_client.get_collection(collection_name)
-        print(f"[DEBUG] Collection {collection_name} exists with {collection_info.points_count} points")
-    except UnexpectedResponse:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Collection `{collection_name}` không tồn tại. Hãy upload dữ liệu trước."
-        )
+def copy_document_vectors(source_collection, source_document_id, target_collection, target_document_id,
+                          source=None):
+    """Copy toàn bộ point (kèm vector) của một tài liệu đã ingest sang tài liệu mới, không cần chunk/embed lại.
+
+    `source` (tên file của bản mới) ghi đè source trong payload. Trả về số point đã copy
+    (0 nếu tài liệu nguồn không còn trong Qdrant).
+    """
+    client = get_qdrant_client()
+    if not client.collection_exists(source_collection):
+        return 0
+    create_collection_if_not_exists(target_collection)
+    local_indexes.invalidate(target_collection)
+    document_filter = Filter(must=[FieldCondition(key="document_id", match=MatchValue(value=source_document_id))])
+    copied = 0
+    offset = None
+    while True:
+        with track_stage("vector_copy"):
+            records, offset = client.scroll(
+                collection_name=source_collection,
+                scroll_filter=document_filter,
+                limit=QDRANT_BATCH_SIZE,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            if records:
+                points = []
+                for record in records:
+                    payload = {**record.payload, "document_id": target_document_id}
+                    if source:
+                        payload["source"] = source
+                        payload["metadata"] = {**payload.get("metadata", {}), "source": source}
+                    points.append(PointStruct(id=str(uuid.uuid4()), vector=record.vector, payload=payload))
+                client.upsert(collection_name=target_collection, points=points)
+        copied += len(records)
+        if offset is None:
+            break
+    if copied:
+        copy_parents(source_collection, source_document_id, target_collection, target_document_id)
+    print(f"[DEBUG] Copied {copied} points of {source_collection}/{source_document_id} to {target_collection}/{target_document_id}")
+    return copied
+
+def build_search_filter(document_ids=None, sources=None, page_from=None, page_to=None):
+    """Tạo Filter của Qdrant từ các điều kiện lọc của request (None nếu không lọc).
+
+    Lọc được đẩy vào search (dùng payload index) chứ không lọc kết quả sau khi search,
+    nên vẫn trả đủ k kết quả thuộc các tài liệu được chọn.
+    """
+    conditions = []
+    if document_ids:
+        conditions.append(FieldCondition(key="document_id", match=MatchAny(any=list(document_ids))))
+    if sources:
+        conditions.append(FieldCondition(key="source", match=MatchAny(any=list(sources))))
+    if page_from is not None or page_to is not None:
+        conditions.append(FieldCondition(key="metadata.page", range=Range(gte=page_from, lte=page_to)))
+    return Filter(must=conditions) if conditions else None
+
+def copy_collection_points(source_collection, target_collection, document_id_map, batch_size=QDRANT_COPY_BATCH_SIZE):
+    """Copy mọi point (kèm vector) của collection sang collection mới, đổi document_id theo document_id_map.
+
+    Không chunk/embed lại: scroll theo batch và upsert nguyên vector, giữ nguyên point id (khác collection
+    nên không trùng). Các batch giữa upsert không chờ index (wait=False), batch cuối chờ để khi trả về
+    mọi point đã search được. Trả về số point đã copy.
+    """
+    client = get_qdrant_client()
+    if not client.collection_exists(source_collection):
+        return 0
+    source_info = client.get_collection(source_collection)
+    create_collection_if_not_exists(target_collection, hnsw_config=HnswConfigDiff(
+        m=source_info.config.hnsw_config.m, ef_construct=source_info.config.hnsw_config.ef_construct))
+    local_indexes.invalidate(target_collection)
+    copied = 0
+    offset = None
+    while True:
+        with track_stage("vector_copy"):
+            records, offset = client.scroll(
+                collection_name=source_collection,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            if records:
+                points = []
+                for record in records:
+                    payload = record.payload or {}
+                    document_id = payload.get("document_id")
+                    if document_id in document_id_map:
+                        payload = {**payload, "document_id": document_id_map[document_id]}
+                    points.append(PointStruct(id=record.id, vector=record.vector, payload=payload))
+                client.upsert(collection_name=target_collection, points=points, wait=offset is None)
+        copied += len(records)
+        if offset is None:
+            break
+    for source_document_id, target_document_id in document_id_map.items():
+        copy_parents(source_collection, source_document_id, target_collection, target_document_id)
+    print(f"[DEBUG] Copied {copied} points of {source_collection} to {target_collection}")
+    return copied
+
+def collapse_to_parents(points):
+    """Giữ child có score cao nhất của mỗi parent (points đã sắp xếp giảm dần theo score)"""
+    seen = set()
+    kept = []
+    for point in points:
+        if "parent_id" in point.payload:
+            key = (point.payload.get("document_id"), point.payload["parent_id"])
+            if key in seen:
+                continue
+            seen.add(key)
+        kept.append(point)
+    return kept
+
+def points_to_documents(collection_name, points):
+    """Kết quả search -> Document. Child của parent-child indexing được thay bằng parent (lấy bulk từ Redis)"""
+    from langchain.docstore.document import Document
+    parent_keys = [(p.payload.get("document_id"), p.payload["parent_id"]) for p in points if "parent_id" in p.payload]
+    parents = {}
+    if parent_keys:
+        with track_stage("parent_fetch"):
+            parents = get_parents(collection_name, parent_keys)
+    docs = []
+    for point in points:
+        payload = point.payload
+        if "parent_id" in payload:
+            parent = parents.get((payload.get("document_id"), payload["parent_id"]))
+            if parent is None:
+                print(f"[WARNING] Missing parent {payload['parent_id']} of document {payload.get('document_id')}")
+                continue
+            docs.append(Document(page_content=payload_text(parent), metadata=parent["metadata"]))
+        else:
+            docs.append(Document(page_content=payload_text(payload), metadata=payload.get('metadata', {})))
+    return docs
+
+_local_index_builds = SingleFlight("local_index")
+
+def get_local_index(collection_name, version, points_count):
+    """LocalIndex của collection ở version tập tài liệu hiện tại, build khi dùng lần đầu (None nếu collection lớn)"""
+    index = local_indexes.get(collection_name, version)
+    if index is not None:
+        CACHE_EVENTS.labels(cache="local_index", result="hit").inc()
+        return index
+    if points_count is None or points_count > LOCAL_INDEX_MAX_POINTS:
+        return None
+    CACHE_EVENTS.labels(cache="local_index", result="miss").inc()
+
+    def build():
+        with track_stage("local_index_build"):
+            built = build_local_index(get_qdrant_client(), collection_name, version)
+        local_indexes.put(collection_name, built)
+        print(f"[DEBUG] Built local index for {collection_name}@{version}: {len(built)} points, {built.nbytes} bytes")
+        return built
+    # Các /chat đồng thời của cùng session chỉ scroll collection một lần
+    return _local_index_builds.do((collection_name, version), build)
+
+# Ước lượng chi phí search để giới hạn ef theo latency target, riêng cho từng collection
+# (collection nhỏ của session và collection chung lớn có chi phí rất khác nhau):
+# latency ~ base_ms (RTT, overhead) + ms_per_ef * ef
+SEARCH_COST_MAX_COLLECTIONS = 1024
+search_costs = OrderedDict()
+_search_costs_lock = threading.Lock()
+
+def get_search_cost(collection_name):
+    """(base_ms, ms_per_ef) đã quan sát của collection, (None, None) nếu chưa có"""
+    with _search_costs_lock:
+        cost = search_costs.get(collection_name)
+        return (cost["base_ms"], cost["ms_per_ef"]) if cost else (None, None)
+
+def record_search_latency(collection_name, ef, elapsed_ms, alpha=0.2):
+    """Cập nhật ước lượng chi phí search của collection từ latency quan sát được"""
+    if not ef or ef <= 0:
+        return
+    with _search_costs_lock:
+        cost = search_costs.get(collection_name)
+        if cost is None:
+            cost = search_costs[collection_name] = {"base_ms": None, "ms_per_ef": None}
+            while len(search_costs) > SEARCH_COST_MAX_COLLECTIONS:
+                search_costs.popitem(last=False)
+        search_costs.move_to_end(collection_name)
+        base = cost["base_ms"]
+        cost["base_ms"] = elapsed_ms if base is None else min(base, elapsed_ms)
+        per_ef = max(elapsed_ms - cost["base_ms"], 0) / ef
+        previous = cost["ms_per_ef"]
+        cost["ms_per_ef"] = per_ef if previous is None else (1 - alpha) * previous + alpha * per_ef
+
+def choose_search_params(points_count, k=TOP_K, hnsw_ef=None, exact=None, latency_target_ms=None,
+                         collection_name=None):
+    """Chọn SearchParams cho Qdrant.
+
+    - Collection nhỏ (<= SEARCH_EXACT_THRESHOLD points) hoặc exact=True: search exact.
+    - hnsw_ef truyền vào (per request) hoặc SEARCH_HNSW_EF: dùng ef cố định.
+    - Adaptive: ef tăng theo log kích thước collection, rồi giới hạn theo latency target
+      dựa trên chi phí search quan sát được.
+    """
+    if exact or (exact is None and points_count is not None and points_count <= SEARCH_EXACT_THRESHOLD):
+        return SearchParams(exact=True)
+    if hnsw_ef:
+        return SearchParams(hnsw_ef=hnsw_ef)
+    if not SEARCH_ADAPTIVE_EF or points_count is None:
+        return SearchParams(hnsw_ef=SEARCH_HNSW_EF) if SEARCH_HNSW_EF else None
+
+    ef_floor = max(SEARCH_EF_MIN, k)
+    # Clamp để collection rỗng (exact=False) không làm log2 lỗi; collection nhỏ hơn ngưỡng dùng ef_floor
+    ef = ef_floor * (1 + math.log2(max(points_count / max(SEARCH_EXACT_THRESHOLD, 1), 1)))
+    target = latency_target_ms or SEARCH_LATENCY_TARGET_MS
+    base_ms, ms_per_ef = get_search_cost(collection_name)
+    if ms_per_ef:
+        ef = min(ef, (target - base_ms) / ms_per_ef)
+    ef = int(min(max(ef, ef_floor), SEARCH_EF_MAX))
+    return SearchParams(hnsw_ef=ef)
+
+def get_retriever_for_collection(collection_name, k=TOP_K, search_params=None, hnsw_ef=None, exact=None,
+                                 score_threshold=SEARCH_SCORE_THRESHOLD, latency_target_ms=None, query_filter=None,
+                                 mmr=None, fetch_k=MMR_FETCH_K, lambda_mult=MMR_LAMBDA, index_version=None):
+    """Retriever search trực tiếp bằng Qdrant client.
+
+    mmr (None: MMR_ENABLED): lấy fetch_k candidate kèm vector rồi chọn k chunk đa dạng bằng MMR.
+    index_version: version tập tài liệu của session; có thì collection nhỏ được search bằng local index
+    trong process (không gọi Qdrant), index tự build lại khi version đổi.
+    """
+    use_mmr = (MMR_ENABLED if mmr is None else mmr) and fetch_k > k
+    local_index = None
+    if LOCAL_INDEX_ENABLED and index_version is not None:
+        local_index = local_indexes.get(collection_name, index_version)
+    if local_index is not None:
+        CACHE_EVENTS.labels(cache="local_index", result="hit").inc()
+        points_count = len(local_index)
+    else:
+        try:
+            collection_info = get_qdrant_client().get_collection(collection_name)
+            print(f"[DEBUG] Collection {collection_name} exists with {collection_info.points_count} points")
+        except UnexpectedResponse:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Collection `{collection_name}` không tồn tại. Hãy upload dữ liệu trước."
+            )
+        points_count = collection_info.points_count
+        if LOCAL_INDEX_ENABLED and index_version is not None:
+            try:
+                local_index = get_local_index(collection_name, index_version, points_count)
+            except Exception as e:
+                print(f"[ERROR] Build local index failed, fallback to Qdrant: {e}")
+    if local_index is not None and not local_index.supports(query_filter):
+        local_index = None
 
-    vector_store = QdrantVectorStore(
-        client=qdrant_client,
-        collection_name=collection_name,
-        embedding=embedding
-    )
-    
     # FIX: Tạo custom retriever với debug
     class DebugRetriever:
-        def __init__(self, vector_store, k=TOP_K):
-            self.vector_store = vector_store
+        def __init__(self, k=TOP_K, search_params=None, points_count=None):
             self.k = k
+            self.search_params = search_params
+            self.points_count = points_count
+            self.limit = fetch_k if use_mmr else k
+            if PARENT_CHILD_INDEXING:
+                # Nhiều child có thể cùng một parent: lấy dư để còn đủ k parent khác nhau
+                self.limit = max(self.limit, SEARCH_LIMIT)
         
-        def invoke(self, query):
-            print(f"[DEBUG] Retrieving for query: {query}")
-            try:
-                # Thử search trực tiếp với Qdrant client trước
-                query_vector = embedding.embed_query(query)
-                search_results = qdrant_client.search(
+        def get_search_params(self):
+            if self.search_params is not None:
+                return self.search_params
+            return choose_search_params(
+                self.points_count, self.limit, hnsw_ef=hnsw_ef, exact=exact, latency_target_ms=latency_target_ms,
+                collection_name=collection_name
+            )
+        
+        def embed(self, query):
+            with track_stage("query_embedding"):
+                return get_embedding().embed_query(query)
+        
+        def search_by_vector(self, query_vector):
+            if local_index is not None:
+                with track_stage("local_search"):
+                    search_results = local_index.search(query_vector, self.limit, query_filter, score_threshold)
+                print(f"[DEBUG] Local index search returned {len(search_results)} of {len(local_index)} points")
+                return self.to_documents(query_vector, search_results)
+            # Thử search trực tiếp với Qdrant client trước
+            params = self.get_search_params()
+            start = time.perf_counter()
+            with track_stage("qdrant_search"):
+                search_results = get_qdrant_client().search(
                     collection_name=collection_name,
                     query_vector=query_vector,
-                    limit=self.k,
-                    with_payload=True
+                    limit=self.limit,
+                    with_payload=True,
+                    with_vectors=use_mmr,
+                    search_params=params,
+                    score_threshold=score_threshold,
+                    query_filter=query_filter
                 )
-                
-                print(f"[DEBUG] Direct Qdrant search returned {len(search_results)} results")
-                for i, result in enumerate(search_results):
-                    payload = result.payload
-                    print(f"[DEBUG] Result {i}: score={result.score}, text_length={len(payload.get('text', ''))}")
-                    print(f"[DEBUG] Result {i} text preview: {payload.get('text', '')[:100]}...")
-                
-                # Chuyển đổi sang LangChain Document format
-                from langchain.docstore.document import Document
-                docs = []
-                for result in search_results:
-                    doc = Document(
-                        page_content=result.payload.get('text', ''),
-                        metadata=result.payload.get('metadata', {})
-                    )
-                    docs.append(doc)
-                
-                return docs
-                
+            if self.search_params is None and params is not None and params.hnsw_ef:
+                record_search_latency(collection_name, params.hnsw_ef, (time.perf_counter() - start) * 1000)
+            print(f"[DEBUG] Search params: {params}, score_threshold={score_threshold}, filter={query_filter}")
+            return self.to_documents(query_vector, search_results)
+
+        def to_documents(self, query_vector, search_results):
+            search_results = collapse_to_parents(search_results)
+            if use_mmr and len(search_results) > self.k:
+                with track_stage("mmr"):
+                    selected = mmr_select(query_vector, [result.vector for result in search_results], self.k, lambda_mult)
+                print(f"[DEBUG] MMR selected candidates {selected} of {len(search_results)}")
+                search_results = [search_results[i] for i in selected]
+            search_results = search_results[:self.k]
+            
+            # Chuyển đổi sang LangChain Document format (chỉ lấy parent của các kết quả cuối cùng)
+            docs = points_to_documents(collection_name, search_results)
+            print(f"[DEBUG] Search returned {len(docs)} results")
+            for i, doc in enumerate(docs):
+                print(f"[DEBUG] Result {i}: text_length={len(doc.page_content)}")
+                print(f"[DEBUG] Result {i} text preview: {doc.page_content[:100]}...")
+            
+            return docs
+        
+        def invoke(self, query):
+            print(f"[DEBUG] Retrieving for query: {query}")
+            try:
+                query_vector = self.embed(query)
+                return self.search_by_vector(query_vector)
             except Exception as e:
                 print(f"[ERROR] Retrieval failed: {e}")
                 return []
     
-    return DebugRetriever(vector_store)
+    return DebugRetriever(k=k, search_params=search_params, points_count=points_count)
+
+def cosine_similarity(vec_a, vec_b):
+    """Cosine similarity giữa 2 embedding vector"""
+    dot = sum(a * b for a, b in zip(vec_a, vec_b))
+    norm_a = sum(a * a for a in vec_a) ** 0.5
+    norm_b = sum(b * b for b in vec_b) ** 0.5
+    if not norm_a or not norm_b:
+        return 0.0
+    return dot / (norm_a * norm_b)
 
 # Prompt/response caching (simple hash-based)
 def cache_key(prompt, context):
@@ -251,6 +696,9 @@ rag_chain = None
 
 def setup_rag(vector_store):
     global retriever, rag_chain
+    from langchain.prompts import PromptTemplate
+    from langchain.chains import ConversationalRetrievalChain
+    prompt = PromptTemplate.from_template(BASE_PROMPT)
     retriever = vector_store.as_retriever(
         search_kwargs={
             "k": TOP_K,
@@ -258,22 +706,29 @@ def setup_rag(vector_store):
         }
     )
     rag_chain = ConversationalRetrievalChain.from_llm(
-        llm=llm,
+        llm=get_llm(),
         retriever=retriever,
         condense_question_prompt=prompt,
         return_source_documents=True
     )
     return rag_chain
 
-def load_and_setup_rag(doc_paths, collection_name, document_ids):
-    """Ingest nhiều tài liệu vào collection, trả về retriever cho collection đó"""
-    for doc_path, document_id in zip(doc_paths, document_ids):
+def load_and_setup_rag(doc_paths, collection_name, document_ids, sources=None, text_compression=None):
+    """Ingest nhiều tài liệu vào collection, trả về retriever cho collection đó.
+
+    `sources`: tên file gốc tương ứng với từng doc_path, lưu vào payload `source` để lọc khi search.
+    """
+    from langchain_community.document_loaders import PyPDFLoader, TextLoader
+    sources = sources or [None] * len(doc_paths)
+    for doc_path, document_id, source in zip(doc_paths, document_ids, sources):
         if doc_path.endswith(".pdf"):
             loader = PyPDFLoader(doc_path)
         else:
             loader = TextLoader(doc_path)
-        documents = loader.load()
-        ingest_documents_to_collection(documents, collection_name, document_id)
+        with track_stage("document_loading"):
+            documents = loader.load()
+        ingest_documents_to_collection(documents, collection_name, document_id, source=source,
+                                       text_compression=text_compression)
     return get_retriever_for_collection(collection_name)
 
 # Batch query optimization
@@ -283,12 +738,12 @@ def load_and_setup_rag(doc_paths, collection_name, document_ids):
 #     for i in range(0, len(queries), batch_size):
 #         batch_queries = queries[i:i + batch_size]
 #         # Embed batch queries
-#         batch_embeddings = embedding.embed_documents(batch_queries)
+#         batch_embeddings = get_embedding().embed_documents(batch_queries)
 
 #         # Batch search
 #         batch_results = []
 #         for query_embedding in batch_embeddings:
-#             search_result = qdrant_client.search(
+#             search_result = get_qdrant_client().search(
 #                 collection_name=QDRANT_COLLECTION_NAME,
 #                 query_vector=query_embedding,
 #                 limit=TOP_K
@@ -300,23 +755,36 @@ def load_and_setup_rag(doc_paths, collection_name, document_ids):
 #     return results
 
 # batch vector search
-async def batch_vector_search(queries: List[str], batch_size: int = 5):
+async def batch_vector_search(queries: List[str], batch_size: int = 5, hnsw_ef=None, exact=None,
+                              score_threshold=SEARCH_SCORE_THRESHOLD, collection_name=QDRANT_COLLECTION_NAME,
+                              query_filter=None):
     """Thực hiện batch vector search để tối ưu IO"""
     results = []
+    try:
+        points_count = get_qdrant_client().get_collection(collection_name).points_count
+    except Exception:
+        points_count = None
+    search_params = choose_search_params(points_count, TOP_K, hnsw_ef=hnsw_ef, exact=exact,
+                                         collection_name=collection_name)
     for i in range(0, len(queries), batch_size):
         batch_queries = queries[i:i + batch_size]
         # Embed batch queries
-        batch_embeddings = embedding.embed_documents(batch_queries)
+        with track_stage("query_embedding"):
+            batch_embeddings = get_embedding().embed_documents(batch_queries)
 
         # Batch search
         batch_results = []
         for query_embedding in batch_embeddings:
-            search_result = qdrant_client.search(
-                collection_name=QDRANT_COLLECTION_NAME,  # FIX: Cần dynamic collection name
-                query_vector=query_embedding,
-                limit=TOP_K,
-                with_payload=True  # FIX: Đảm bảo lấy payload
-            )
+            with track_stage("qdrant_search"):
+                search_result = get_qdrant_client().search(
+                    collection_name=collection_name,
+                    query_vector=query_embedding,
+                    limit=TOP_K,
+                    with_payload=True,  # FIX: Đảm bảo lấy payload
+                    search_params=search_params,
+                    score_threshold=score_threshold,
+                    query_filter=query_filter
+                )
             batch_results.append(search_result)
 
         results.extend(batch_results)
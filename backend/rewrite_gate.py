@@ -0,0 +1,101 @@
+import hashlib
+import re
+from .config import REWRITE_HISTORY_M, REWRITE_GATE_MIN_WORDS, REWRITE_GATE_OVERLAP_THRESHOLD
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Đại từ/chỉ định từ cho thấy câu hỏi phụ thuộc vào lượt chat trước
+ANAPHORA_MARKERS = [
+    # Tiếng Việt
+    "nó", "chúng", "họ", "hắn", "ấy", "đó", "đấy", "kia", "này", "như vậy", "như thế",
+    "vậy thì", "điều trên", "ở trên", "cái đó", "việc đó",
+    # English
+    "it", "its", "they", "them", "their", "this", "that", "these", "those",
+    "he", "she", "him", "her", "his",
+]
+
+# Từ nối đầu câu cho thấy câu hỏi bị tỉnh lược (ellipsis)
+CONTINUATION_PREFIXES = [
+    "còn", "vậy", "thế còn", "thế thì", "và", "nhưng", "rồi", "tiếp", "thì sao",
+    "what about", "how about", "and", "so", "then",
+]
+
+# Từ hư (stopwords) không tính là nội dung khi đếm độ dài câu hỏi
+STOPWORDS = {
+    "là", "gì", "ai", "của", "có", "không", "và", "thì", "mà", "các", "những", "một", "được",
+    "cho", "với", "trong", "về", "như", "sao", "nào", "bao", "nhiêu", "hãy", "giúp", "tôi",
+    "what", "who", "is", "are", "the", "a", "an", "of", "to", "in", "on", "how", "why", "does", "do",
+}
+
+_ANAPHORA_RE = re.compile(
+    r"(?<!\w)(" + "|".join(re.escape(m) for m in sorted(ANAPHORA_MARKERS, key=len, reverse=True)) + r")(?!\w)",
+    re.UNICODE,
+)
+_CONTINUATION_RE = re.compile(
+    r"^(" + "|".join(re.escape(p) for p in sorted(CONTINUATION_PREFIXES, key=len, reverse=True)) + r")(?!\w)",
+    re.UNICODE,
+)
+
+
+def content_words(text):
+    return [w for w in _WORD_RE.findall(text.lower()) if w not in STOPWORDS]
+
+
+def last_question(history):
+    """Câu hỏi gần nhất của người dùng trong history (format chat), None nếu không có"""
+    for chat in reversed(history):
+        if str(chat.get("is_user")) == "1":
+            return chat.get("message", "")
+    return None
+
+
+def overlap_with_last_question(question, history):
+    """Tỉ lệ từ nội dung của câu hỏi đã có trong câu hỏi trước (0 nếu không có câu hỏi trước)"""
+    words = set(content_words(question))
+    previous = last_question(history)
+    if not words or not previous:
+        return 0.0
+    return len(words & set(content_words(previous))) / len(words)
+
+
+def needs_rewrite(question, history):
+    """Gate rẻ (regex + đếm từ trùng, không gọi LLM) quyết định có cần rewrite câu hỏi theo lịch sử không.
+
+    Trả về (need, reason). Câu hỏi được coi là tự đủ nghĩa nếu không có đại từ thay thế,
+    không bắt đầu bằng từ nối tỉnh lược, có đủ từ nội dung và không lặp lại phần lớn từ
+    nội dung của câu hỏi trước (cùng chủ đề thì thường thiếu ngữ cảnh, vd. "Nhân vật phản diện
+    là ai?" sau "Nhân vật chính trong truyện Tấm Cám là ai?").
+    """
+    if not history:
+        return False, "no_history"
+    text = question.strip().lower()
+    if _ANAPHORA_RE.search(text):
+        return True, "anaphora"
+    if _CONTINUATION_RE.match(text):
+        return True, "continuation"
+    if len(content_words(text)) < REWRITE_GATE_MIN_WORDS:
+        return True, "too_short"
+    if overlap_with_last_question(text, history) >= REWRITE_GATE_OVERLAP_THRESHOLD:
+        return True, "topic_overlap"
+    return False, "self_contained"
+
+
+def history_to_chats(pairs):
+    """Chuyển các cặp (question, answer) trong Redis sang format chat dùng cho rewrite"""
+    return [
+        {"is_user": "1", "message": pair["question"]} for pair in pairs
+    ] + [
+        {"is_user": "0", "message": pair["answer"]} for pair in pairs
+    ]
+
+
+def history_fingerprint(history, m=REWRITE_HISTORY_M):
+    """Hash m lịch sử gần nhất (chỉ phần được đưa vào prompt rewrite)"""
+    selected_history = history[-m:] if len(history) >= m else history
+    raw = "\n".join(f"{c.get('is_user')}:{c.get('message', '')}" for c in selected_history)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def rewrite_cache_key(question, history):
+    raw = question.strip().lower() + "|" + history_fingerprint(history)
+    return hashlib.sha256(raw.encode()).hexdigest()
@@ -0,0 +1,45 @@
+"""Single-flight: các lời gọi đồng thời cùng key dùng chung một lần thực thi.
+
+Caller đầu tiên chạy hàm, các caller đến sau trong lúc hàm đang chạy chỉ chờ Future của caller đầu.
+Kết quả không được lưu lại sau khi xong (không phải cache), nên không bao giờ trả dữ liệu cũ.
+Lỗi thuộc `unshared_errors` là lỗi riêng của caller đầu (vd. bị từ chối theo session của nó): follower
+không nhận lỗi đó mà tự chạy hàm.
+"""
+import threading
+from concurrent.futures import Future
+from .metrics import COALESCED_CALLS
+
+
+class SingleFlight:
+    def __init__(self, kind, unshared_errors=()):
+        self.kind = kind
+        self.unshared_errors = unshared_errors
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            COALESCED_CALLS.labels(kind=self.kind).inc()
+            try:
+                return future.result()
+            except self.unshared_errors:
+                return fn(*args, **kwargs)
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._in_flight)
@@ -0,0 +1,130 @@
+"""Nén text trong payload Qdrant bằng zstd với dictionary train trên text của collection.
+
+Chunk ngắn nén riêng lẻ thì tỉ lệ nén thấp; dictionary chung (train từ chính các chunk của collection)
+chứa các cụm từ lặp lại nên mỗi chunk nén được nhỏ hơn nhiều. Payload nén có dạng
+    {"text_zstd": <base64>, "text_dict": <dict_id>}
+dict_id là hash nội dung của dictionary (lưu trong Redis), nên point copy sang collection khác
+(dedup, fork) vẫn giải nén được. Parent passage trong Redis (PARENT_CHILD_INDEXING) dùng cùng format.
+Retriever giải nén trong `payload_text`, payload cũ có "text" vẫn đọc như trước.
+"""
+import base64
+import hashlib
+import threading
+from .config import TEXT_COMPRESSION, TEXT_DICT_SIZE, TEXT_DICT_MIN_SAMPLES, TEXT_COMPRESSION_LEVEL
+from .db import get_collection_codec, set_collection_codec, save_dictionary, load_dictionary
+
+CODECS = ("none", "zstd")
+
+_local = threading.local()  # ZstdDecompressor không dùng chung được giữa các thread
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def collection_codec(collection_name, requested=None):
+    """Cấu hình codec của collection ({"codec", "dict_id"}).
+
+    Lần upload đầu chọn codec (tham số hoặc TEXT_COMPRESSION), các lần sau giữ nguyên.
+    """
+    settings = get_collection_codec(collection_name)
+    if settings.get("codec"):
+        return settings
+    codec = requested or TEXT_COMPRESSION
+    if codec not in CODECS:
+        raise ValueError(f"Codec không hợp lệ: {codec} (chọn một trong {', '.join(CODECS)})")
+    if codec == "zstd" and _zstd() is None:
+        print("[WARNING] zstandard chưa được cài, lưu text không nén")
+        codec = "none"
+    # Hai worker cùng upload lần đầu thì codec của worker ghi trước được giữ
+    set_collection_codec(collection_name, codec)
+    return get_collection_codec(collection_name)
+
+
+def train_dictionary(texts, dict_size=TEXT_DICT_SIZE):
+    """Train dictionary từ các chunk, trả về (dict_id, bytes) hoặc None nếu quá ít mẫu"""
+    zstd = _zstd()
+    samples = [t.encode("utf-8") for t in texts if t]
+    if zstd is None or len(samples) < TEXT_DICT_MIN_SAMPLES:
+        return None
+    try:
+        data = zstd.train_dictionary(dict_size, samples).as_bytes()
+    except zstd.ZstdError as e:
+        print(f"[WARNING] Train zstd dictionary failed: {e}")
+        return None
+    return hashlib.sha256(data).hexdigest()[:16], data
+
+
+def _dictionary(dict_id):
+    zstd = _zstd()
+    cache = getattr(_local, "dictionaries", None)
+    if cache is None:
+        cache = _local.dictionaries = {}
+    if dict_id not in cache:
+        data = load_dictionary(dict_id)
+        if data is None:
+            raise KeyError(f"Không tìm thấy zstd dictionary {dict_id}")
+        cache[dict_id] = zstd.ZstdCompressionDict(data)
+    return cache[dict_id]
+
+
+def _decompressor(dict_id):
+    cache = getattr(_local, "decompressors", None)
+    if cache is None:
+        cache = _local.decompressors = {}
+    if dict_id not in cache:
+        zstd = _zstd()
+        cache[dict_id] = zstd.ZstdDecompressor(dict_data=_dictionary(dict_id)) if dict_id else zstd.ZstdDecompressor()
+    return cache[dict_id]
+
+
+class TextEncoder:
+    """Tạo field text cho payload theo codec của collection"""
+
+    def __init__(self, codec="none", dict_id=None, dict_data=None, level=TEXT_COMPRESSION_LEVEL):
+        self.codec = codec
+        self.dict_id = dict_id
+        self._compressor = None
+        if codec == "zstd":
+            zstd = _zstd()
+            dictionary = zstd.ZstdCompressionDict(dict_data) if dict_data else None
+            self._compressor = zstd.ZstdCompressor(level=level, dict_data=dictionary)
+
+    def encode(self, text):
+        if self._compressor is None:
+            return {"text": text}
+        fields = {"text_zstd": base64.b64encode(self._compressor.compress(text.encode("utf-8"))).decode("ascii")}
+        if self.dict_id:
+            fields["text_dict"] = self.dict_id
+        return fields
+
+
+def get_text_encoder(collection_name, texts, requested=None):
+    """Encoder cho một lần ingest; collection zstd chưa có dictionary thì train từ `texts`"""
+    settings = collection_codec(collection_name, requested)
+    if settings["codec"] != "zstd":
+        return TextEncoder()
+    dict_id = settings.get("dict_id")
+    dict_data = load_dictionary(dict_id) if dict_id else None
+    if dict_data is None:
+        trained = train_dictionary(texts)
+        if trained:
+            dict_id, dict_data = trained
+            save_dictionary(dict_id, dict_data)
+            set_collection_codec(collection_name, "zstd", dict_id=dict_id)
+            print(f"[DEBUG] Trained zstd dictionary {dict_id} ({len(dict_data)} bytes) for {collection_name}")
+        else:
+            dict_id = None
+    return TextEncoder("zstd", dict_id, dict_data)
+
+
+def payload_text(payload):
+    """Text của point, giải nén nếu payload nén"""
+    if "text_zstd" not in payload:
+        return payload.get("text", "")
+    data = base64.b64decode(payload["text_zstd"])
+    return _decompressor(payload.get("text_dict")).decompress(data).decode("utf-8")
@@ -0,0 +1,50 @@
+"""Ghi file upload xuống đĩa theo từng chunk, vừa ghi vừa tính hash và kiểm tra giới hạn dung lượng.
+
+Không bao giờ giữ toàn bộ file trong RAM: peak memory chỉ khoảng UPLOAD_CHUNK_SIZE mỗi file.
+"""
+import hashlib
+import os
+import tempfile
+from fastapi import HTTPException
+from .config import UPLOAD_CHUNK_SIZE, UPLOAD_TMP_DIR
+
+MB = 1024 * 1024
+
+
+async def save_upload_to_disk(file, max_bytes, chunk_size=UPLOAD_CHUNK_SIZE, tmp_dir=UPLOAD_TMP_DIR):
+    """Stream UploadFile xuống temp file, trả về (path, size_bytes, sha256).
+
+    Vượt `max_bytes` thì dừng ngay, xóa phần đã ghi và trả 413.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    suffix = "_" + os.path.basename(file.filename or "upload")
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            while True:
+                chunk = await file.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File {file.filename} vượt quá giới hạn {max_bytes / MB:.1f}MB.",
+                    )
+                digest.update(chunk)
+                tmp.write(chunk)
+    except BaseException:
+        remove_temp_files([path])
+        raise
+    finally:
+        await file.close()
+    return path, size, digest.hexdigest()
+
+
+def remove_temp_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
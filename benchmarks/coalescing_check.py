@@ -0,0 +1,88 @@
+"""Kiểm tra single-flight: nhiều lời gọi đồng thời giống hệt chỉ tạo một lời gọi upstream.
+
+Dùng StubLLM/StubEmbeddings (không cần Gemini, Qdrant hay Redis). N thread cùng gửi một prompt qua
+`invoke_llm` và cùng một query qua `embed_query`; LLM/embedding gốc phải chỉ được gọi đúng một lần
+và mọi thread nhận cùng kết quả. Prompt khác nhau thì không được gộp. Sai thì exit code 1.
+
+Ví dụ (chạy từ thư mục gốc repo):
+    python -m benchmarks.coalescing_check --concurrency 50
+"""
+import argparse
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class CountingEmbeddings:
+    def __init__(self, backend):
+        self.backend = backend
+        self.query_calls = 0
+        self._lock = threading.Lock()
+
+    def embed_query(self, text):
+        with self._lock:
+            self.query_calls += 1
+        return self.backend.embed_query(text)
+
+    def embed_documents(self, texts):
+        return self.backend.embed_documents(texts)
+
+
+def run_concurrently(fn, args_list):
+    """Chạy fn với từng args cùng lúc (barrier để các thread bắt đầu đồng thời)"""
+    barrier = threading.Barrier(len(args_list))
+
+    def call(args):
+        barrier.wait()
+        return fn(*args)
+
+    with ThreadPoolExecutor(max_workers=len(args_list)) as pool:
+        return list(pool.map(call, args_list))
+
+
+def check(name, ok, detail):
+    print(f"[{'OK' if ok else 'FAIL'}] {name}: {detail}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    args = parser.parse_args()
+
+    os.environ["LLM_PROVIDER"] = "stub"
+    os.environ["REQUEST_COALESCING"] = "true"
+    # Scheduler không được là nút thắt của phép thử
+    os.environ["LLM_MAX_QUEUED_PER_SESSION"] = str(args.concurrency * 2)
+    from backend import rag_pipeline
+    from backend.embedding_service import CoalescingEmbeddings
+    from backend.llm_scheduler import invoke_llm
+    from backend.stubs import StubEmbeddings, StubLLM
+
+    llm = StubLLM(latency_ms=args.llm_latency_ms, jitter=0, output_tokens=0)
+    rag_pipeline._components["llm"] = llm
+    passed = True
+
+    prompt = "Tài liệu này là về vấn đề gì?"
+    results = run_concurrently(invoke_llm, [(prompt, "answer", f"s{i}") for i in range(args.concurrency)])
+    passed &= check("llm identical prompts", llm.calls == 1, f"{args.concurrency} callers -> {llm.calls} upstream call(s)")
+    passed &= check("llm shared result", len({r.content for r in results}) == 1, results[0].content)
+
+    llm.calls = 0
+    run_concurrently(invoke_llm, [(f"{prompt} #{i}", "answer", f"s{i}") for i in range(8)])
+    passed &= check("llm distinct prompts", llm.calls == 8, f"8 distinct prompts -> {llm.calls} upstream call(s)")
+
+    counting = CountingEmbeddings(StubEmbeddings(latency_ms=200))
+    embedder = CoalescingEmbeddings(counting)
+    vectors = run_concurrently(embedder.embed_query, [(prompt,)] * args.concurrency)
+    passed &= check("embed_query identical text", counting.query_calls == 1,
+                    f"{args.concurrency} callers -> {counting.query_calls} upstream call(s)")
+    passed &= check("embed_query shared result", all(v == vectors[0] for v in vectors), f"dim={len(vectors[0])}")
+
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Đo hiệu quả micro-batching embed_query khi có nhiều /chat đồng thời.
+
+Mô phỏng N request đồng thời (mỗi request một thread, giống `asyncio.to_thread` trong /chat),
+mỗi request gọi embed_query cho các query trong benchmarks/data/retrieval_vi.json.
+So sánh gọi thẳng backend với BatchingEmbeddings theo mức đồng thời và cửa sổ gom batch:
+throughput (query/giây), p50/p95 latency mỗi query và batch size trung bình.
+
+Ví dụ (chạy từ thư mục gốc repo):
+    python -m benchmarks.embedding_batching_bench --concurrency 32,64,128 --windows 2,5
+    EMBEDDING_PROVIDER=onnx python -m benchmarks.embedding_batching_bench
+"""
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), "data", "retrieval_vi.json")
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def parse_ints(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def parse_floats(value):
+    return [float(v) for v in value.split(",") if v]
+
+
+def percentile(sorted_values, q):
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class CountingBackend:
+    """Bọc backend để đếm số lần forward pass và số text đã embed"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.calls = 0
+        self.texts = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.calls += 1
+            self.texts += len(texts)
+        return self.backend.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def run(embedder, queries, concurrency, requests_per_worker):
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(offset):
+        local = []
+        for i in range(requests_per_worker):
+            t0 = time.perf_counter()
+            embedder.embed_query(queries[(offset + i) % len(queries)])
+            local.append(time.perf_counter() - t0)
+        with lock:
+            latencies.extend(local)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "queries_per_s": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=parse_ints, default=[1, 32, 64, 128])
+    parser.add_argument("--windows", type=parse_floats, default=[2, 5], help="Cửa sổ gom batch (ms)")
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--requests-per-worker", type=int, default=8)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    # Benchmark tự bọc backend, không dùng batcher mặc định của rag_pipeline
+    os.environ["EMBEDDING_MICRO_BATCHING"] = "false"
+    from backend import rag_pipeline
+    from backend.embedding_service import BatchingEmbeddings
+
+    with open(DATA_PATH, encoding="utf-8") as f:
+        queries = [q["query"] for q in json.load(f)["queries"]]
+    backend = rag_pipeline.get_embedding()
+    backend.embed_documents(queries)  # warmup
+
+    rows = []
+    for concurrency in args.concurrency:
+        direct = CountingBackend(backend)
+        metrics = run(direct, queries, concurrency, args.requests_per_worker)
+        rows.append({"concurrency": concurrency, "mode": "direct", "window_ms": None,
+                     "avg_batch": direct.texts / direct.calls, **metrics})
+        for window_ms in args.windows:
+            counting = CountingBackend(backend)
+            batcher = BatchingEmbeddings(counting, window_ms=window_ms, max_batch=args.max_batch)
+            metrics = run(batcher, queries, concurrency, args.requests_per_worker)
+            rows.append({"concurrency": concurrency, "mode": "batched", "window_ms": window_ms,
+                         "avg_batch": counting.texts / counting.calls, **metrics})
+        for r in rows[-1 - len(args.windows):]:
+            print(f"[BENCH] c={concurrency} {r['mode']} window={r['window_ms']}: "
+                  f"{r['queries_per_s']:.1f} q/s, p95 {r['p95_ms']:.1f}ms, avg batch {r['avg_batch']:.1f}")
+
+    print(f"\n{'conc':>5} {'mode':>8} {'window':>7} {'q/s':>9} {'p50ms':>8} {'p95ms':>8} {'batch':>6}")
+    for r in rows:
+        print(f"{r['concurrency']:>5} {r['mode']:>8} {str(r['window_ms'] or '-'):>7} {r['queries_per_s']:>9.1f} "
+              f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['avg_batch']:>6.1f}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"embedding_batching_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"timestamp": datetime.now().isoformat(), "config": vars(args),
+                   "embedding_provider": rag_pipeline.EMBEDDING_PROVIDER, "results": rows},
+                  f, indent=2, ensure_ascii=False)
+    print(f"\nSaved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""So sánh backend embedding: PyTorch (HuggingFaceEmbeddings) vs. ONNX fp32 vs. ONNX int8.
+
+Kiểm tra parity (cosine với model tham chiếu, độ trùng nearest neighbor) trên corpus
+benchmarks/data/retrieval_vi.json và đo throughput (text/giây) theo batch size.
+
+Ví dụ (chạy từ thư mục gốc repo):
+    python -m benchmarks.embedding_bench --export
+    python -m benchmarks.embedding_bench --batch-sizes 1,8,32,64 --threads 4
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), "data", "retrieval_vi.json")
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def parse_ints(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def measure_throughput(backend, texts, batch_size, min_seconds):
+    """Text/giây khi gọi embed_documents với từng batch `batch_size` text"""
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    backend.embed_documents(batches[0])  # warmup
+    done = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_seconds:
+        for batch in batches:
+            backend.embed_documents(batch)
+            done += len(batch)
+    return done / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--export", action="store_true", help="Export (lại) model ONNX trước khi benchmark")
+    parser.add_argument("--batch-sizes", type=parse_ints, default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads cho ONNX (0: mặc định)")
+    parser.add_argument("--min-seconds", type=float, default=3.0, help="Thời gian đo tối thiểu mỗi cấu hình")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+    from backend.config import EMBEDDING_MODEL
+    from backend.onnx_embedding import OnnxEmbeddings, export_onnx_model, parity_check
+
+    if args.export:
+        export_onnx_model()
+
+    with open(DATA_PATH, encoding="utf-8") as f:
+        data = json.load(f)
+    texts = [p["text"] for p in data["passages"]] + [q["query"] for q in data["queries"]]
+
+    backends = {
+        "torch_fp32": HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL),
+        "onnx_fp32": OnnxEmbeddings(quantized=False, intra_op_threads=args.threads),
+        "onnx_int8": OnnxEmbeddings(quantized=True, intra_op_threads=args.threads),
+    }
+    reference = backends["torch_fp32"]
+
+    report = {"timestamp": datetime.now().isoformat(), "config": vars(args), "parity": {}, "throughput": {}}
+    for name, backend in backends.items():
+        if backend is not reference:
+            report["parity"][name] = parity_check(reference, backend, texts)
+            print(f"[PARITY] {name}: {report['parity'][name]}")
+        report["throughput"][name] = {}
+        for batch_size in args.batch_sizes:
+            rate = measure_throughput(backend, texts, batch_size, args.min_seconds)
+            report["throughput"][name][batch_size] = rate
+            print(f"[THROUGHPUT] {name} batch={batch_size}: {rate:.1f} texts/s")
+
+    print(f"\n{'batch':>6} " + " ".join(f"{name:>12}" for name in backends))
+    for batch_size in args.batch_sizes:
+        print(f"{batch_size:>6} " + " ".join(f"{report['throughput'][name][batch_size]:>12.1f}" for name in backends))
+
+    output = args.output or os.path.join(RESULTS_DIR, f"embedding_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\nSaved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Đo tốc độ fork session: copy point (kèm vector) sang collection mới bằng `copy_collection_points`.
+
+Tạo collection nguồn với N point vector ngẫu nhiên (payload giống chunk thật, chia đều cho vài document_id),
+rồi copy sang collection đích với các batch size khác nhau và báo cáo points/giây. So với thời gian ingest
+(chunk + embed) thì fork chỉ tốn băng thông scroll/upsert. Không cần model embedding.
+
+Ví dụ (chạy từ thư mục gốc repo; nên dùng Qdrant server thật để số đo có ý nghĩa):
+    QDRANT_URL=http://localhost:6333 python -m benchmarks.fork_bench --points 100000 --batch-sizes 256,1000,2000
+"""
+import argparse
+import os
+import random
+import time
+import uuid
+
+
+def parse_ints(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def fill_source(rag_pipeline, collection_name, n_points, n_documents, dim, seed):
+    from qdrant_client.models import PointStruct
+
+    client = rag_pipeline.get_qdrant_client()
+    if client.collection_exists(collection_name):
+        client.delete_collection(collection_name)
+    rag_pipeline.create_collection_if_not_exists(collection_name)
+    rng = random.Random(seed)
+    document_ids = [str(uuid.uuid4()) for _ in range(n_documents)]
+    text = "Đoạn văn mẫu dùng để đo tốc độ fork session. " * 10
+    batch = []
+    for i in range(n_points):
+        document_id = document_ids[i % n_documents]
+        batch.append(PointStruct(
+            id=str(uuid.uuid4()),
+            vector=[rng.uniform(-1, 1) for _ in range(dim)],
+            payload={"text": text, "metadata": {"source": "bench.pdf", "page": i % 50}, "chunk_id": i,
+                     "document_id": document_id, "content_length": len(text), "source": "bench.pdf"},
+        ))
+        if len(batch) == 1000 or i == n_points - 1:
+            client.upsert(collection_name=collection_name, points=batch)
+            batch = []
+    return document_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=20000)
+    parser.add_argument("--documents", type=int, default=10)
+    parser.add_argument("--batch-sizes", type=parse_ints, default=[256, 1000, 2000])
+    parser.add_argument("--keep", action="store_true", help="Giữ lại các collection benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ.setdefault("LLM_PROVIDER", "stub")
+    os.environ.setdefault("EMBEDDING_PROVIDER", "stub")
+    from backend import rag_pipeline
+    from backend.config import QDRANT_VECTOR_SIZE
+
+    source = "bench_fork_source"
+    print(f"[BENCH] Filling {source} with {args.points} points")
+    document_ids = fill_source(rag_pipeline, source, args.points, args.documents, QDRANT_VECTOR_SIZE, args.seed)
+    client = rag_pipeline.get_qdrant_client()
+
+    print(f"{'batch':>6} {'points':>8} {'seconds':>8} {'points/s':>10}")
+    for batch_size in args.batch_sizes:
+        target = f"bench_fork_target_{batch_size}"
+        if client.collection_exists(target):
+            client.delete_collection(target)
+        document_id_map = {d: str(uuid.uuid4()) for d in document_ids}
+        start = time.perf_counter()
+        copied = rag_pipeline.copy_collection_points(source, target, document_id_map, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        assert client.count(target).count == args.points, "Thiếu point sau khi copy"
+        print(f"{batch_size:>6} {copied:>8} {elapsed:>8.2f} {copied / elapsed:>10.0f}")
+        if not args.keep:
+            client.delete_collection(target)
+    if not args.keep:
+        client.delete_collection(source)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Mô phỏng hedged LLM requests với phân phối latency đuôi dài (StubLLM + latency_fn).
+
+Phần lớn lời gọi lấy latency lognormal quanh `--median-ms`, một tỉ lệ `--tail-prob` rơi vào đuôi
+chậm gấp `--tail-factor` lần. Chạy cùng một tải với hedging tắt/bật qua LLMScheduler + HedgedInvoker
+thật và báo cáo p50/p95/p99, tỉ lệ hedge, win rate và chi phí (số lời gọi upstream tăng thêm).
+
+Ví dụ (chạy từ thư mục gốc repo):
+    python -m benchmarks.hedging_sim --calls 400 --concurrency 8 --tail-prob 0.05 --tail-factor 8
+"""
+import argparse
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(sorted_values, q):
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def make_latency_fn(median_ms, sigma, tail_prob, tail_factor, seed):
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def latency():
+        with lock:
+            base = median_ms / 1000 * rng.lognormvariate(0, sigma)
+            return base * tail_factor if rng.random() < tail_prob else base
+    return latency
+
+
+def run(hedging, args):
+    from prometheus_client import REGISTRY
+    from backend.llm_hedging import HedgedInvoker, LLMTimeout
+    from backend.llm_scheduler import LLMScheduler
+    from backend.stubs import StubLLM
+
+    def counter(name, labels):
+        return REGISTRY.get_sample_value(name, labels) or 0.0
+
+    before = {r: counter("rag_llm_hedges_total", {"result": r}) for r in ("won", "lost")}
+    llm = StubLLM(latency_fn=make_latency_fn(args.median_ms, args.sigma, args.tail_prob, args.tail_factor, args.seed))
+    scheduler = LLMScheduler(max_concurrency=args.concurrency * 2, tokens_per_minute=0,
+                             max_queue_seconds=60, max_queue_depth=10_000, max_queued_per_session=10_000)
+    invoker = HedgedInvoker(scheduler, timeout=args.timeout, hedging=hedging, percentile=args.percentile,
+                            max_rate=args.max_rate, min_delay_ms=0)
+
+    def call(i):
+        ticket = scheduler.acquire(f"s{i % args.concurrency}", "answer", 100)
+        t0 = time.perf_counter()
+        try:
+            invoker.invoke(lambda: llm.invoke(f"prompt {i}"), ticket, "answer", f"s{i}", 100)
+        except LLMTimeout:
+            pass
+        return time.perf_counter() - t0
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        latencies = sorted(pool.map(call, range(args.calls)))
+    invoker._executor.shutdown(wait=True)  # đợi các lời gọi thua chạy xong để đếm đủ chi phí
+    won = counter("rag_llm_hedges_total", {"result": "won"}) - before["won"]
+    lost = counter("rag_llm_hedges_total", {"result": "lost"}) - before["lost"]
+    return {
+        "hedging": hedging,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "upstream_calls": llm.calls,
+        "overhead": llm.calls / args.calls - 1,
+        "hedges": won + lost,
+        "win_rate": won / (won + lost) if won + lost else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--median-ms", type=float, default=200)
+    parser.add_argument("--sigma", type=float, default=0.25)
+    parser.add_argument("--tail-prob", type=float, default=0.05)
+    parser.add_argument("--tail-factor", type=float, default=8)
+    parser.add_argument("--percentile", type=float, default=95)
+    parser.add_argument("--max-rate", type=float, default=0.1)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ.setdefault("LLM_PROVIDER", "stub")
+    rows = [run(False, args), run(True, args)]
+    print(f"{'hedging':>8} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'upstream':>9} {'overhead':>9} {'hedges':>7} {'win':>6}")
+    for r in rows:
+        print(f"{str(r['hedging']):>8} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} "
+              f"{r['upstream_calls']:>9} {r['overhead']:>9.1%} {r['hedges']:>7.0f} {r['win_rate']:>6.1%}")
+
+
+if __name__ == "__main__":
+    main()
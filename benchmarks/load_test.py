@@ -0,0 +1,212 @@
+"""Load test offline cho FastAPI backend.
+
+Boot app in-process với stub LLM (latency/token rate cấu hình được), stub embedding,
+Qdrant in-memory và Redis giả lập (fakeredis, hoặc Redis local qua --redis-url),
+rồi bắn /chat, /batch_query, /upload_doc, /history ở mức concurrency cấu hình được.
+Báo cáo p50/p95/p99, throughput, error rate theo endpoint và lưu JSON để so sánh giữa các lần chạy.
+
+Ví dụ (chạy từ thư mục gốc repo):
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.load_test --concurrency 16 --requests 200 --llm-latency-ms 500
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import time
+from datetime import datetime
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+ENDPOINTS = ["upload_doc", "chat", "batch_query", "history"]
+
+CORPUS = """Tấm Cám là một truyện cổ tích Việt Nam thuộc thể loại truyện cổ tích thần kỳ.
+Tấm mồ côi mẹ từ nhỏ, sống với dì ghẻ là mẹ của Cám. Tấm phải làm lụng vất vả suốt ngày,
+còn Cám được mẹ nuông chiều. Một hôm dì ghẻ sai hai chị em đi bắt tép, hứa ai bắt được nhiều
+sẽ thưởng cho một cái yếm đỏ. Tấm chăm chỉ bắt đầy giỏ, còn Cám mải chơi nên lừa Tấm gội đầu
+rồi trút hết tép của Tấm vào giỏ mình. Tấm khóc, Bụt hiện lên giúp đỡ và cho Tấm con cá bống.
+Về sau nhờ chiếc hài rơi, Tấm trở thành hoàng hậu. Mẹ con Cám ghen ghét tìm cách hãm hại Tấm,
+Tấm hóa thân thành chim vàng anh, cây xoan đào, khung cửi và quả thị rồi trở lại làm người.
+Truyện thể hiện ước mơ của nhân dân về công lý, cái thiện chiến thắng cái ác.
+Thánh Gióng là truyện truyền thuyết về người anh hùng làng Gióng thời Hùng Vương thứ sáu.
+Lên ba tuổi Gióng vẫn không biết nói cười, nhưng khi nghe sứ giả tìm người đánh giặc Ân thì
+cất tiếng nói, xin vua làm ngựa sắt, roi sắt, áo giáp sắt. Gióng vươn vai thành tráng sĩ,
+cưỡi ngựa sắt đánh tan giặc rồi bay về trời. Truyện ca ngợi tinh thần yêu nước chống giặc ngoại xâm.
+"""
+
+QUESTIONS = [
+    "Tấm là ai?",
+    "Ai đã trút hết tép của Tấm vào giỏ mình?",
+    "Bụt cho Tấm con vật gì?",
+    "Tấm hóa thân thành những gì?",
+    "Truyện Tấm Cám thể hiện ước mơ gì của nhân dân?",
+    "Thánh Gióng sống vào thời vua Hùng thứ mấy?",
+    "Gióng xin vua những gì để đánh giặc?",
+    "Tài liệu này là về vấn đề gì?",
+]
+
+
+def configure_environment(args):
+    """Đặt env trước khi import backend để rag_pipeline khởi tạo stub thay vì Gemini/HF/Qdrant Cloud"""
+    os.environ["LLM_PROVIDER"] = "stub"
+    os.environ["EMBEDDING_PROVIDER"] = "stub"
+    os.environ["QDRANT_URL"] = ":memory:"
+    os.environ["QDRANT_COLLECTION_NAME"] = "bench_shared"
+    os.environ["STUB_LLM_LATENCY_MS"] = str(args.llm_latency_ms)
+    os.environ["STUB_LLM_JITTER"] = str(args.llm_jitter)
+    os.environ["STUB_LLM_TOKENS_PER_SECOND"] = str(args.llm_tps)
+    os.environ["STUB_LLM_OUTPUT_TOKENS"] = str(args.llm_output_tokens)
+    os.environ["STUB_EMBEDDING_LATENCY_MS"] = str(args.embedding_latency_ms)
+    if args.redis_url:
+        os.environ["REDIS_URL"] = args.redis_url
+
+
+def load_app(args):
+    configure_environment(args)
+    from backend import db, main, rag_pipeline
+
+    if not args.redis_url:
+        import fakeredis
+        server = fakeredis.FakeServer()
+        db.redis_client = fakeredis.FakeRedis(server=server, decode_responses=True)
+        main.redis_client = fakeredis.FakeRedis(server=server)
+
+    # Collection dùng chung cho /batch_query của session chưa có tài liệu (search trên QDRANT_COLLECTION_NAME)
+    from langchain.docstore.document import Document
+    rag_pipeline.ingest_documents([Document(page_content=CORPUS, metadata={"source": "bench_corpus.txt"})])
+    return main.app
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    # nearest-rank
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, wall_time):
+    values = sorted(latencies)
+    total = len(values)
+    return {
+        "requests": total,
+        "errors": errors,
+        "error_rate": errors / total if total else 0,
+        "throughput_rps": total / wall_time if wall_time else 0,
+        "wall_time_s": wall_time,
+        "mean_s": sum(values) / total if total else None,
+        "p50_s": percentile(values, 50),
+        "p95_s": percentile(values, 95),
+        "p99_s": percentile(values, 99),
+        "max_s": values[-1] if values else None,
+    }
+
+
+async def run_endpoint(client, make_request, num_requests, concurrency):
+    latencies = []
+    errors = 0
+    counter = iter(range(num_requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            t0 = time.perf_counter()
+            try:
+                response = await make_request(client, i)
+                if response.status_code >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - t0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def run(args):
+    import httpx
+
+    app = load_app(args)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        sessions = []
+        for _ in range(args.sessions):
+            response = await client.post("/session")
+            sessions.append(response.json()["session_id"])
+
+        async def upload(client, i):
+            return await client.post(
+                "/upload_doc",
+                data={"session_id": sessions[i % len(sessions)]},
+                files=[("files", (f"bench_{i}.txt", CORPUS.encode(), "text/plain"))],
+            )
+
+        async def chat(client, i):
+            return await client.post("/chat", json={
+                "question": QUESTIONS[i % len(QUESTIONS)],
+                "session_id": sessions[i % len(sessions)],
+            })
+
+        async def batch_query(client, i):
+            return await client.post("/batch_query", json={
+                "queries": [QUESTIONS[(i + j) % len(QUESTIONS)] for j in range(args.batch_size)],
+                "session_id": sessions[i % len(sessions)],
+            })
+
+        async def history(client, i):
+            return await client.get("/history", params={"session_id": sessions[i % len(sessions)]})
+
+        handlers = {"upload_doc": upload, "chat": chat, "batch_query": batch_query, "history": history}
+        results = {}
+        for name in args.endpoints:
+            # mặc định upload mỗi session 1 lần để /chat có dữ liệu
+            num_requests = (args.upload_requests or len(sessions)) if name == "upload_doc" else args.requests
+            print(f"[BENCH] {name}: {num_requests} requests, concurrency={args.concurrency}")
+            results[name] = await run_endpoint(client, handlers[name], num_requests, args.concurrency)
+            print(f"[BENCH] {name}: {json.dumps(results[name])}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", nargs="+", default=ENDPOINTS, choices=ENDPOINTS)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="Số request mỗi endpoint")
+    parser.add_argument("--upload-requests", type=int, default=None, help="Số request /upload_doc (mặc định = số session)")
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=5, help="Số câu hỏi mỗi /batch_query")
+    parser.add_argument("--llm-latency-ms", type=float, default=800)
+    parser.add_argument("--llm-jitter", type=float, default=0.3)
+    parser.add_argument("--llm-tps", type=float, default=200, help="Tokens/giây của stub LLM")
+    parser.add_argument("--llm-output-tokens", type=int, default=60)
+    parser.add_argument("--embedding-latency-ms", type=float, default=0)
+    parser.add_argument("--redis-url", help="Dùng Redis local thật thay cho fakeredis")
+    parser.add_argument("--output", help="File JSON kết quả (mặc định benchmarks/results/load_test_<timestamp>.json)")
+    args = parser.parse_args()
+    # upload_doc luôn chạy đầu tiên để /chat có dữ liệu
+    args.endpoints = sorted(set(args.endpoints), key=ENDPOINTS.index)
+
+    results = asyncio.run(run(args))
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"load_test_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(f"\n{'endpoint':<12} {'req':>6} {'err%':>6} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for name, r in results.items():
+        print(f"{name:<12} {r['requests']:>6} {r['error_rate'] * 100:>5.1f}% {r['throughput_rps']:>8.2f} "
+              f"{r['p50_s'] or 0:>8.3f} {r['p95_s'] or 0:>8.3f} {r['p99_s'] or 0:>8.3f}")
+    print(f"\nSaved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
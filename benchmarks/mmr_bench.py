@@ -0,0 +1,92 @@
+"""Đo overhead của bước chọn MMR theo số candidate (50-500), NumPy vs. vòng lặp Python theo cặp.
+
+Candidate là các vector ngẫu nhiên có cụm (mô phỏng nhiều chunk gần giống nhau từ các trang liên tiếp),
+dim mặc định bằng QDRANT_VECTOR_SIZE. Cả hai cách phải chọn cùng các index; báo cáo thời gian trung
+bình mỗi lần chọn (ms). Không cần Qdrant hay model embedding.
+
+Ví dụ (chạy từ thư mục gốc repo):
+    python -m benchmarks.mmr_bench --candidates 50,100,200,500 --k 3
+"""
+import argparse
+import time
+
+import numpy as np
+
+
+def parse_ints(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def make_candidates(n, dim, clusters, rng):
+    """n vector quanh `clusters` tâm cụm, cùng một query gần vài cụm đầu"""
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, n)
+    candidates = centers[labels] + 0.3 * rng.standard_normal((n, dim)).astype(np.float32)
+    query = centers[:3].mean(axis=0) + 0.3 * rng.standard_normal(dim).astype(np.float32)
+    return query, candidates
+
+
+def python_mmr(query_vector, candidate_vectors, k, lambda_mult):
+    """Cách viết bằng vòng lặp Python: cosine từng cặp candidate/đã chọn ở mỗi bước"""
+    def cosine(a, b):
+        dot = sum(x * y for x, y in zip(a, b))
+        norm_a = sum(x * x for x in a) ** 0.5
+        norm_b = sum(y * y for y in b) ** 0.5
+        return dot / (norm_a * norm_b) if norm_a and norm_b else 0.0
+
+    relevance = [cosine(query_vector, c) for c in candidate_vectors]
+    selected = []
+    remaining = list(range(len(candidate_vectors)))
+    while remaining and len(selected) < k:
+        def score(i):
+            redundancy = max((cosine(candidate_vectors[i], candidate_vectors[j]) for j in selected), default=0.0)
+            return lambda_mult * relevance[i] - (1 - lambda_mult) * redundancy
+        best = max(remaining, key=score)
+        selected.append(best)
+        remaining.remove(best)
+    return selected
+
+
+def time_per_call(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--candidates", type=parse_ints, default=[50, 100, 200, 500])
+    parser.add_argument("--k", type=int, default=None, help="Số chunk chọn (mặc định TOP_K)")
+    parser.add_argument("--dim", type=int, default=None, help="Số chiều vector (mặc định QDRANT_VECTOR_SIZE)")
+    parser.add_argument("--lambda-mult", type=float, default=None, help="Mặc định MMR_LAMBDA")
+    parser.add_argument("--clusters", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--skip-python", action="store_true", help="Không đo cách vòng lặp Python (chậm ở 500)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from backend.config import MMR_LAMBDA, QDRANT_VECTOR_SIZE, TOP_K
+    from backend.mmr import mmr_select
+
+    k = args.k or TOP_K
+    dim = args.dim or QDRANT_VECTOR_SIZE
+    lambda_mult = MMR_LAMBDA if args.lambda_mult is None else args.lambda_mult
+    rng = np.random.default_rng(args.seed)
+
+    print(f"k={k} dim={dim} lambda={lambda_mult}")
+    print(f"{'candidates':>10} {'numpy_ms':>9} {'python_ms':>10} {'speedup':>8} {'same':>5}")
+    for n in args.candidates:
+        query, candidates = make_candidates(n, dim, args.clusters, rng)
+        numpy_ms, selected = time_per_call(lambda: mmr_select(query, candidates, k, lambda_mult), args.repeat)
+        if args.skip_python:
+            print(f"{n:>10} {numpy_ms:>9.3f} {'-':>10} {'-':>8} {'-':>5}")
+            continue
+        query_list, candidate_lists = query.tolist(), candidates.tolist()
+        python_ms, expected = time_per_call(
+            lambda: python_mmr(query_list, candidate_lists, k, lambda_mult), max(1, args.repeat // 10))
+        print(f"{n:>10} {numpy_ms:>9.3f} {python_ms:>10.2f} {python_ms / numpy_ms:>7.0f}x {str(selected == expected):>5}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""So sánh dung lượng text payload và latency giải nén mỗi lần search: không nén, zstd, zstd + dictionary.
+
+Chunk lấy từ corpus benchmarks/data/retrieval_vi.json cộng passage nhiễu sinh từ chính corpus (giống
+retrieval_bench). Dung lượng tính theo JSON payload (text nén được lưu dạng base64). Latency giải nén đo
+qua `payload_text` thật với `--k` chunk ngẫu nhiên mỗi "search". Dùng fakeredis cho dictionary, không cần
+Qdrant hay Redis.
+
+Ví dụ (chạy từ thư mục gốc repo):
+    python -m benchmarks.payload_compression_bench --distractors 5000 --levels 3,9,19
+"""
+import argparse
+import json
+import math
+import random
+import time
+
+from benchmarks.retrieval_bench import DATA_PATH, make_distractors
+
+
+def parse_ints(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def percentile(sorted_values, q):
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def payload_bytes(payloads):
+    return sum(len(json.dumps(p, ensure_ascii=False).encode("utf-8")) for p in payloads)
+
+
+def decode_latency(payloads, k, searches, rng, payload_text):
+    """Thời gian giải nén k payload của một lần search (µs)"""
+    samples = []
+    for _ in range(searches):
+        hits = rng.sample(payloads, k)
+        start = time.perf_counter()
+        for payload in hits:
+            payload_text(payload)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return sorted(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=DATA_PATH)
+    parser.add_argument("--distractors", type=int, default=5000)
+    parser.add_argument("--levels", type=parse_ints, default=[3, 9, 19])
+    parser.add_argument("--dict-size", type=int, default=None, help="Mặc định TEXT_DICT_SIZE")
+    parser.add_argument("--k", type=int, default=None, help="Số chunk giải nén mỗi search (mặc định TOP_K)")
+    parser.add_argument("--searches", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import fakeredis
+    from backend import db
+    db.redis_client = fakeredis.FakeRedis(decode_responses=True)
+    from backend.config import TEXT_DICT_SIZE, TOP_K
+    from backend.text_codec import TextEncoder, payload_text, train_dictionary
+
+    with open(args.data, encoding="utf-8") as f:
+        passages = json.load(f)["passages"]
+    texts = [p["text"] for p in passages + make_distractors(passages, args.distractors, args.seed)]
+    k = args.k or TOP_K
+    rng = random.Random(args.seed)
+
+    trained = train_dictionary(texts, args.dict_size or TEXT_DICT_SIZE)
+    if trained is None:
+        raise SystemExit("Không train được dictionary (thiếu zstandard hoặc quá ít chunk)")
+    dict_id, dict_data = trained
+    db.save_dictionary(dict_id, dict_data)
+
+    raw = [TextEncoder().encode(t) for t in texts]
+    raw_bytes = payload_bytes(raw)
+    print(f"{len(texts)} chunks, dictionary {len(dict_data)} bytes, k={k}")
+    print(f"{'codec':>14} {'level':>5} {'payload_mb':>11} {'ratio':>6} {'saved_mb':>9} {'p50_us':>8} {'p95_us':>8}")
+    latencies = decode_latency(raw, k, args.searches, rng, payload_text)
+    print(f"{'none':>14} {'-':>5} {raw_bytes / 1e6:>11.2f} {1.0:>6.2f} {0.0:>9.2f} "
+          f"{percentile(latencies, 50):>8.1f} {percentile(latencies, 95):>8.1f}")
+    for level in args.levels:
+        for name, encoder in (("zstd", TextEncoder("zstd", level=level)),
+                              ("zstd+dict", TextEncoder("zstd", dict_id, dict_data, level=level))):
+            payloads = [encoder.encode(t) for t in texts]
+            size = payload_bytes(payloads) + (len(dict_data) if encoder.dict_id else 0)
+            latencies = decode_latency(payloads, k, args.searches, rng, payload_text)
+            print(f"{name:>14} {level:>5} {size / 1e6:>11.2f} {raw_bytes / size:>6.2f} {(raw_bytes - size) / 1e6:>9.2f} "
+                  f"{percentile(latencies, 50):>8.1f} {percentile(latencies, 95):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""Benchmark latency/recall của retrieval với sweep tham số HNSW.
+
+Ingest corpus tiếng Việt cố định (benchmarks/data/retrieval_vi.json, có nhãn query -> passage liên quan),
+thêm passage nhiễu để tăng kích thước collection, rồi sweep `m`, `ef_construct`, `hnsw_ef`,
+exact vs. approximate và k qua `get_retriever_for_collection`/`DebugRetriever`.
+Báo cáo recall@k, MRR, độ trùng với exact search và p50/p95 latency search.
+
+Cần một Qdrant server thật (Qdrant local mode ":memory:" luôn brute-force, không dùng HNSW):
+    docker run -p 6333:6333 qdrant/qdrant
+    QDRANT_URL=http://localhost:6333 python -m benchmarks.retrieval_bench --distractors 20000
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import math
+import os
+import random
+import time
+from datetime import datetime
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), "data", "retrieval_vi.json")
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def parse_ints(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def make_distractors(passages, count, seed):
+    """Sinh passage nhiễu bằng cách trộn câu/từ của corpus để collection đủ lớn cho HNSW có tác dụng"""
+    rng = random.Random(seed)
+    words = [w for p in passages for w in p["text"].split()]
+    return [
+        {"id": f"distractor_{i}", "text": " ".join(rng.choice(words) for _ in range(rng.randint(20, 60)))}
+        for i in range(count)
+    ]
+
+
+def percentile(sorted_values, q):
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def ingest(rag_pipeline, collection_name, passages, vectors, m, ef_construct):
+    from qdrant_client.models import CollectionStatus, HnswConfigDiff, OptimizersConfigDiff, PointStruct
+
+    client = rag_pipeline.qdrant_client
+    if client.collection_exists(collection_name):
+        client.delete_collection(collection_name)
+    # full_scan_threshold/indexing_threshold nhỏ để Qdrant thực sự build và dùng HNSW cho corpus benchmark
+    rag_pipeline.create_collection_if_not_exists(
+        collection_name,
+        hnsw_config=HnswConfigDiff(m=m, ef_construct=ef_construct, full_scan_threshold=10),
+    )
+    client.update_collection(collection_name, optimizer_config=OptimizersConfigDiff(indexing_threshold=10))
+    points = [
+        PointStruct(
+            id=i,
+            vector=vector,
+            payload={"text": p["text"], "metadata": {"passage_id": p["id"]}, "chunk_id": i},
+        )
+        for i, (p, vector) in enumerate(zip(passages, vectors))
+    ]
+    for i in range(0, len(points), rag_pipeline.QDRANT_BATCH_SIZE):
+        client.upsert(collection_name=collection_name, points=points[i:i + rag_pipeline.QDRANT_BATCH_SIZE])
+    # Đợi optimizer build xong index
+    while client.get_collection(collection_name).status != CollectionStatus.GREEN:
+        time.sleep(0.5)
+
+
+def evaluate(retriever, queries, query_vectors, k, repeats, exact_ids=None):
+    latencies = []
+    recall_sum = 0.0
+    rr_sum = 0.0
+    overlap_sum = 0.0
+    result_ids = []
+    for query, vector in zip(queries, query_vectors):
+        ids = []
+        for _ in range(repeats):
+            # DebugRetriever log từng kết quả; bỏ log để không tính vào latency
+            with contextlib.redirect_stdout(io.StringIO()):
+                t0 = time.perf_counter()
+                docs = retriever.search_by_vector(vector)
+                latencies.append(time.perf_counter() - t0)
+            ids = [doc.metadata.get("passage_id") for doc in docs]
+        result_ids.append(ids)
+        relevant = set(query["relevant"])
+        recall_sum += len(relevant & set(ids[:k])) / len(relevant)
+        rr_sum += next((1 / (rank + 1) for rank, pid in enumerate(ids[:k]) if pid in relevant), 0)
+    if exact_ids is not None:
+        for ids, truth in zip(result_ids, exact_ids):
+            overlap_sum += len(set(ids[:k]) & set(truth[:k])) / max(len(truth[:k]), 1)
+    latencies.sort()
+    n = len(queries)
+    return {
+        "recall@k": recall_sum / n,
+        "mrr": rr_sum / n,
+        "exact_overlap@k": overlap_sum / n if exact_ids is not None else 1.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+    }, result_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=DATA_PATH)
+    parser.add_argument("--distractors", type=int, default=5000, help="Số passage nhiễu thêm vào collection")
+    parser.add_argument("--m", type=parse_ints, default=[8, 16, 32])
+    parser.add_argument("--ef-construct", type=parse_ints, default=[64, 128])
+    parser.add_argument("--hnsw-ef", type=parse_ints, default=[16, 32, 64, 128])
+    parser.add_argument("--k", type=parse_ints, default=[3, 5, 10])
+    parser.add_argument("--repeats", type=int, default=3, help="Số lần search lặp lại mỗi query")
+    parser.add_argument("--stub-embeddings", action="store_true", help="Dùng StubEmbeddings thay cho bi-encoder")
+    parser.add_argument("--keep", action="store_true", help="Giữ lại các collection benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    if args.stub_embeddings:
+        os.environ["EMBEDDING_PROVIDER"] = "stub"
+    os.environ.setdefault("LLM_PROVIDER", "stub")
+    from qdrant_client.models import SearchParams
+    from backend import rag_pipeline
+
+    with open(args.data, encoding="utf-8") as f:
+        data = json.load(f)
+    passages = data["passages"] + make_distractors(data["passages"], args.distractors, args.seed)
+    queries = data["queries"]
+
+    print(f"[BENCH] Embedding {len(passages)} passages, {len(queries)} queries")
+    passage_vectors = rag_pipeline.embedding.embed_documents([p["text"] for p in passages])
+    query_vectors = [rag_pipeline.embedding.embed_query(q["query"]) for q in queries]
+
+    rows = []
+    for m, ef_construct in itertools.product(args.m, args.ef_construct):
+        collection_name = f"bench_hnsw_m{m}_efc{ef_construct}"
+        t0 = time.perf_counter()
+        ingest(rag_pipeline, collection_name, passages, passage_vectors, m, ef_construct)
+        build_time = time.perf_counter() - t0
+        print(f"[BENCH] {collection_name}: ingest + index {build_time:.1f}s")
+
+        for k in args.k:
+            exact = rag_pipeline.get_retriever_for_collection(
+                collection_name, k=k, search_params=SearchParams(exact=True), mmr=False)
+            exact_metrics, exact_ids = evaluate(exact, queries, query_vectors, k, args.repeats)
+            rows.append({"m": m, "ef_construct": ef_construct, "search": "exact", "hnsw_ef": None, "k": k,
+                         "build_s": build_time, **exact_metrics})
+            for hnsw_ef in args.hnsw_ef:
+                approx = rag_pipeline.get_retriever_for_collection(
+                    collection_name, k=k, search_params=SearchParams(hnsw_ef=hnsw_ef), mmr=False)
+                metrics, _ = evaluate(approx, queries, query_vectors, k, args.repeats, exact_ids=exact_ids)
+                rows.append({"m": m, "ef_construct": ef_construct, "search": "hnsw", "hnsw_ef": hnsw_ef, "k": k,
+                             "build_s": build_time, **metrics})
+
+        if not args.keep:
+            rag_pipeline.qdrant_client.delete_collection(collection_name)
+
+    header = f"{'m':>4} {'ef_c':>5} {'search':>6} {'ef':>5} {'k':>3} {'recall@k':>9} {'mrr':>6} {'exact@k':>8} {'p50ms':>7} {'p95ms':>7}"
+    print("\n" + header)
+    for r in rows:
+        print(f"{r['m']:>4} {r['ef_construct']:>5} {r['search']:>6} {str(r['hnsw_ef'] or '-'):>5} {r['k']:>3} "
+              f"{r['recall@k']:>9.3f} {r['mrr']:>6.3f} {r['exact_overlap@k']:>8.3f} {r['p50_ms']:>7.2f} {r['p95_ms']:>7.2f}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"retrieval_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"timestamp": datetime.now().isoformat(), "config": vars(args), "num_passages": len(passages),
+                   "results": rows}, f, indent=2, ensure_ascii=False)
+    print(f"\nSaved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
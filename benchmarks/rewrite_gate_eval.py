@@ -0,0 +1,125 @@
+"""Offline evaluation cho gate/cache của bước rewrite query.
+
+Replay các hội thoại thật (lấy từ Redis `chat:*:history` hoặc file JSONL export)
+và đo tỉ lệ rewrite bị bỏ qua / trúng cache cùng latency tiết kiệm được.
+
+Ví dụ (chạy từ thư mục gốc repo):
+    python -m benchmarks.rewrite_gate_eval --export conversations.jsonl
+    python -m benchmarks.rewrite_gate_eval --input conversations.jsonl --rewrite-latency 1.5
+    python -m benchmarks.rewrite_gate_eval --input conversations.jsonl --live
+"""
+import argparse
+import json
+import statistics
+import time
+
+from backend.config import REDIS_URL, REWRITE_HISTORY_M
+from backend.rewrite_gate import needs_rewrite, rewrite_cache_key, history_to_chats
+
+SUMMARY_QUESTION = "Tóm tắt hội thoại"
+
+
+def load_from_redis(redis_url):
+    import redis
+    client = redis.Redis.from_url(redis_url, decode_responses=True)
+    conversations = []
+    for key in client.scan_iter("chat:*:history"):
+        pairs = [json.loads(item) for item in client.lrange(key, 0, -1)]
+        conversations.append({"session_id": key.split(":")[1], "history": pairs})
+    return conversations
+
+
+def load_from_file(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def replay(conversations, rewrite_latency, live=False):
+    llm_rewrite_query = None
+    if live:
+        from backend.main import llm_rewrite_query
+
+    cache = {}
+    counts = {"turns": 0, "skipped": 0, "cached": 0, "llm": 0}
+    reasons = {}
+    gate_times = []
+    llm_latencies = []
+    disagreements = 0
+    for conv in conversations:
+        pairs = [p for p in conv["history"] if p.get("question") != SUMMARY_QUESTION]
+        for i in range(1, len(pairs)):
+            question = pairs[i]["question"]
+            history = history_to_chats(pairs[max(0, i - REWRITE_HISTORY_M):i])
+            counts["turns"] += 1
+
+            t0 = time.perf_counter()
+            need, reason = needs_rewrite(question, history)
+            key = rewrite_cache_key(question, history)
+            gate_times.append(time.perf_counter() - t0)
+            reasons[reason] = reasons.get(reason, 0) + 1
+
+            if not need:
+                counts["skipped"] += 1
+                if live:
+                    # Đo xem LLM có thực sự đổi câu hỏi không để ước lượng false skip
+                    rewritten = llm_rewrite_query(question, history)
+                    if rewritten.strip().lower() != question.strip().lower():
+                        disagreements += 1
+                continue
+            if key in cache:
+                counts["cached"] += 1
+                continue
+            counts["llm"] += 1
+            if live:
+                t0 = time.perf_counter()
+                cache[key] = llm_rewrite_query(question, history)
+                llm_latencies.append(time.perf_counter() - t0)
+            else:
+                cache[key] = question
+
+    per_call = statistics.mean(llm_latencies) if llm_latencies else rewrite_latency
+    turns = max(counts["turns"], 1)
+    avoided = counts["skipped"] + counts["cached"]
+    return {
+        "conversations": len(conversations),
+        **counts,
+        "skip_rate": counts["skipped"] / turns,
+        "cache_rate": counts["cached"] / turns,
+        "gate_reasons": reasons,
+        "gate_overhead_us_mean": statistics.mean(gate_times) * 1e6 if gate_times else 0,
+        "rewrite_latency_s": per_call,
+        "rewrite_latency_measured": bool(llm_latencies),
+        "latency_saved_s_total": avoided * per_call,
+        "latency_saved_s_per_turn": avoided * per_call / turns,
+        "skip_disagreement_rate": disagreements / counts["skipped"] if live and counts["skipped"] else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", help="File JSONL, mỗi dòng {'session_id', 'history': [{question, answer}, ...]}")
+    parser.add_argument("--redis-url", default=REDIS_URL, help="Đọc hội thoại từ Redis nếu không có --input")
+    parser.add_argument("--export", help="Export hội thoại từ Redis ra file JSONL rồi thoát")
+    parser.add_argument("--rewrite-latency", type=float, default=1.2, help="Latency giả định của 1 lần rewrite (giây)")
+    parser.add_argument("--live", action="store_true", help="Gọi LLM thật để đo latency và tỉ lệ false skip")
+    parser.add_argument("--output", help="Lưu kết quả ra file JSON")
+    args = parser.parse_args()
+
+    if args.export:
+        conversations = load_from_redis(args.redis_url)
+        with open(args.export, "w", encoding="utf-8") as f:
+            for conv in conversations:
+                f.write(json.dumps(conv, ensure_ascii=False) + "\n")
+        print(f"Exported {len(conversations)} conversations to {args.export}")
+        return
+
+    conversations = load_from_file(args.input) if args.input else load_from_redis(args.redis_url)
+    result = replay(conversations, args.rewrite_latency, live=args.live)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
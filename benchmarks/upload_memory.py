@@ -0,0 +1,91 @@
+"""Kiểm tra peak memory khi lưu file upload: stream theo chunk vs. đọc cả file (`await file.read()`).
+
+Tạo file upload giả (SpooledTemporaryFile đã nằm trên đĩa, giống Starlette sau khi parse multipart)
+với nhiều kích thước, đo peak memory Python (tracemalloc) của `save_upload_to_disk`.
+Peak phải gần như không đổi theo kích thước file; script trả exit code 1 nếu không.
+
+Ví dụ (chạy từ thư mục gốc repo):
+    python -m benchmarks.upload_memory --sizes-mb 1,16,64,256
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import sys
+import tempfile
+import tracemalloc
+
+MB = 1024 * 1024
+
+
+def parse_ints(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def make_upload(size_mb):
+    from starlette.datastructures import UploadFile
+
+    spooled = tempfile.SpooledTemporaryFile(max_size=MB)
+    digest = hashlib.sha256()
+    block = os.urandom(MB)
+    for _ in range(size_mb):
+        spooled.write(block)
+        digest.update(block)
+    spooled.seek(0)
+    return UploadFile(file=spooled, filename=f"sample_{size_mb}mb.pdf"), digest.hexdigest()
+
+
+async def read_all(upload):
+    """Cách cũ: đọc toàn bộ file vào RAM rồi ghi ra temp file"""
+    content = await upload.read()
+    with tempfile.NamedTemporaryFile(delete=True) as tmp:
+        tmp.write(content)
+    return len(content)
+
+
+def measure(coro_fn, upload):
+    tracemalloc.start()
+    try:
+        result = asyncio.run(coro_fn(upload))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-mb", type=parse_ints, default=[1, 16, 64, 256])
+    parser.add_argument("--skip-baseline", action="store_true", help="Không đo cách đọc cả file vào RAM")
+    args = parser.parse_args()
+
+    from backend.config import UPLOAD_CHUNK_SIZE
+    from backend.uploads import save_upload_to_disk, remove_temp_files
+
+    peaks = []
+    print(f"{'size_mb':>8} {'stream_peak_mb':>15} {'read_all_peak_mb':>17}")
+    for size_mb in args.sizes_mb:
+        upload, expected_hash = make_upload(size_mb)
+        (path, size, content_hash), peak = measure(
+            lambda f: save_upload_to_disk(f, max_bytes=(size_mb + 1) * MB), upload)
+        remove_temp_files([path])
+        assert size == size_mb * MB and content_hash == expected_hash, "Sai kích thước hoặc hash"
+        peaks.append(peak)
+
+        baseline = "-"
+        if not args.skip_baseline:
+            upload, _ = make_upload(size_mb)
+            _, baseline_peak = measure(read_all, upload)
+            baseline = f"{baseline_peak / MB:.2f}"
+        print(f"{size_mb:>8} {peak / MB:>15.2f} {baseline:>17}")
+
+    # Peak khi stream chỉ phụ thuộc chunk size, không phụ thuộc kích thước file
+    limit = 4 * UPLOAD_CHUNK_SIZE
+    if max(peaks) > limit:
+        print(f"[FAIL] Stream peak {max(peaks) / MB:.2f}MB vượt {limit / MB:.2f}MB")
+        sys.exit(1)
+    print(f"[OK] Stream peak <= {limit / MB:.2f}MB với mọi kích thước file")
+
+
+if __name__ == "__main__":
+    main()
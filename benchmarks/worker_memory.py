@@ -0,0 +1,136 @@
+"""Đo bộ nhớ (RSS/PSS) của từng uvicorn worker: model load trong mỗi worker vs. embedding sidecar.
+
+Với mỗi chế độ, script khởi động `uvicorn backend.main:app --workers N` (chế độ `remote` chạy thêm
+`python -m backend.embedding_service`), chờ tổng RSS ổn định sau warmup rồi đọc /proc của
+từng process. PSS chia đều các page dùng chung nên phản ánh đúng chi phí thực tế mỗi worker.
+Chỉ chạy trên Linux, cần Redis/Qdrant như khi chạy backend bình thường.
+
+Ví dụ (chạy từ thư mục gốc repo):
+    python -m benchmarks.worker_memory --workers 4 --modes local,remote
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def read_memory_kb(pid):
+    """RSS và PSS (kB) của một process, đọc từ /proc"""
+    memory = {"rss_kb": 0, "pss_kb": 0}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                memory["rss_kb"] = int(line.split()[1])
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    memory["pss_kb"] = int(line.split()[1])
+    except FileNotFoundError:
+        pass
+    return memory
+
+
+def child_pids(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except FileNotFoundError:
+        return []
+
+
+def wait_until_stable(pids_fn, interval, rounds, timeout):
+    """Chờ tới khi tổng RSS thay đổi < 1% trong `rounds` lần đo liên tiếp"""
+    deadline = time.monotonic() + timeout
+    previous, stable = None, 0
+    while time.monotonic() < deadline:
+        time.sleep(interval)
+        total = sum(read_memory_kb(pid)["rss_kb"] for pid in pids_fn())
+        if previous and abs(total - previous) < previous * 0.01:
+            stable += 1
+            if stable >= rounds:
+                return
+        else:
+            stable = 0
+        previous = total
+
+
+def measure_mode(mode, args):
+    env = dict(os.environ, WARMUP_ON_STARTUP="true")
+    sidecar = None
+    if mode == "remote":
+        env["EMBEDDING_PROVIDER"] = "remote"
+        env["EMBEDDING_SOCKET_PATH"] = args.socket
+        sidecar = subprocess.Popen(
+            [sys.executable, "-m", "backend.embedding_service", "--socket", args.socket, "--provider", args.provider],
+            env=env,
+        )
+    else:
+        env["EMBEDDING_PROVIDER"] = args.provider
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--workers", str(args.workers), "--port", str(args.port)],
+        env=env,
+    )
+
+    def pids():
+        return [server.pid, *child_pids(server.pid)] + ([sidecar.pid] if sidecar else [])
+
+    try:
+        wait_until_stable(pids, args.interval, args.stable_rounds, args.timeout)
+        workers = [{"pid": pid, **read_memory_kb(pid)} for pid in child_pids(server.pid)]
+        # uvicorn còn một process resource tracker của multiprocessing -> bỏ qua process nhỏ
+        workers = [w for w in workers if w["rss_kb"] > 50 * 1024]
+        result = {"mode": mode, "workers": workers}
+        if sidecar:
+            result["sidecar"] = {"pid": sidecar.pid, **read_memory_kb(sidecar.pid)}
+        total_pss = sum(w["pss_kb"] for w in workers) + (result["sidecar"]["pss_kb"] if sidecar else 0)
+        result["total_pss_mb"] = total_pss / 1024
+        return result
+    finally:
+        server.send_signal(signal.SIGINT)
+        server.wait(timeout=30)
+        if sidecar:
+            sidecar.send_signal(signal.SIGINT)
+            sidecar.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--modes", default="local,remote", help="local (model trong mỗi worker) | remote (sidecar)")
+    parser.add_argument("--provider", default="huggingface", help="Backend embedding thật: huggingface | onnx")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", default="/tmp/rag_embedding_bench.sock")
+    parser.add_argument("--interval", type=float, default=2.0)
+    parser.add_argument("--stable-rounds", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    results = []
+    for mode in args.modes.split(","):
+        result = measure_mode(mode, args)
+        results.append(result)
+        for w in result["workers"]:
+            print(f"[MEMORY] {mode} worker pid={w['pid']}: RSS {w['rss_kb'] / 1024:.0f}MB, PSS {w['pss_kb'] / 1024:.0f}MB")
+        if "sidecar" in result:
+            s = result["sidecar"]
+            print(f"[MEMORY] {mode} sidecar pid={s['pid']}: RSS {s['rss_kb'] / 1024:.0f}MB, PSS {s['pss_kb'] / 1024:.0f}MB")
+        print(f"[MEMORY] {mode} total PSS: {result['total_pss_mb']:.0f}MB")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"worker_memory_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"timestamp": datetime.now().isoformat(), "config": vars(args), "results": results},
+                  f, indent=2, ensure_ascii=False)
+    print(f"\nSaved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
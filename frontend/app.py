@@ -257,16 +257,41 @@ def get_session_documents(session_id: str) -> List[Dict]:
         st.error(f"Error fetching documents: {e}")
         return []
 
-def get_session_history(session_id: str) -> List[Dict]:
-    """Get chat history for a session"""
+def get_session_history_page(session_id: str, limit: int = 50, before: str = None) -> Dict:
+    """Get one page of chat history (newest first) and the cursor of the next, older page.
+
+    `stale` is True when the cursor belongs to a history that was summarized/deleted since.
+    """
+    params = {"session_id": session_id, "limit": limit}
+    if before is not None:
+        params["before"] = before
     try:
-        response = requests.get(f"{API_BASE_URL}/history", params={"session_id": session_id})
+        response = requests.get(f"{API_BASE_URL}/history", params=params)
         if response.status_code == 200:
-            return response.json().get("history", [])
-        return []
+            return response.json()
+        if response.status_code == 409:
+            return {"history": [], "next_cursor": None, "total": 0, "stale": True}
     except Exception as e:
         st.error(f"Error fetching history: {e}")
-        return []
+    return {"history": [], "next_cursor": None, "total": 0}
+
+def get_session_history(session_id: str, limit: int = 50) -> List[Dict]:
+    """Get the latest chat history of a session, oldest first for rendering"""
+    return list(reversed(get_session_history_page(session_id, limit)["history"]))
+
+def get_full_session_history(session_id: str) -> List[Dict]:
+    """Walk all history pages (used for export), oldest first"""
+    chats, before = [], None
+    while True:
+        page = get_session_history_page(session_id, limit=200, before=before)
+        if page.get("stale"):
+            # History was summarized while paging: start over from the newest page
+            chats, before = [], None
+            continue
+        chats.extend(page["history"])
+        before = page.get("next_cursor")
+        if before is None:
+            return list(reversed(chats))
 
 def upload_documents(session_id: str, files) -> bool:
     """Upload documents to a session"""
@@ -490,7 +515,7 @@ def main():
     if st.session_state.current_session:
         session_id = st.session_state.current_session
         session_info = get_session_info(session_id)
-        chat_history_1 = get_session_history(session_id)
+        history_page = get_session_history_page(session_id, limit=1)
         documents_1 = get_session_documents(session_id)
         
         if not session_info:
@@ -510,7 +535,7 @@ def main():
                 <h1 class="header-title">Session: {session_id[:12]}...</h1>
                 <div class="header-stats">
                     <span class="stat-item">🔗 {session_info.get('status', 'active').title()}</span>
-                    <span class="stat-item">💬 {len(chat_history_1)}</span>
+                    <span class="stat-item">💬 {history_page.get("total", 0)}</span>
                     <span class="stat-item">📄 {len(documents_1)}</span>
                 </div>
             </div>
@@ -622,7 +647,7 @@ def main():
                         export_data = {
                             "session_id": session_id,
                             "exported_at": datetime.now().isoformat(),
-                            "messages": chat_history
+                            "messages": get_full_session_history(session_id)
                         }
                         st.download_button(
                             "📥 Download JSON",
@@ -731,7 +756,7 @@ def main():
             col1, col2, col3 = st.columns(3)
             
             with col1:
-                total_messages = len(chat_history)
+                total_messages = history_page.get("total", len(chat_history))
                 st.markdown(f'''
                 <div class="metric-card">
                     <div class="metric-icon">💬</div>